@@ -0,0 +1,121 @@
+"""
+Cold start benchmarks: how long a fresh interpreter takes to import the app, and how much slower the first /verify
+request is than the ones after it. Each run uses a new process, so nothing is shared between runs. Run from the
+repository root with:
+
+    python -m benchmarks.startup                 # time imports and the first request
+    python -m benchmarks.startup --top 15        # also list the slowest modules to import
+    python -m benchmarks.startup --no-warmup     # serve the first request without the startup warm-up
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+APP_MODULE = "fia_auth.fia_auth"
+RUNS = 5
+REQUESTS = 200
+
+# Run in a fresh interpreter. The app is served in process, without the database or UOWS, so only the signing and
+# routes steps of the startup warm-up apply
+FIRST_REQUEST_SCRIPT = """
+import asyncio, json, logging, statistics, time, warnings
+logging.disable(logging.CRITICAL)
+warnings.simplefilter("ignore")
+import httpx
+from benchmarks.suite import USER_NUMBER, _configure_offline
+from fia_auth.fia_auth import app
+from fia_auth.model import User
+from fia_auth.tokens import VERIFIED_TOKEN_CACHE, generate_access_token
+from fia_auth.warmup import warm_up, warmup_steps
+
+
+async def main():
+    _configure_offline()
+    if WARM_UP:
+        steps = warmup_steps(app)
+        await warm_up({"signing": steps["signing"], "routes": steps["routes"]})
+    token = (await generate_access_token(User(USER_NUMBER, "Benchmark User"))).jwt
+    VERIFIED_TOKEN_CACHE.clear()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        timings = []
+        for _ in range(REQUESTS + 1):
+            VERIFIED_TOKEN_CACHE.clear()
+            start = time.perf_counter()
+            (await client.post("/verify", json={"token": token})).raise_for_status()
+            timings.append(time.perf_counter() - start)
+    print(json.dumps({"first": timings[0], "rest": statistics.median(timings[1:])}))
+
+
+asyncio.run(main())
+"""
+
+
+def _import_seconds() -> float:
+    start_script = f"import time; start = time.perf_counter(); import {APP_MODULE}; print(time.perf_counter() - start)"
+    output = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", start_script], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _slowest_imports(top: int) -> list[tuple[float, str]]:
+    stderr = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {APP_MODULE}"], check=True, capture_output=True, text=True
+    ).stderr
+    # Lines look like "import time:       123 |       4567 | package.module", the second column is cumulative
+    # Modules imported by the app module itself, or directly by those, are nested at most three spaces deep
+    timings = [
+        (int(match.group(1)) / 1e6, match.group(3))
+        for match in re.finditer(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", stderr)
+        if len(match.group(2)) <= 3  # noqa: PLR2004
+    ]
+    return sorted(timings, reverse=True)[:top]
+
+
+def _first_request(warm_up: bool) -> dict[str, float]:
+    script = f"REQUESTS = {REQUESTS}\nWARM_UP = {warm_up}\n" + FIRST_REQUEST_SCRIPT
+    output = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    ).stdout
+    result: dict[str, float] = json.loads(output.strip().splitlines()[-1])
+    return result
+
+
+def main() -> None:
+    """
+    Time the import of the app and the first request over several fresh processes, reporting the best and median runs
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=RUNS, help="fresh processes to time")
+    parser.add_argument("--top", type=int, default=0, help="list this many of the slowest imports")
+    parser.add_argument("--no-warmup", action="store_true", help="skip the startup warm-up before the first request")
+    args = parser.parse_args()
+
+    imports = [_import_seconds() for _ in range(args.runs)]
+    requests = [_first_request(not args.no_warmup) for _ in range(args.runs)]
+    firsts = [request["first"] * 1000 for request in requests]
+    rests = [request["rest"] * 1000 for request in requests]
+
+    sys.stdout.write(f"{'measurement':<28}{'best ms':>12}{'median ms':>12}\n")
+    sys.stdout.write(
+        f"{'import ' + APP_MODULE:<28}{min(imports) * 1000:>12.1f}{statistics.median(imports) * 1000:>12.1f}\n"
+    )
+    sys.stdout.write(f"{'first /verify':<28}{min(firsts):>12.2f}{statistics.median(firsts):>12.2f}\n")
+    sys.stdout.write(f"{'later /verify':<28}{min(rests):>12.2f}{statistics.median(rests):>12.2f}\n")
+
+    if args.top:
+        sys.stdout.write(f"\n{'module':<40}{'cumulative ms':>14}\n")
+        for seconds, module in _slowest_imports(args.top):
+            sys.stdout.write(f"{module:<40}{seconds * 1000:>14.1f}\n")
+
+
+if __name__ == "__main__":
+    main()
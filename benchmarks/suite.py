@@ -0,0 +1,199 @@
+"""
+Offline microbenchmarks for the token, role and routing hot paths. Results are compared with a stored baseline and
+changes reported as percentages. Run from the repository root with:
+
+    python -m benchmarks.suite                   # compare with benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline   # record a new baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import platform
+import sys
+import time
+import warnings
+from dataclasses import dataclass
+from http import HTTPStatus
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import httpx
+
+from fia_auth import uows
+from fia_auth.db import STAFF_SNAPSHOT
+from fia_auth.fia_auth import app
+from fia_auth.model import User
+from fia_auth.roles import ROLE_CACHE
+from fia_auth.tokens import (
+    VERIFIED_TOKEN_CACHE,
+    generate_access_token,
+    generate_refresh_token,
+    load_access_token,
+    load_refresh_token,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+USER_NUMBER = 1234
+REPEATS = 5
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    """A named operation and how many times to run it per timing"""
+
+    name: str
+    operation: Callable[[], Any]
+    iterations: int
+
+
+async def _time_async(operation: Callable[[], Awaitable[Any]], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await operation()
+    return time.perf_counter() - start
+
+
+def _time_sync(operation: Callable[[], Any], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        operation()
+    return time.perf_counter() - start
+
+
+def _configure_offline() -> None:
+    """
+    Make role lookups answerable without the database or UOWS: the staff snapshot is loaded empty and the UOWS client
+    answers from an in-process transport
+    :return: None
+    """
+    STAFF_SNAPSHOT.replace(frozenset())
+    uows._CLIENT = uows.UOWSClient(
+        "https://uows.benchmark",
+        "benchmark",
+        transport=httpx.MockTransport(lambda _: httpx.Response(HTTPStatus.OK, json=[{"name": "User"}])),
+    )
+
+
+async def _benchmarks(client: httpx.AsyncClient) -> list[Benchmark]:
+    user = User(USER_NUMBER, "Benchmark User")
+    access_jwt = (await generate_access_token(user)).jwt
+    refresh_jwt = generate_refresh_token().jwt
+
+    async def generate() -> None:
+        await generate_access_token(user)
+
+    def verify_cold() -> None:
+        VERIFIED_TOKEN_CACHE.clear()
+        load_access_token(access_jwt).verify()
+
+    def verify_cached() -> None:
+        load_access_token(access_jwt).verify()
+
+    async def refresh_access_token() -> None:
+        await load_access_token(access_jwt).refresh()
+
+    def refresh_token_round_trip() -> None:
+        load_refresh_token(generate_refresh_token().jwt).verify()
+
+    async def role_uncached() -> None:
+        ROLE_CACHE.clear()
+        await user.get_role()
+
+    async def route_verify() -> None:
+        VERIFIED_TOKEN_CACHE.clear()
+        response = await client.post("/verify", json={"token": access_jwt})
+        response.raise_for_status()
+
+    async def route_refresh() -> None:
+        response = await client.post("/refresh", json={"token": access_jwt}, cookies={"refresh_token": refresh_jwt})
+        response.raise_for_status()
+
+    return [
+        Benchmark("generate_access_token", generate, 5000),
+        Benchmark("verify_cold", verify_cold, 10000),
+        Benchmark("verify_cached", verify_cached, 20000),
+        Benchmark("access_token_refresh", refresh_access_token, 5000),
+        Benchmark("refresh_token_round_trip", refresh_token_round_trip, 5000),
+        Benchmark("role_cached", user.get_role, 20000),
+        Benchmark("role_uncached", role_uncached, 2000),
+        Benchmark("route_verify", route_verify, 1000),
+        Benchmark("route_refresh", route_refresh, 1000),
+    ]
+
+
+async def _run_all(benchmarks_filter: str | None) -> dict[str, float]:
+    results: dict[str, float] = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for benchmark in await _benchmarks(client):
+            if benchmarks_filter is not None and benchmarks_filter not in benchmark.name:
+                continue
+            timings = []
+            for _ in range(REPEATS):
+                if inspect.iscoroutinefunction(benchmark.operation):
+                    timings.append(await _time_async(benchmark.operation, benchmark.iterations))
+                else:
+                    timings.append(_time_sync(benchmark.operation, benchmark.iterations))
+            results[benchmark.name] = benchmark.iterations / min(timings)
+    return results
+
+
+def _report(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    regressions = []
+    sys.stdout.write(f"{'benchmark':<28}{'ops/s':>14}{'baseline':>14}{'change':>10}\n")
+    for name, rate in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            sys.stdout.write(f"{name:<28}{rate:>14,.0f}{'-':>14}{'-':>10}\n")
+            continue
+        change = (rate - reference) / reference * 100
+        marker = ""
+        if change < -threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        sys.stdout.write(f"{name:<28}{rate:>14,.0f}{reference:>14,.0f}{change:>+9.1f}%{marker}\n")
+    return regressions
+
+
+def main() -> None:
+    """
+    Run the benchmarks, then either save them as the baseline or compare them with it
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="slowdown in percent reported as a regression")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit non-zero if anything regressed")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter("ignore")
+    _configure_offline()
+    results = asyncio.run(_run_all(args.filter))
+
+    if args.save_baseline:
+        baseline = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        sys.stdout.write(f"Saved baseline for {len(results)} benchmarks to {args.baseline}\n")
+        return
+
+    baseline_results: dict[str, float] = (
+        json.loads(args.baseline.read_text(encoding="utf-8"))["results"] if args.baseline.exists() else {}
+    )
+    regressions = _report(results, baseline_results, args.threshold)
+    if regressions and args.fail_on_regression:
+        raise SystemExit(f"Regressed by more than {args.threshold}%: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
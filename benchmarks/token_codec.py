@@ -0,0 +1,68 @@
+"""
+Microbenchmark comparing the token decoding used by /verify and /refresh, which picks the HS256 codec by the token's
+header, with PyJWT. Run from the repository root with: python -m benchmarks.token_codec
+"""
+
+from __future__ import annotations
+
+import sys
+import timeit
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING
+
+import jwt
+
+from fia_auth.keys import get_key_ring
+from fia_auth.tokens import _decode, _hs256_codec
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+ITERATIONS = 20000
+
+
+def _tokens_per_second(operation: Callable[[], object]) -> float:
+    best = min(timeit.repeat(operation, number=ITERATIONS, repeat=5))
+    return ITERATIONS / best
+
+
+def main() -> None:
+    """
+    Time verifying and refreshing a typical access token with PyJWT and with fia-auth's decoding
+    :return: None
+    """
+    key = get_key_ring().active
+    if key.algorithm != "HS256":
+        raise SystemExit("The HS256 codec benchmark requires an HS256 active key")
+    codec = _hs256_codec(key.kid, key.signing_key)
+    payload = {"usernumber": 1234, "role": "user", "username": "Mr Cool", "exp": datetime.now(UTC) + timedelta(hours=1)}
+    token = codec.encode(payload)
+    headers = {"kid": key.kid}
+
+    def pyjwt_verify() -> object:
+        return jwt.decode(token, key.verification_key, algorithms=["HS256"], options={"require": ["exp"]})
+
+    def pyjwt_refresh() -> object:
+        claims = jwt.decode(
+            token, key.verification_key, algorithms=["HS256"], options={"require": ["exp"], "verify_exp": False}
+        )
+        return jwt.encode(claims, key.signing_key, algorithm="HS256", headers=headers)
+
+    def fia_auth_verify() -> object:
+        return _decode(token, verify_exp=True)
+
+    def fia_auth_refresh() -> object:
+        return codec.encode(_decode(token, verify_exp=False))
+
+    sys.stdout.write(f"{'operation':<10}{'PyJWT tokens/s':>18}{'fia-auth tokens/s':>18}{'speedup':>10}\n")
+    for name, reference, fast in (
+        ("verify", pyjwt_verify, fia_auth_verify),
+        ("refresh", pyjwt_refresh, fia_auth_refresh),
+    ):
+        reference_rate = _tokens_per_second(reference)
+        fast_rate = _tokens_per_second(fast)
+        sys.stdout.write(f"{name:<10}{reference_rate:>18,.0f}{fast_rate:>18,.0f}{fast_rate / reference_rate:>9.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
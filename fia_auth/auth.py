@@ -4,46 +4,57 @@ import logging
 import os
 from http import HTTPStatus
 
-import requests
+import httpx
 
-from fia_auth.exceptions import BadCredentialsError, UOWSError
+from fia_auth.exceptions import BadCredentialsError, UOWSError, UOWSUnavailableError, UpstreamUnavailableError
 from fia_auth.model import User, UserCredentials
+from fia_auth.shared_cache import CacheNamespace
+from fia_auth.tracing import TRACER
+from fia_auth.uows import get_uows_client
 
 logger = logging.getLogger(__name__)
-UOWS_URL = os.environ.get("UOWS_URL", "https://devapi.facilities.rl.ac.uk/users-service")
 
+DISPLAY_NAME_CACHE_TTL_SECONDS = float(os.environ.get("DISPLAY_NAME_CACHE_TTL_SECONDS", "3600"))
 
-def authenticate(credentials: UserCredentials) -> User:
+DISPLAY_NAME_CACHE = CacheNamespace("display_names", ttl_seconds=DISPLAY_NAME_CACHE_TTL_SECONDS)
+
+
+@TRACER.start_as_current_span("auth.authenticate")
+async def authenticate(credentials: UserCredentials) -> User:
     """
-    Authenticate the user based on the given credentials
+    Authenticate the user based on the given credentials. The UOWS session is always created, but display names are
+    cached so repeat logins skip the person details lookup
     :param credentials: The user credentials
     :return: UserNumber
     """
-    data = {"username": credentials.username, "password": credentials.password}
     logger.info(f"Authentication user: {credentials.username[0:3]}*****")  # Partial reveal to help logging
-    response = requests.post(
-        f"{UOWS_URL}/v1/sessions",
-        json=data,
-        headers={"Content-Type": "application/json"},
-        timeout=30,
-    )
-    if response.status_code == HTTPStatus.CREATED:
-        logger.info("Session created with UOWS")
-        user_id = response.json()["userId"]
-        uows_api_key = os.environ.get("UOWS_API_KEY", "")
-        details_response = requests.get(
-            f"{UOWS_URL}/v1/basic-person-details?userNumbers={user_id}",
-            headers={"Authorization": f"Api-key {uows_api_key}", "Content-Type": "application/json"},
-            timeout=30,
-        )
-        if (
-            details_response.status_code != HTTPStatus.OK
-            or len(details_response.json()) < 1
-            or "displayName" not in details_response.json()[0]
-        ):
-            logger.warning("Unexpected error occured when authentication with the UOWS: %s", response.text)
-            raise UOWSError("An unexpected error occurred when authenticating with the user office web service")
-        return User(user_number=user_id, username=details_response.json()[0]["displayName"])
+    client = get_uows_client()
+    try:
+        response = await client.create_session(credentials.username, credentials.password)
+        if response.status_code == HTTPStatus.CREATED:
+            logger.info("Session created with UOWS")
+            user_id = response.json()["userId"]
+            display_name = await DISPLAY_NAME_CACHE.get(user_id)
+            if display_name is None:
+                details_response = await client.get_basic_person_details(user_id)
+                if (
+                    details_response.status_code != HTTPStatus.OK
+                    or len(details_response.json()) < 1
+                    or "displayName" not in details_response.json()[0]
+                ):
+                    logger.warning("Unexpected error occured when authentication with the UOWS: %s", response.text)
+                    raise UOWSError("An unexpected error occurred when authenticating with the user office web service")
+                display_name = details_response.json()[0]["displayName"]
+                await DISPLAY_NAME_CACHE.set(user_id, display_name)
+            return User(user_number=user_id, username=display_name)
+    except UpstreamUnavailableError as exc:
+        logger.warning("Not calling the UOWS: %s", exc)
+        raise UOWSUnavailableError(
+            "The user office web service is unavailable, try again later", exc.retry_after_seconds
+        ) from exc
+    except httpx.HTTPError as exc:
+        logger.warning("Could not reach the UOWS: %s", exc)
+        raise UOWSError("An unexpected error occurred when authenticating with the user office web service") from exc
     if response.status_code == HTTPStatus.UNAUTHORIZED:
         logger.info("Bad credentials given to UOWS")
         raise BadCredentialsError("Invalid user credentials provided to authenticate with the user office web service.")
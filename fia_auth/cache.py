@@ -0,0 +1,256 @@
+"""Bounded in-process caches used to avoid repeated upstream lookups"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Generic, NamedTuple, TypeVar
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound="Hashable")
+V = TypeVar("V")
+
+CACHES: dict[str, TTLCache[Any, Any]] = {}
+
+
+def approximate_size(obj: Any) -> int:
+    """
+    Approximate the memory used by an object, following the contents of builtin containers
+    :param obj: The object to size
+    :return: The approximate size in bytes
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approximate_size(key) + approximate_size(value) for key, value in obj.items())
+    elif isinstance(obj, list | tuple | set | frozenset):
+        size += sum(approximate_size(item) for item in obj)
+    return size
+
+
+@dataclass
+class CacheStats:
+    """Counters describing how a cache is performing"""
+
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    refreshes: int = 0
+    refresh_failures: int = 0
+
+
+class _Entry(NamedTuple):
+    value: Any
+    expires_at: float
+    stale_until: float
+    size: int
+
+
+class TTLCache(Generic[K, V]):
+    """
+    LRU cache with a time to live for each entry and a bound on both the number of entries and the memory they use.
+    Expired entries may still be served as stale until their stale period ends, allowing a refresh in the background.
+    Safe to share between threads, as sync routes run in the threadpool while async routes use the event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        max_entries: int,
+        max_bytes: int | None = None,
+        stale_seconds: float = 0,
+        sizeof: Callable[[Any], int] = approximate_size,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Create the cache and register it so its statistics can be reported
+        :param name: Unique name the cache is reported under
+        :param ttl_seconds: How long an entry is fresh for
+        :param max_entries: Maximum number of entries before the least recently used is evicted
+        :param max_bytes: Optional maximum approximate memory use before the least recently used is evicted
+        :param stale_seconds: How long after expiry an entry may still be served as stale
+        :param sizeof: Function used to size cached values
+        :param clock: Monotonic clock, only expected to be replaced in tests
+        """
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self.stats = CacheStats()
+        self._sizeof = sizeof
+        self._clock = clock
+        self._entries: OrderedDict[K, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def __len__(self) -> int:
+        """
+        Return the number of entries, including stale entries
+        :return: The number of entries
+        """
+        return len(self._entries)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        The approximate memory used by the cached values
+        :return: The size in bytes
+        """
+        return self._bytes
+
+    def lookup(self, key: K) -> tuple[V, bool] | None:
+        """
+        Look up a key, returning stale entries as well as fresh ones
+        :param key: The key
+        :return: A tuple of the value and whether it is still fresh, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            now = self._clock()
+            if now >= entry.stale_until:
+                self._remove(key)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if now < entry.expires_at:
+                self.stats.hits += 1
+                return entry.value, True
+            self.stats.stale_hits += 1
+            return entry.value, False
+
+    def get(self, key: K) -> V | None:
+        """
+        Get a fresh value for the key
+        :param key: The key
+        :return: The value or None if it is missing or no longer fresh
+        """
+        result = self.lookup(key)
+        if result is None or not result[1]:
+            return None
+        return result[0]
+
+    def set(self, key: K, value: V, ttl_seconds: float | None = None) -> None:
+        """
+        Store a value, evicting the least recently used entries if the cache is over its bounds
+        :param key: The key
+        :param value: The value
+        :param ttl_seconds: Optional ttl overriding the cache default
+        :return: None
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires_at = self._clock() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+            self._entries[key] = _Entry(value, expires_at, expires_at + self.stale_seconds, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1
+            ):
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def invalidate(self, key: K) -> bool:
+        """
+        Remove the key from the cache
+        :param key: The key
+        :return: True if the key was cached
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def clear(self) -> None:
+        """
+        Remove all entries
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self) -> dict[str, float]:
+        """
+        Report the counters along with the hit rate and current size of the cache
+        :return: The statistics
+        """
+        with self._lock:
+            stats = asdict(self.stats)
+            entries, memory_bytes = len(self._entries), self._bytes
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        hit_rate = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return {**stats, "hit_rate": hit_rate, "entries": entries, "memory_bytes": memory_bytes}
+
+    def _remove(self, key: K) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+class AsyncLoadingCache(Generic[K, V]):
+    """
+    Stale-while-revalidate wrapper around a TTLCache. Misses wait for the loader, while stale entries are returned
+    immediately and refreshed in the background.
+    """
+
+    def __init__(self, cache: TTLCache[K, V], loader: Callable[[K], Awaitable[V]]) -> None:
+        """
+        Create the loading cache
+        :param cache: The cache holding the values
+        :param loader: Coroutine function loading the value for a key from upstream
+        """
+        self.cache = cache
+        self._loader = loader
+        self._refreshing: dict[K, asyncio.Task[None]] = {}
+
+    async def get(self, key: K) -> V:
+        """
+        Get the value for the key, loading it on a miss
+        :param key: The key
+        :return: The value
+        """
+        result = self.cache.lookup(key)
+        if result is None:
+            value = await self._loader(key)
+            self.cache.set(key, value)
+            return value
+        value, fresh = result
+        if not fresh and key not in self._refreshing:
+            self._refreshing[key] = asyncio.create_task(self._refresh(key))
+        return value
+
+    async def _refresh(self, key: K) -> None:
+        try:
+            self.cache.set(key, await self._loader(key))
+            self.cache.stats.refreshes += 1
+        except Exception:
+            self.cache.stats.refresh_failures += 1
+            logger.warning("Background refresh of %s cache entry failed", self.cache.name, exc_info=True)
+        finally:
+            self._refreshing.pop(key, None)
+
+
+def cache_statistics() -> dict[str, dict[str, float]]:
+    """
+    Report the statistics of every registered cache
+    :return: The statistics keyed by cache name
+    """
+    return {name: cache.snapshot() for name, cache in CACHES.items()}
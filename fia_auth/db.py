@@ -1,11 +1,24 @@
 """DB Access moculde"""
 
+import asyncio
 import logging
 import os
+import time
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, ClassVar, cast
 
-from sqlalchemy import Integer, NullPool, create_engine, select, text
+from sqlalchemy import DateTime, Integer, create_engine, delete, func, insert, select, text
 from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection, QueuePool
+
+from fia_auth.metrics import track_upstream
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
 
 logger = logging.getLogger(__name__)
 
@@ -23,25 +36,217 @@ class Staff(Base):
     user_number: Mapped[int] = mapped_column(Integer())
 
 
+class UserExperiment(Base):
+    """An experiment (RB) number of a user, as of the last sync of the experiments index"""
+
+    __tablename__ = "user_experiments"
+    user_number: Mapped[int] = mapped_column(Integer(), index=True)
+    experiment_number: Mapped[int] = mapped_column(Integer())
+    synced_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
 DB_USERNAME = os.environ.get("DB_USERNAME", "postgres")
 DB_PASSWORD = os.environ.get("DB_PASSWORD", "password")
 DB_IP = os.environ.get("DB_IP", "localhost")
 DB_PORT = os.environ.get("DB_PORT", "5432")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+STAFF_REFRESH_SECONDS = float(os.environ.get("STAFF_REFRESH_SECONDS", "30"))
+
+
+@dataclass
+class PoolStats:
+    """Counters describing how long connection checkouts from a pool have waited"""
+
+    checkouts: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+
+    def record(self, wait_seconds: float) -> None:
+        """
+        Record a single checkout
+        :param wait_seconds: How long the checkout took
+        :return: None
+        """
+        self.checkouts += 1
+        self.wait_seconds_total += wait_seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+
+class _CheckoutTimingMixin:
+    stats: ClassVar[PoolStats]
+
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        connection: PoolProxiedConnection = super().connect()  # type: ignore[misc]
+        type(self).stats.record(time.perf_counter() - start)
+        return connection
+
+
+class _TimedQueuePool(_CheckoutTimingMixin, QueuePool):
+    stats = PoolStats()
+
+
+class _TimedAsyncQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+
+_POOL_ARGUMENTS: dict[str, Any] = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+    "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
 
 ENGINE = create_engine(
     f"postgresql+psycopg2://{DB_USERNAME}:{DB_PASSWORD}@{DB_IP}:{DB_PORT}/fia",
-    poolclass=NullPool,
+    poolclass=_TimedQueuePool,
+    **_POOL_ARGUMENTS,
 )
+_ASYNC_ENGINE: "AsyncEngine | None" = None
 
 SESSION = sessionmaker(ENGINE)
 
 
-def is_staff_user(user_number: int) -> bool:
+def get_async_engine() -> "AsyncEngine":
+    """
+    Return the async engine, creating it on first use. SQLAlchemy's asyncio extension and asyncpg are only imported
+    then, as they are only needed by the database health check
+    :return: The async engine
+    """
+    global _ASYNC_ENGINE  # noqa: PLW0603
+    if _ASYNC_ENGINE is None:
+        from sqlalchemy.ext.asyncio import create_async_engine  # noqa: PLC0415
+
+        _ASYNC_ENGINE = create_async_engine(
+            f"postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_IP}:{DB_PORT}/fia",
+            poolclass=_TimedAsyncQueuePool,
+            **_POOL_ARGUMENTS,
+        )
+    return _ASYNC_ENGINE
+
+
+def pool_statistics() -> dict[str, dict[str, Any]]:
+    """
+    Report the state of the sync and async connection pools along with their checkout wait times
+    :return: The statistics keyed by engine
+    """
+    statistics = {}
+    for name, pool, stats in (
+        ("sync", cast("QueuePool", ENGINE.pool), _TimedQueuePool.stats),
+        ("async", cast("QueuePool", get_async_engine().pool), _TimedAsyncQueuePool.stats),
+    ):
+        statistics[name] = {
+            **asdict(stats),
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+    return statistics
+
+
+class StaffSnapshot:
+    """
+    In-memory copy of the staff table. The table is small, so it is reloaded periodically and the new set of user
+    numbers swapped in if it differs from the current one.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty snapshot, it is not used for lookups until it has been loaded"""
+        self._user_numbers: frozenset[int] | None = None
+        self.loaded_at: float | None = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the snapshot has been loaded and can answer lookups
+        :return: True if loaded
+        """
+        return self._user_numbers is not None
+
+    def __contains__(self, user_number: object) -> bool:
+        """
+        Check if the user number is in the snapshot
+        :param user_number: The user number
+        :return: True if the user number is a staff user
+        """
+        return self._user_numbers is not None and user_number in self._user_numbers
+
+    def __len__(self) -> int:
+        """
+        Return the number of staff users in the snapshot
+        :return: The number of staff users
+        """
+        return 0 if self._user_numbers is None else len(self._user_numbers)
+
+    def replace(self, user_numbers: frozenset[int]) -> None:
+        """
+        Swap in a new set of staff user numbers
+        :param user_numbers: The staff user numbers
+        :return: None
+        """
+        self._user_numbers = user_numbers
+        self.loaded_at = time.monotonic()
+
+    def clear(self) -> None:
+        """
+        Drop the snapshot so lookups go to the database again
+        :return: None
+        """
+        self._user_numbers = None
+        self.loaded_at = None
+
+    def refresh(self) -> bool:
+        """
+        Reload the staff user numbers, replacing the snapshot if they have changed since the last load
+        :return: True if the snapshot was replaced
+        """
+        with track_upstream("postgres", "staff_snapshot_refresh"), SESSION() as session:
+            user_numbers = frozenset(session.scalars(select(Staff.user_number)).all())
+        if user_numbers == self._user_numbers:
+            return False
+        self.replace(user_numbers)
+        logger.info("Loaded %s staff users into the staff snapshot", len(user_numbers))
+        return True
+
+
+STAFF_SNAPSHOT = StaffSnapshot()
+
+
+async def refresh_staff_snapshot_periodically(interval_seconds: float = STAFF_REFRESH_SECONDS) -> None:
+    """
+    Keep the staff snapshot up to date, reloading the table every interval. Failures are logged and the
+    previous snapshot kept.
+    :param interval_seconds: Seconds between reloads
+    :return: None
+    """
+    while True:
+        try:
+            await asyncio.to_thread(STAFF_SNAPSHOT.refresh)
+        except Exception:
+            logger.warning("Failed to refresh the staff snapshot", exc_info=True)
+        await asyncio.sleep(interval_seconds)
+
+
+async def is_staff_user(user_number: int) -> bool:
     """
-    Given a user_number, check if it is a staff
+    Given a user_number, check if it is a staff. Uses the in-memory staff snapshot once it has been loaded, otherwise
+    queries the database off the event loop
     :param user_number: The user number to check
     :return: boolean indicating if it is a staff
     """
+    if STAFF_SNAPSHOT.loaded:
+        return int(user_number) in STAFF_SNAPSHOT
+    with track_upstream("postgres", "is_staff_user"):
+        return await asyncio.to_thread(_query_is_staff_user, user_number)
+
+
+def _query_is_staff_user(user_number: int) -> bool:
     try:
         with SESSION() as session:
             session.execute(select(Staff.user_number).where(Staff.user_number == user_number)).one()
@@ -56,7 +261,59 @@ def is_staff_user(user_number: int) -> bool:
         return False
 
 
-def ensure_db_connection() -> None:
+def experiments_index_synced_at() -> datetime | None:
+    """
+    Get when the persisted experiments index was last synced
+    :return: The sync time, or None if no index has been persisted
+    """
+    with track_upstream("postgres", "experiments_index_synced_at"), SESSION() as session:
+        return session.scalar(select(func.max(UserExperiment.synced_at)))
+
+
+def load_experiments_index() -> tuple[dict[int, tuple[int, ...]], datetime] | None:
+    """
+    Load the persisted experiments index
+    :return: The experiment (RB) numbers keyed by user number and when they were synced, or None if no index has been
+    persisted
+    """
+    experiments: defaultdict[int, list[int]] = defaultdict(list)
+    with track_upstream("postgres", "load_experiments_index"), SESSION() as session:
+        synced_at = session.scalar(select(func.max(UserExperiment.synced_at)))
+        if synced_at is None:
+            return None
+        # Distinct, so rows left duplicated by replicas that rebuilt the index at the same time are read once
+        for user_number, experiment_number in session.execute(
+            select(UserExperiment.user_number, UserExperiment.experiment_number).distinct()
+        ):
+            experiments[user_number].append(experiment_number)
+    return {user_number: tuple(sorted(numbers)) for user_number, numbers in experiments.items()}, synced_at
+
+
+# Key of the transaction level advisory lock serialising rebuilds of the experiments index
+EXPERIMENTS_INDEX_LOCK_KEY = 4_627_201
+
+
+def store_experiments_index(experiments: Mapping[int, Sequence[int]], synced_at: datetime) -> None:
+    """
+    Replace the persisted experiments index in a single transaction. Replicas syncing at the same time take turns, as
+    interleaved deletes and inserts would otherwise leave both replicas' rows behind
+    :param experiments: The experiment (RB) numbers keyed by user number
+    :param synced_at: When the experiments were fetched
+    :return: None
+    """
+    rows = [
+        {"user_number": user_number, "experiment_number": experiment_number, "synced_at": synced_at}
+        for user_number, numbers in experiments.items()
+        for experiment_number in numbers
+    ]
+    with track_upstream("postgres", "store_experiments_index"), SESSION.begin() as session:
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": EXPERIMENTS_INDEX_LOCK_KEY})
+        session.execute(delete(UserExperiment))
+        if rows:
+            session.execute(insert(UserExperiment), rows)
+
+
+async def ensure_db_connection() -> None:
     """Ensure the application can talk to the database."""
-    with ENGINE.connect() as connection:
-        connection.execute(text("SELECT 1"))
+    async with get_async_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
@@ -1,11 +1,14 @@
 """Error handlers"""
 
 import logging
+import math
 from http import HTTPStatus
 
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
+from fia_auth.exceptions import ServiceUnavailableError
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,3 +24,20 @@ async def auth_error_handler(_: Request, exc: Exception) -> JSONResponse:
         status_code=HTTPStatus.FORBIDDEN,
         content={"message": "Forbidden"},
     )
+
+
+async def service_unavailable_handler(_: Request, exc: Exception) -> JSONResponse:
+    """
+    Return a 503 with a Retry-After header when an upstream service is refusing calls, so clients back off rather than
+    treating it as a failed login or lookup
+    :param _:
+    :param exc: The caught exception
+    :return: JSONResponse with 503
+    """
+    retry_after = exc.retry_after_seconds if isinstance(exc, ServiceUnavailableError) else 1
+    logger.info("Upstream service unavailable: %s", exc)
+    return JSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={"message": "Service Unavailable"},
+        headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+    )
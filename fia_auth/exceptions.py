@@ -1,14 +1,35 @@
 """FIA Auth custom exceptions"""
 
 
+class ServiceUnavailableError(Exception):
+    """Raised when an upstream service is refusing calls for now, so the request should be retried later"""
+
+    def __init__(self, message: str, retry_after_seconds: float) -> None:
+        """
+        Create the error
+        :param message: The error message
+        :param retry_after_seconds: How long until the upstream service is expected to accept calls again
+        """
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
 class UOWSError(Exception):
     """Problem authenticating with the user office web service"""
 
 
+class UOWSUnavailableError(UOWSError, ServiceUnavailableError):
+    """The user office web service is not being called because it is failing or busy"""
+
+
 class ProposalAllocationsError(Exception):
     """Problem connecting with the proposal allocations api"""
 
 
+class ProposalAllocationsUnavailableError(ProposalAllocationsError, ServiceUnavailableError):
+    """The proposal allocations api is not being called because it is failing or busy"""
+
+
 class AuthenticationError(Exception):
     """Problem with authentication mechanism"""
 
@@ -19,3 +40,24 @@ class BadCredentialsError(AuthenticationError):
 
 class BadJWTError(AuthenticationError):
     """Raised when a bad jwt has been given to the service"""
+
+
+class ExpiredJWTError(BadJWTError):
+    """Raised when a jwt has a valid signature but has expired"""
+
+
+class BadJWTSignatureError(BadJWTError):
+    """Raised when a jwt was not signed by this service"""
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised without calling an upstream service when its circuit breaker is open or its bulkhead is full"""
+
+    def __init__(self, message: str, retry_after_seconds: float = 1) -> None:
+        """
+        Create the error
+        :param message: The error message
+        :param retry_after_seconds: How long until the upstream service may be called again
+        """
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
@@ -1,43 +1,620 @@
 """Module for dealing with experiment user data via proposal allocations API"""
 
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import functools
+import json
 import logging
 import os
+import time
+from collections import defaultdict
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-from gql import Client, gql
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql import Client, GraphQLRequest, gql
 from gql.transport.exceptions import TransportError
+from graphql import GraphQLError
+
+from fia_auth.cache import AsyncLoadingCache, TTLCache
+from fia_auth.db import experiments_index_synced_at, load_experiments_index, store_experiments_index
+from fia_auth.exceptions import ProposalAllocationsError, ProposalAllocationsUnavailableError, UpstreamUnavailableError
+from fia_auth.metrics import EXPERIMENTS_INDEX_AGE, EXPERIMENTS_INDEX_USERS, track_upstream
+from fia_auth.resilience import UpstreamGuard
+from fia_auth.shared_cache import CacheNamespace
+from fia_auth.singleflight import SingleFlight
+from fia_auth.tracing import TRACER, inject_trace_context
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, Callable
 
-from fia_auth.exceptions import ProposalAllocationsError
+    from gql.client import AsyncClientSession
+    from gql.transport.async_transport import AsyncTransport
 
 logger = logging.getLogger(__name__)
 
 UOWS_API_KEY = os.environ.get("UOWS_API_KEY", "shh")
 ALLOCATIONS_URL = os.environ.get("ALLOCATIONS_URL", "https://devapi.facilities.rl.ac.uk/proposal-allocations/graphql")
+ALLOCATIONS_SCHEMA_CACHE = os.environ.get("ALLOCATIONS_SCHEMA_CACHE")
+EXPERIMENTS_CACHE_TTL_SECONDS = float(os.environ.get("EXPERIMENTS_CACHE_TTL_SECONDS", "300"))
+EXPERIMENTS_CACHE_STALE_SECONDS = float(os.environ.get("EXPERIMENTS_CACHE_STALE_SECONDS", "3600"))
+EXPERIMENTS_CACHE_MAX_ENTRIES = int(os.environ.get("EXPERIMENTS_CACHE_MAX_ENTRIES", "10000"))
+EXPERIMENTS_CACHE_MAX_BYTES = int(os.environ.get("EXPERIMENTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+EXPERIMENTS_BATCH_CHUNK_SIZE = int(os.environ.get("EXPERIMENTS_BATCH_CHUNK_SIZE", "50"))
+EXPERIMENTS_BATCH_CONCURRENCY = int(os.environ.get("EXPERIMENTS_BATCH_CONCURRENCY", "4"))
+ALLOCATIONS_BULKHEAD_MAX_CALLS = int(os.environ.get("ALLOCATIONS_BULKHEAD_MAX_CALLS", "20"))
+ALLOCATIONS_BULKHEAD_MAX_WAIT_SECONDS = float(os.environ.get("ALLOCATIONS_BULKHEAD_MAX_WAIT_SECONDS", "0.5"))
+EXPERIMENTS_INDEX_ENABLED = os.environ.get("EXPERIMENTS_INDEX_ENABLED", "false").lower() == "true"
+EXPERIMENTS_INDEX_SYNC_SECONDS = float(os.environ.get("EXPERIMENTS_INDEX_SYNC_SECONDS", "3600"))
+EXPERIMENTS_INDEX_CHECK_SECONDS = float(os.environ.get("EXPERIMENTS_INDEX_CHECK_SECONDS", "60"))
+EXPERIMENTS_INDEX_MAX_AGE_SECONDS = float(os.environ.get("EXPERIMENTS_INDEX_MAX_AGE_SECONDS", "86400"))
+EXPERIMENTS_PAGE_SIZE = int(os.environ.get("EXPERIMENTS_PAGE_SIZE", "500"))
+
+PROPOSALS_FOR_USER_QUERY = gql(
+    """
+    query ProposalsForUser($userNumber: String!) {
+      proposals(filter: {un: $userNumber, facilities: ["ISIS"], includeWithdrawn: false}) {
+        referenceNumber
+      }
+    }
+    """
+)
+
+PROPOSALS_PAGE_FOR_USER_QUERY = gql(
+    """
+    query ProposalsPageForUser($userNumber: String!, $offset: Int!, $limit: Int!) {
+      proposals(
+        filter: {un: $userNumber, facilities: ["ISIS"], includeWithdrawn: false}, offset: $offset, limit: $limit
+      ) {
+        referenceNumber
+      }
+    }
+    """
+)
+
+ISIS_PROPOSAL_MEMBERS_QUERY = gql(
+    """
+    query IsisProposalMembers {
+      proposals(filter: {facilities: ["ISIS"], includeWithdrawn: false}) {
+        referenceNumber
+        members {
+          userNumber
+        }
+      }
+    }
+    """
+)
+
+HEALTH_CHECK_QUERY = gql("query HealthCheck { __typename }")
+
+
+@functools.lru_cache(maxsize=64)
+def _proposals_for_users_query(user_count: int) -> GraphQLRequest:
+    """
+    Build a query fetching the proposals of many users at once, one aliased proposals field per user. Queries are
+    parsed once for each number of users
+    :param user_count: The number of users the query is for
+    :return: The parsed query, with variables u0 to u{user_count - 1}
+    """
+    variables = ", ".join(f"$u{index}: String!" for index in range(user_count))
+    fields = "\n".join(
+        f'u{index}: proposals(filter: {{un: $u{index}, facilities: ["ISIS"], includeWithdrawn: false}}) '
+        "{ referenceNumber }"
+        for index in range(user_count)
+    )
+    return gql(f"query ProposalsForUsers({variables}) {{\n{fields}\n}}")
+
+
+# The introspected schema is kept for the life of the process, so reconnecting does not repeat the introspection
+_SCHEMA_INTROSPECTION: dict[str, Any] | None = None
+
+
+def _load_schema_introspection() -> dict[str, Any] | None:
+    if _SCHEMA_INTROSPECTION is not None:
+        return _SCHEMA_INTROSPECTION
+    if ALLOCATIONS_SCHEMA_CACHE is None:
+        return None
+    try:
+        introspection: dict[str, Any] = json.loads(Path(ALLOCATIONS_SCHEMA_CACHE).read_text(encoding="utf-8"))
+        logger.info("Loaded allocations schema from %s", ALLOCATIONS_SCHEMA_CACHE)
+        return introspection
+    except (OSError, ValueError):
+        logger.warning("Could not load allocations schema from %s, it will be fetched", ALLOCATIONS_SCHEMA_CACHE)
+        return None
+
+
+def _store_schema_introspection(introspection: dict[str, Any]) -> None:
+    global _SCHEMA_INTROSPECTION  # noqa: PLW0603
+    _SCHEMA_INTROSPECTION = introspection
+    if ALLOCATIONS_SCHEMA_CACHE is None:
+        return
+    try:
+        Path(ALLOCATIONS_SCHEMA_CACHE).write_text(json.dumps(introspection), encoding="utf-8")
+    except OSError:
+        logger.warning("Could not write allocations schema to %s", ALLOCATIONS_SCHEMA_CACHE)
+
+
+class AllocationsClient:
+    """
+    Long-lived GraphQL client for the proposal allocations API. Holds one connected session for its lifetime, and
+    calls go through a bulkhead and circuit breaker, raising UpstreamUnavailableError when either rejects them
+    """
+
+    def __init__(self, url: str, api_key: str, transport: AsyncTransport | None = None) -> None:
+        """
+        Create the client, the connection is opened on first use
+        :param url: The allocations GraphQL url
+        :param api_key: The UOWS api key
+        :param transport: Optional gql transport, only expected to be given in tests
+        """
+        if transport is None:
+            # aiohttp is slow to import and only needed once the client is created, during startup
+            from gql.transport.aiohttp import AIOHTTPTransport  # noqa: PLC0415
+
+            transport = AIOHTTPTransport(url=url, headers={"Authorisation": f"token {api_key}"})
+        self._transport = transport
+        self._client: Client | None = None
+        self._session: AsyncClientSession | None = None
+        self._lock = asyncio.Lock()
+        self.guard = UpstreamGuard("allocations", ALLOCATIONS_BULKHEAD_MAX_CALLS, ALLOCATIONS_BULKHEAD_MAX_WAIT_SECONDS)
+
+    async def _get_session(self) -> AsyncClientSession:
+        if self._session is not None:
+            return self._session
+        async with self._lock:
+            if self._session is None:
+                introspection = _load_schema_introspection()
+                self._client = Client(
+                    transport=self._transport,
+                    introspection=introspection,  # type: ignore[arg-type]
+                    fetch_schema_from_transport=introspection is None,
+                )
+                self._session = await self._client.connect_async(reconnecting=False)  # type: ignore[no-untyped-call]
+                if introspection is None and self._client.introspection is not None:
+                    _store_schema_introspection(dict(self._client.introspection))
+            return self._session
+
+    async def execute(self, request: GraphQLRequest, operation: str = "query") -> dict[str, Any]:
+        """
+        Execute the given request against the allocations API
+        :param request: The GraphQL request, including its variables
+        :param operation: Name the call is reported under in the upstream metrics
+        :return: The response data
+        :raises GraphQLError: If the request is not valid for the schema of the API
+        """
+
+        async def send() -> dict[str, Any] | GraphQLError:
+            with track_upstream("allocations", operation):
+                session = await self._get_session()
+                headers = inject_trace_context({})
+                try:
+                    if headers:
+                        return await session.execute(request, extra_args={"headers": headers})
+                    return await session.execute(request)
+                except GraphQLError as e:
+                    # The request failed validation against the schema before being sent, which says nothing about
+                    # the health of the API, so it is raised outside the circuit breaker
+                    return e
+
+        result = await self.guard.call(send)
+        if isinstance(result, GraphQLError):
+            raise result
+        return result
+
+    async def ping(self) -> None:
+        """
+        Check the allocations API answers a trivial query. Bypasses the circuit breaker, so recovery is seen as soon as
+        it happens
+        :return: None
+        """
+        session = await self._get_session()
+        await session.execute(HEALTH_CHECK_QUERY)
+
+    async def close(self) -> None:
+        """
+        Close the connected session if one is open
+        :return: None
+        """
+        async with self._lock:
+            if self._client is not None and self._session is not None:
+                await self._client.close_async()  # type: ignore[no-untyped-call]
+            self._client = None
+            self._session = None
+
+
+_CLIENT: AllocationsClient | None = None
+
+
+def get_allocations_client() -> AllocationsClient:
+    """
+    Return the shared allocations client, creating it on first use
+    :return: The allocations client
+    """
+    global _CLIENT  # noqa: PLW0603
+    if _CLIENT is None:
+        _CLIENT = AllocationsClient(ALLOCATIONS_URL, UOWS_API_KEY)
+    return _CLIENT
+
+
+async def close_allocations_client() -> None:
+    """
+    Close the shared allocations client if it has been created
+    :return: None
+    """
+    global _CLIENT  # noqa: PLW0603
+    if _CLIENT is not None:
+        logger.info("Closing allocations API session")
+        await _CLIENT.close()
+        _CLIENT = None
+
+
+EXPERIMENTS_LOOKUPS: SingleFlight[int, list[int]] = SingleFlight("experiments")
+
+EXPERIMENTS_SHARED_CACHE = CacheNamespace("experiments", ttl_seconds=EXPERIMENTS_CACHE_TTL_SECONDS)
+
+
+async def _load_experiments_for_user_number(user_number: int) -> list[int]:
+    # Concurrent misses and refreshes for the same user share one allocations query
+    return await EXPERIMENTS_LOOKUPS.do(user_number, lambda: _lookup_experiments_for_user_number(user_number))
+
+
+async def _lookup_experiments_for_user_number(user_number: int) -> list[int]:
+    if not EXPERIMENTS_SHARED_CACHE.shared:
+        return await _fetch_experiments_for_user_number(user_number)
+    shared: list[int] | None = await EXPERIMENTS_SHARED_CACHE.get(user_number)
+    if shared is not None:
+        return shared
+    experiments = await _fetch_experiments_for_user_number(user_number)
+    await EXPERIMENTS_SHARED_CACHE.set(user_number, experiments)
+    return experiments
+
+
+async def _fetch_experiments_for_user_number(user_number: int) -> list[int]:
+    logger.info("Fetching experiments for user number %s", user_number)
+    request = GraphQLRequest(PROPOSALS_FOR_USER_QUERY, variable_values={"userNumber": str(user_number)})
+    try:
+        response = await get_allocations_client().execute(request, "proposals_for_user")
+        return [int(proposal["referenceNumber"]) for proposal in response["proposals"]]
+    except UpstreamUnavailableError as e:
+        logger.warning("Not querying allocations API: %s", e)
+        raise ProposalAllocationsUnavailableError(str(e), e.retry_after_seconds) from e
+    except (TransportError, GraphQLError) as e:
+        logger.exception("Failed to query allocations API", exc_info=e)
+        raise ProposalAllocationsError() from e
+
+
+async def _fetch_experiments_for_user_numbers(user_numbers: list[int]) -> dict[int, list[int]]:
+    logger.info("Fetching experiments for %s user numbers", len(user_numbers))
+    request = GraphQLRequest(
+        _proposals_for_users_query(len(user_numbers)),
+        variable_values={f"u{index}": str(user_number) for index, user_number in enumerate(user_numbers)},
+    )
+    try:
+        response = await get_allocations_client().execute(request, "proposals_for_users")
+    except UpstreamUnavailableError as e:
+        logger.warning("Not querying allocations API: %s", e)
+        raise ProposalAllocationsUnavailableError(str(e), e.retry_after_seconds) from e
+    except (TransportError, GraphQLError) as e:
+        logger.exception("Failed to query allocations API", exc_info=e)
+        raise ProposalAllocationsError() from e
+    return {
+        user_number: [int(proposal["referenceNumber"]) for proposal in response[f"u{index}"]]
+        for index, user_number in enumerate(user_numbers)
+    }
+
+
+EXPERIMENTS_CACHE: AsyncLoadingCache[int, list[int]] = AsyncLoadingCache(
+    TTLCache(
+        "experiments",
+        ttl_seconds=EXPERIMENTS_CACHE_TTL_SECONDS,
+        max_entries=EXPERIMENTS_CACHE_MAX_ENTRIES,
+        max_bytes=EXPERIMENTS_CACHE_MAX_BYTES,
+        stale_seconds=EXPERIMENTS_CACHE_STALE_SECONDS,
+    ),
+    _load_experiments_for_user_number,
+)
+
+
+class ExperimentsIndex:
+    """
+    In-memory inverted index from user number to experiment (RB) numbers, built from every ISIS proposal. It is
+    swapped whole when synced, and not used for lookups once older than max_age_seconds.
+    """
+
+    def __init__(
+        self, max_age_seconds: float = EXPERIMENTS_INDEX_MAX_AGE_SECONDS, clock: Callable[[], float] = time.time
+    ) -> None:
+        """
+        Create an empty index, it is not used for lookups until it has been loaded
+        :param max_age_seconds: How long after a sync the index may answer lookups
+        :param clock: Wall clock, only expected to be replaced in tests
+        """
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self._experiments: dict[int, tuple[int, ...]] | None = None
+        self.synced_at: datetime | None = None
+
+    def __len__(self) -> int:
+        """
+        Return the number of users in the index
+        :return: The number of users
+        """
+        return 0 if self._experiments is None else len(self._experiments)
+
+    @property
+    def age_seconds(self) -> float | None:
+        """
+        How long ago the index was synced
+        :return: The age in seconds, or None if the index has not been loaded
+        """
+        if self.synced_at is None:
+            return None
+        return self._clock() - self.synced_at.timestamp()
+
+    def get(self, user_number: int) -> list[int] | None:
+        """
+        Get the experiment (RB) numbers of a user
+        :param user_number: The user number
+        :return: The experiment numbers, or None if the user is not in the index or the index is missing or too old
+        """
+        experiments = self._experiments
+        if experiments is None or user_number not in experiments:
+            return None
+        age_seconds = self.age_seconds
+        if age_seconds is None or age_seconds > self.max_age_seconds:
+            return None
+        return list(experiments[user_number])
+
+    def replace(self, experiments: dict[int, tuple[int, ...]], synced_at: datetime) -> None:
+        """
+        Swap in a new index
+        :param experiments: The experiment (RB) numbers keyed by user number
+        :param synced_at: When the experiments were fetched
+        :return: None
+        """
+        self._experiments = experiments
+        self.synced_at = synced_at
+
+    def clear(self) -> None:
+        """
+        Drop the index so lookups go to the allocations API again
+        :return: None
+        """
+        self._experiments = None
+        self.synced_at = None
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Report the size and age of the index
+        :return: The statistics
+        """
+        return {
+            "users": len(self),
+            "synced_at": None if self.synced_at is None else self.synced_at.isoformat(),
+            "age_seconds": self.age_seconds,
+        }
+
+
+EXPERIMENTS_INDEX = ExperimentsIndex()
+EXPERIMENTS_INDEX_USERS.set_function(lambda: len(EXPERIMENTS_INDEX))
+EXPERIMENTS_INDEX_AGE.set_function(lambda: EXPERIMENTS_INDEX.age_seconds or 0.0)
+
+
+async def _fetch_experiments_index() -> dict[int, tuple[int, ...]]:
+    logger.info("Fetching the members of every ISIS proposal")
+    try:
+        response = await get_allocations_client().execute(ISIS_PROPOSAL_MEMBERS_QUERY, "proposal_members")
+    except UpstreamUnavailableError as e:
+        raise ProposalAllocationsUnavailableError(str(e), e.retry_after_seconds) from e
+    except (TransportError, GraphQLError) as e:
+        raise ProposalAllocationsError() from e
+    experiments: defaultdict[int, set[int]] = defaultdict(set)
+    for proposal in response["proposals"]:
+        experiment_number = int(proposal["referenceNumber"])
+        for member in proposal["members"] or []:
+            experiments[int(member["userNumber"])].add(experiment_number)
+    return {user_number: tuple(sorted(numbers)) for user_number, numbers in experiments.items()}
+
+
+async def sync_experiments_index(sync_seconds: float = EXPERIMENTS_INDEX_SYNC_SECONDS) -> bool:
+    """
+    Bring the experiments index up to date. An index persisted by another replica within the sync interval is loaded
+    from the database, otherwise if this replica's index is due a sync every ISIS proposal is fetched, and the index
+    built from them is swapped in and persisted
+    :param sync_seconds: How often the index is rebuilt from the allocations API
+    :return: True if the index was replaced
+    """
+    now = datetime.now(UTC)
+    try:
+        persisted_at = await asyncio.to_thread(experiments_index_synced_at)
+    except Exception:
+        logger.warning("Could not check the persisted experiments index", exc_info=True)
+        persisted_at = None
+    if persisted_at is not None and (now - persisted_at).total_seconds() < sync_seconds:
+        if EXPERIMENTS_INDEX.synced_at is not None and EXPERIMENTS_INDEX.synced_at >= persisted_at:
+            return False
+        persisted = await asyncio.to_thread(load_experiments_index)
+        if persisted is not None:
+            EXPERIMENTS_INDEX.replace(*persisted)
+            logger.info("Loaded the experiments index of %s users from the database", len(EXPERIMENTS_INDEX))
+            return True
+    if EXPERIMENTS_INDEX.synced_at is not None and (now - EXPERIMENTS_INDEX.synced_at).total_seconds() < sync_seconds:
+        return False
+
+    experiments = await _fetch_experiments_index()
+    EXPERIMENTS_INDEX.replace(experiments, now)
+    logger.info("Synced the experiments index of %s users from the allocations API", len(experiments))
+    try:
+        await asyncio.to_thread(store_experiments_index, experiments, now)
+    except Exception:
+        logger.warning("Could not persist the experiments index", exc_info=True)
+    return True
+
+
+async def sync_experiments_index_periodically(interval_seconds: float = EXPERIMENTS_INDEX_CHECK_SECONDS) -> None:
+    """
+    Keep the experiments index up to date, checking whether it is due a sync every interval. Failures are logged and
+    the previous index kept.
+    :param interval_seconds: Seconds between checks
+    :return: None
+    """
+    while True:
+        try:
+            await sync_experiments_index()
+        except Exception:
+            logger.warning("Failed to sync the experiments index", exc_info=True)
+        await asyncio.sleep(interval_seconds)
 
 
 async def get_experiments_for_user_number(user_number: int) -> list[int]:
     """
-    Return the experiment (RB) numbers related to the given user number
+    Return the experiment (RB) numbers related to the given user number. Users in the experiments index are answered
+    from it. Otherwise results are cached, and once stale are served while being refreshed in the background
     :param user_number: The user number
     :return: A list of Experiment (RB) numbers
     """
-    transport = AIOHTTPTransport(url=ALLOCATIONS_URL, headers={"Authorisation": f"token {UOWS_API_KEY}"})
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-    logger.info("Fetching experiments for user number %s", user_number)
-    query = gql(
-        f"""
-        {{
-      proposals(
-        filter: {{un: "{user_number}", facilities: ["ISIS"], includeWithdrawn: false}}
-      ) {{
-        referenceNumber
-      }}
-    }}
+    indexed = EXPERIMENTS_INDEX.get(user_number)
+    if indexed is not None:
+        return indexed
+    with TRACER.start_as_current_span("experiments.get_experiments_for_user_number"):
+        return list(await EXPERIMENTS_CACHE.get(user_number))
+
+
+def encode_experiments_cursor(offset: int) -> str:
+    """
+    Encode the position of the next page of experiments as an opaque cursor
+    :param offset: How many experiments come before the next page
+    :return: The cursor
     """
+    return base64.urlsafe_b64encode(f"offset:{offset}".encode()).decode().rstrip("=")
+
+
+def decode_experiments_cursor(cursor: str) -> int:
+    """
+    Decode a cursor returned with a page of experiments
+    :param cursor: The cursor
+    :return: How many experiments come before the page the cursor points to
+    :raises ValueError: If the cursor was not returned by this service
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    prefix, _, offset = decoded.partition(":")
+    if prefix != "offset" or not offset.isdigit():
+        raise ValueError("Invalid cursor")
+    return int(offset)
+
+
+async def _fetch_experiments_page(user_number: int, offset: int, limit: int) -> list[int]:
+    logger.debug("Fetching %s experiments from %s for user number %s", limit, offset, user_number)
+    request = GraphQLRequest(
+        PROPOSALS_PAGE_FOR_USER_QUERY,
+        variable_values={"userNumber": str(user_number), "offset": offset, "limit": limit},
     )
     try:
-        response = await client.execute_async(query)
-        return [int(proposal["referenceNumber"]) for proposal in response["proposals"]]
-    except TransportError as e:
+        response = await get_allocations_client().execute(request, "proposals_page_for_user")
+    except UpstreamUnavailableError as e:
+        logger.warning("Not querying allocations API: %s", e)
+        raise ProposalAllocationsUnavailableError(str(e), e.retry_after_seconds) from e
+    except (TransportError, GraphQLError) as e:
         logger.exception("Failed to query allocations API", exc_info=e)
         raise ProposalAllocationsError() from e
+    return [int(proposal["referenceNumber"]) for proposal in response["proposals"]]
+
+
+@TRACER.start_as_current_span("experiments.get_experiments_page")
+async def get_experiments_page(user_number: int, offset: int, limit: int) -> tuple[list[int], int | None]:
+    """
+    Return one page of the experiment (RB) numbers of a user, in the order of the allocations API so that cursors stay
+    valid whichever source answers the next page. Pages are sliced from the cache, which holds the user's experiments
+    in that order, when the user is in it, otherwise only the page is fetched from the allocations API. The experiments
+    index is sorted by RB number, so it is not used
+    :param user_number: The user number
+    :param offset: How many experiments come before the page
+    :param limit: The most experiments in the page
+    :return: The page, and the offset of the next page or None if this is the last
+    """
+    cached = EXPERIMENTS_CACHE.cache.get(user_number)
+    if cached is not None:
+        page = cached[offset : offset + limit]
+        more = offset + limit < len(cached)
+    else:
+        # One more than the page is asked for, to tell whether another page follows without an empty last page
+        page = await _fetch_experiments_page(user_number, offset, limit + 1)
+        more = len(page) > limit
+        page = page[:limit]
+    return page, offset + len(page) if more else None
+
+
+async def iter_experiments_for_user_number(
+    user_number: int, offset: int = 0, page_size: int = EXPERIMENTS_PAGE_SIZE
+) -> AsyncGenerator[list[int]]:
+    """
+    Yield the experiment (RB) numbers of a user a page at a time in the order of the allocations API, fetching each
+    page from it only as the previous one is consumed unless the user is in the cache. Streamed results are not cached,
+    so memory use does not grow with the number of experiments
+    :param user_number: The user number
+    :param offset: How many experiments to skip
+    :param page_size: The most experiments in each page
+    :return: The pages
+    """
+    cached = EXPERIMENTS_CACHE.cache.get(user_number)
+    if cached is not None:
+        for start in range(offset, len(cached), page_size):
+            yield cached[start : start + page_size]
+        return
+    while True:
+        page = await _fetch_experiments_page(user_number, offset, page_size)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+
+@TRACER.start_as_current_span("experiments.get_experiments_for_user_numbers")
+async def get_experiments_for_user_numbers(user_numbers: list[int]) -> dict[int, list[int]]:
+    """
+    Return the experiment (RB) numbers for many user numbers. Users in the experiments index or with fresh cached
+    experiments are answered from them, then those in a shared cache with one bulk lookup. The rest are fetched in
+    chunks of aliased queries with a bounded number of requests in flight
+    :param user_numbers: The user numbers
+    :return: The experiment (RB) numbers keyed by user number
+    """
+    experiments: dict[int, list[int]] = {}
+    missing = []
+    for user_number in dict.fromkeys(user_numbers):
+        cached = EXPERIMENTS_INDEX.get(user_number) or EXPERIMENTS_CACHE.cache.get(user_number)
+        if cached is None:
+            missing.append(user_number)
+        else:
+            experiments[user_number] = list(cached)
+
+    if missing and EXPERIMENTS_SHARED_CACHE.shared:
+        shared = await EXPERIMENTS_SHARED_CACHE.get_many(missing)
+        for user_number, user_experiments in shared.items():
+            EXPERIMENTS_CACHE.cache.set(user_number, user_experiments)
+            experiments[user_number] = list(user_experiments)
+        missing = [user_number for user_number in missing if user_number not in shared]
+
+    semaphore = asyncio.Semaphore(EXPERIMENTS_BATCH_CONCURRENCY)
+
+    async def fetch_chunk(chunk: list[int]) -> dict[int, list[int]]:
+        async with semaphore:
+            return await _fetch_experiments_for_user_numbers(chunk)
+
+    chunks = [
+        missing[start : start + EXPERIMENTS_BATCH_CHUNK_SIZE]
+        for start in range(0, len(missing), EXPERIMENTS_BATCH_CHUNK_SIZE)
+    ]
+    for fetched in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+        for user_number, user_experiments in fetched.items():
+            EXPERIMENTS_CACHE.cache.set(user_number, user_experiments)
+            experiments[user_number] = list(user_experiments)
+        if EXPERIMENTS_SHARED_CACHE.shared:
+            await EXPERIMENTS_SHARED_CACHE.set_many(fetched)
+    return experiments
@@ -1,28 +1,70 @@
 """Module containing the fast api app. Uvicorn loads this to start the api"""
 
+import asyncio
+import contextlib
 import logging
-import sys
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
-from fia_auth.exception_handlers import auth_error_handler
-from fia_auth.exceptions import AuthenticationError
+from fia_auth.db import refresh_staff_snapshot_periodically
+from fia_auth.exception_handlers import auth_error_handler, service_unavailable_handler
+from fia_auth.exceptions import AuthenticationError, ServiceUnavailableError
+from fia_auth.experiments import (
+    EXPERIMENTS_INDEX_ENABLED,
+    close_allocations_client,
+    get_allocations_client,
+    sync_experiments_index_periodically,
+)
+from fia_auth.health import HEALTH_MONITOR
+from fia_auth.keys import reload_key_ring_periodically
+from fia_auth.logs import configure_logging
+from fia_auth.metrics import MetricsMiddleware
 from fia_auth.routers import ROUTER
+from fia_auth.shared_cache import close_cache_backend, get_cache_backend
+from fia_auth.tracing import TracingMiddleware, configure_tracing
+from fia_auth.uows import close_uows_client, get_uows_client
+from fia_auth.warmup import warm_up, warmup_steps
 
-file_handler = logging.FileHandler(filename="run-detection.log")
-stdout_handler = logging.StreamHandler(stream=sys.stdout)
-logging.basicConfig(
-    handlers=[file_handler, stdout_handler],
-    format="[%(asctime)s]-%(name)s-%(levelname)s: %(message)s",
-    level=logging.INFO,
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 ALLOWED_ORIGINS = ["*"]
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Open the shared upstream connection pools, warm up connections, keys and the staff snapshot, and start background
+    refreshes on startup, stopping them on shutdown. Requests are only accepted once warm-up has finished
+    :param app: The FastAPI app
+    :return: None
+    """
+    get_uows_client()
+    get_allocations_client()
+    get_cache_backend()
+    await warm_up(warmup_steps(app))
+    background_tasks = [
+        asyncio.create_task(refresh_staff_snapshot_periodically()),
+        asyncio.create_task(reload_key_ring_periodically()),
+        asyncio.create_task(HEALTH_MONITOR.run_periodically()),
+    ]
+    if EXPERIMENTS_INDEX_ENABLED:
+        background_tasks.append(asyncio.create_task(sync_experiments_index_periodically()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await close_uows_client()
+    await close_allocations_client()
+    await close_cache_backend()
+
+
+configure_tracing()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -30,5 +72,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(ROUTER)
 app.add_exception_handler(AuthenticationError, auth_error_handler)
+app.add_exception_handler(ServiceUnavailableError, service_unavailable_handler)
@@ -0,0 +1,152 @@
+"""
+Background health monitoring of the services fia-auth depends on. Checks run periodically and their results are cached,
+so readiness probes are answered without doing any I/O
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+from fia_auth.db import ensure_db_connection
+from fia_auth.experiments import get_allocations_client
+from fia_auth.metrics import DEPENDENCY_UP
+from fia_auth.uows import get_uows_client
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.environ.get("HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.environ.get("HEALTH_CHECK_TIMEOUT_SECONDS", "5"))
+HEALTH_CHECK_MAX_AGE_SECONDS = float(os.environ.get("HEALTH_CHECK_MAX_AGE_SECONDS", "60"))
+
+
+@dataclass(frozen=True)
+class DependencyStatus:
+    """The result of the latest check of a dependency"""
+
+    healthy: bool
+    checked_at: float
+    latency_seconds: float
+    error: str | None = None
+
+
+@dataclass(frozen=True)
+class HealthCheck:
+    """A dependency check, and whether the service is ready to serve requests without the dependency"""
+
+    check: Callable[[], Awaitable[Any]]
+    required: bool
+
+
+class HealthMonitor:
+    """
+    Periodically checks each dependency, keeping the latest result. The service is ready once every required
+    dependency passed its latest check and that check is recent
+    """
+
+    def __init__(
+        self,
+        checks: dict[str, HealthCheck],
+        timeout_seconds: float = HEALTH_CHECK_TIMEOUT_SECONDS,
+        max_age_seconds: float = HEALTH_CHECK_MAX_AGE_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Create the monitor, no dependency is considered healthy until it has been checked
+        :param checks: The checks keyed by dependency name, a check fails by raising or timing out
+        :param timeout_seconds: How long a check may take before it fails
+        :param max_age_seconds: How old a passed check may be and still count towards readiness
+        :param clock: Monotonic clock, only expected to be replaced in tests
+        """
+        self.checks = checks
+        self.timeout_seconds = timeout_seconds
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self.statuses: dict[str, DependencyStatus] = {}
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether every required dependency passed a recent check
+        :return: True if ready
+        """
+        now = self._clock()
+        for name, health_check in self.checks.items():
+            if not health_check.required:
+                continue
+            status = self.statuses.get(name)
+            if status is None or not status.healthy or now - status.checked_at > self.max_age_seconds:
+                return False
+        return True
+
+    async def _check(self, name: str, health_check: HealthCheck) -> None:
+        start = self._clock()
+        error = detail = None
+        try:
+            await asyncio.wait_for(health_check.check(), self.timeout_seconds)
+        except TimeoutError:
+            error = detail = f"Timed out after {self.timeout_seconds} seconds"
+        except Exception as exc:
+            # Only the type is reported, the message can hold hosts, ports and driver details so is only logged
+            error = type(exc).__name__
+            detail = f"{error}: {exc}"
+        now = self._clock()
+        previous = self.statuses.get(name)
+        if error is not None and (previous is None or previous.healthy):
+            logger.warning("Health check of %s failed: %s", name, detail)
+        elif error is None and previous is not None and not previous.healthy:
+            logger.info("Health check of %s passed again", name)
+        self.statuses[name] = DependencyStatus(error is None, now, now - start, error)
+        DEPENDENCY_UP.labels(name).set(error is None)
+
+    async def check_all(self) -> None:
+        """
+        Check every dependency concurrently, recording the results
+        :return: None
+        """
+        await asyncio.gather(*(self._check(name, health_check) for name, health_check in self.checks.items()))
+
+    async def run_periodically(self, interval_seconds: float = HEALTH_CHECK_INTERVAL_SECONDS) -> None:
+        """
+        Check every dependency each interval. The first round runs after one interval, as startup warm-up has just
+        checked them
+        :param interval_seconds: Seconds between rounds of checks
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await self.check_all()
+
+    def report(self) -> dict[str, Any]:
+        """
+        Report readiness and the latest status of each dependency, with the age of its check
+        :return: The report
+        """
+        now = self._clock()
+        dependencies: dict[str, Any] = {}
+        for name, health_check in self.checks.items():
+            status = self.statuses.get(name)
+            dependencies[name] = {
+                "required": health_check.required,
+                "healthy": status is not None and status.healthy,
+                "checked_age_seconds": None if status is None else now - status.checked_at,
+                "latency_seconds": None if status is None else status.latency_seconds,
+                "error": "Not checked yet" if status is None else status.error,
+            }
+        return {"ready": self.ready, "dependencies": dependencies}
+
+
+HEALTH_MONITOR = HealthMonitor(
+    {
+        "postgres": HealthCheck(ensure_db_connection, required=True),
+        "uows": HealthCheck(lambda: get_uows_client().ping(), required=False),
+        "allocations": HealthCheck(lambda: get_allocations_client().ping(), required=False),
+    }
+)
@@ -0,0 +1,244 @@
+"""Module containing the keys used to sign and verify tokens, and their publication as a JSON Web Key Set"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+logger = logging.getLogger(__name__)
+
+JWT_SECRET = os.environ.get("JWT_SECRET", "shh")
+JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
+JWT_PRIVATE_KEY = os.environ.get("JWT_PRIVATE_KEY")
+JWT_PRIVATE_KEY_FILE = os.environ.get("JWT_PRIVATE_KEY_FILE")
+JWT_KEYRING_FILE = os.environ.get("JWT_KEYRING_FILE")
+JWT_KEYRING_RELOAD_SECONDS = float(os.environ.get("JWT_KEYRING_RELOAD_SECONDS", "60"))
+JWKS_MAX_AGE_SECONDS = int(os.environ.get("JWKS_MAX_AGE_SECONDS", "300"))
+
+SYMMETRIC_ALGORITHMS = ("HS256",)
+ASYMMETRIC_ALGORITHMS = ("RS256", "EdDSA")
+
+# Members of each key type that identify the key, as defined by RFC 7638
+_THUMBPRINT_MEMBERS = {"RSA": ("e", "kty", "n"), "OKP": ("crv", "kty", "x")}
+
+
+def _thumbprint(jwk: dict[str, Any]) -> str:
+    members = {member: jwk[member] for member in _THUMBPRINT_MEMBERS[jwk["kty"]]}
+    digest = hashlib.sha256(json.dumps(members, separators=(",", ":"), sort_keys=True).encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def _secret_kid(secret: str) -> str:
+    # Only a truncated digest of the secret is exposed in token headers
+    digest = hashlib.sha256(b"fia-auth-kid:" + secret.encode()).digest()
+    return base64.urlsafe_b64encode(digest[:12]).decode()
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    """A parsed key, ready to verify tokens with the given algorithm and, unless verification only, to sign them"""
+
+    kid: str
+    algorithm: str
+    signing_key: Any
+    verification_key: Any
+    public_jwk: dict[str, Any] | None = None
+
+
+def load_signing_key(
+    algorithm: str = JWT_ALGORITHM,
+    secret: str = JWT_SECRET,
+    private_key_pem: str | None = JWT_PRIVATE_KEY,
+    private_key_file: str | None = JWT_PRIVATE_KEY_FILE,
+    public_key_pem: str | None = None,
+    kid: str | None = None,
+) -> SigningKey:
+    """
+    Load and parse a key tokens are signed with. HS256 uses the shared secret, RS256 and EdDSA use a PEM private key
+    given directly or as a file, or only a PEM public key for keys that are kept to verify older tokens
+    :param algorithm: The signing algorithm
+    :param secret: The shared secret used by symmetric algorithms
+    :param private_key_pem: The PEM encoded private key used by asymmetric algorithms
+    :param private_key_file: Path to the PEM encoded private key, used if the key is not given directly
+    :param public_key_pem: The PEM encoded public key of a verification only asymmetric key
+    :param kid: Optional key id, derived from the key when not given
+    :return: The signing key
+    """
+    if algorithm in SYMMETRIC_ALGORITHMS:
+        if not secret:
+            # An empty HMAC key lets anyone forge tokens
+            raise ValueError(f"{algorithm} requires a non-empty secret, set JWT_SECRET")
+        return SigningKey(kid or _secret_kid(secret), algorithm, bytes(secret, encoding="utf8"), secret)
+    if algorithm not in ASYMMETRIC_ALGORITHMS:
+        raise ValueError(f"Unsupported JWT_ALGORITHM {algorithm}")
+
+    private_key = None
+    if private_key_pem is not None:
+        private_key = serialization.load_pem_private_key(private_key_pem.encode(), password=None)
+    elif private_key_file is not None:
+        private_key = serialization.load_pem_private_key(Path(private_key_file).read_bytes(), password=None)
+    elif public_key_pem is None:
+        raise ValueError(f"{algorithm} requires JWT_PRIVATE_KEY or JWT_PRIVATE_KEY_FILE to be set")
+    public_key = (
+        private_key.public_key()
+        if private_key is not None
+        else serialization.load_pem_public_key(str(public_key_pem).encode())
+    )
+
+    if algorithm == "RS256" and isinstance(public_key, RSAPublicKey):
+        jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    elif algorithm == "EdDSA" and isinstance(public_key, Ed25519PublicKey):
+        jwk = OKPAlgorithm.to_jwk(public_key, as_dict=True)
+    else:
+        raise ValueError(f"The configured key cannot be used with {algorithm}")
+    if private_key is not None and not isinstance(private_key, RSAPrivateKey | Ed25519PrivateKey):
+        raise ValueError(f"The configured key cannot be used with {algorithm}")
+    kid = kid or _thumbprint(jwk)
+    public_jwk = {**jwk, "kid": kid, "use": "sig", "alg": algorithm}
+    return SigningKey(kid, algorithm, private_key, public_key, public_jwk)
+
+
+class KeyRing:
+    """
+    The active key new tokens are signed with, and the older keys still accepted when verifying. Keeping retired keys
+    in the ring lets tokens they signed be verified and refreshed, rather than forcing everyone to log in again
+    """
+
+    def __init__(self, active: SigningKey, verification_keys: tuple[SigningKey, ...] = ()) -> None:
+        """
+        Create the key ring
+        :param active: The key used to sign new tokens
+        :param verification_keys: Further keys accepted when verifying tokens
+        """
+        if active.signing_key is None:
+            raise ValueError(f"The active key {active.kid} cannot sign tokens")
+        self.active = active
+        self._keys = {key.kid: key for key in (*verification_keys, active)}
+
+    def __len__(self) -> int:
+        """
+        Return the number of keys in the ring
+        :return: The number of keys
+        """
+        return len(self._keys)
+
+    def get(self, kid: str | None) -> SigningKey | None:
+        """
+        Find the key to verify a token with. Tokens issued before key ids were added have none and use the active key
+        :param kid: The key id from the token header
+        :return: The key, or None if the key id is not in the ring
+        """
+        if kid is None:
+            return self.active
+        return self._keys.get(kid)
+
+    def __iter__(self) -> Iterator[SigningKey]:
+        """
+        Iterate over every key in the ring
+        :return: The keys
+        """
+        return iter(self._keys.values())
+
+
+def load_key_ring_file(path: str) -> KeyRing:
+    """
+    Load a key ring from a JSON file of the form
+    {"active": "<kid>", "keys": [{"kid": "<kid>", "algorithm": "<alg>", "secret" | "private_key" |
+    "private_key_file" | "public_key": "..."}]}
+    :param path: The path of the key ring file
+    :return: The key ring
+    """
+    contents = json.loads(Path(path).read_text(encoding="utf-8"))
+    for spec in contents["keys"]:
+        if spec["algorithm"] in SYMMETRIC_ALGORITHMS and not spec.get("secret"):
+            raise ValueError(f"Key {spec['kid']} uses {spec['algorithm']} but has no secret")
+    keys = [
+        load_signing_key(
+            algorithm=spec["algorithm"],
+            secret=spec.get("secret", ""),
+            private_key_pem=spec.get("private_key"),
+            private_key_file=spec.get("private_key_file"),
+            public_key_pem=spec.get("public_key"),
+            kid=spec["kid"],
+        )
+        for spec in contents["keys"]
+    ]
+    active = next((key for key in keys if key.kid == contents["active"]), None)
+    if active is None:
+        raise ValueError(f"Active key {contents['active']} is not in the key ring")
+    return KeyRing(active, tuple(key for key in keys if key is not active))
+
+
+def _load_configured_key_ring() -> KeyRing:
+    if JWT_KEYRING_FILE is not None:
+        return load_key_ring_file(JWT_KEYRING_FILE)
+    return KeyRing(load_signing_key())
+
+
+_KEY_RING = _load_configured_key_ring()
+_key_ring_mtime = Path(JWT_KEYRING_FILE).stat().st_mtime if JWT_KEYRING_FILE is not None else None
+
+
+def get_key_ring() -> KeyRing:
+    """
+    Return the current key ring. It may be replaced when the key ring file changes, so should not be held on to
+    :return: The key ring
+    """
+    return _KEY_RING
+
+
+def reload_key_ring_if_changed() -> bool:
+    """
+    Reload the key ring if its file has been modified since it was last loaded. A key ring that fails to load is
+    logged and the current key ring kept
+    :return: True if a new key ring was loaded
+    """
+    global _KEY_RING, _key_ring_mtime  # noqa: PLW0603
+    if JWT_KEYRING_FILE is None:
+        return False
+    try:
+        mtime = Path(JWT_KEYRING_FILE).stat().st_mtime
+        if mtime == _key_ring_mtime:
+            return False
+        _KEY_RING = load_key_ring_file(JWT_KEYRING_FILE)
+    except (OSError, ValueError, KeyError):
+        logger.exception("Could not reload the key ring from %s, keeping the current keys", JWT_KEYRING_FILE)
+        return False
+    _key_ring_mtime = mtime
+    logger.info("Reloaded key ring, active key is %s", _KEY_RING.active.kid)
+    return True
+
+
+def jwks(key_ring: KeyRing) -> dict[str, list[dict[str, Any]]]:
+    """
+    Build the JSON Web Key Set publishing the public keys in the key ring. Symmetric keys are never published
+    :param key_ring: The key ring
+    :return: The JSON Web Key Set
+    """
+    return {"keys": [key.public_jwk for key in key_ring if key.public_jwk is not None]}
+
+
+async def reload_key_ring_periodically(interval_seconds: float = JWT_KEYRING_RELOAD_SECONDS) -> None:
+    """
+    Check the key ring file for changes every interval
+    :param interval_seconds: Seconds between checks
+    :return: None
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await asyncio.to_thread(reload_key_ring_if_changed)
@@ -0,0 +1,151 @@
+"""
+Logging configuration. Records are put on a queue by the logging call and written to stdout and the log file by a
+listener thread, so slow disks and log collectors do not hold up requests
+"""
+
+from __future__ import annotations
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import UTC, datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Any
+
+from opentelemetry import trace
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_FILE = os.environ.get("LOG_FILE", "fia-auth.log")
+LOG_ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN", "")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+
+TEXT_FORMAT = "[%(asctime)s]-%(name)s-%(levelname)s: %(message)s"
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+_listener: QueueListener | None = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as one line of JSON, including the trace and span ids when logged inside a span"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format the record
+        :param record: The log record
+        :return: The record as JSON
+        """
+        entry: dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=UTC).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            entry["trace_id"] = trace_id
+            entry["span_id"] = getattr(record, "span_id", None)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Queue handler resolving the parts of a record that depend on the logging thread before it is queued: the message
+    arguments, the exception and the current trace and span ids. Formatting is left to the listener's handlers
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        prepared = copy.copy(record)
+        prepared.message = prepared.msg = record.getMessage()
+        prepared.args = None
+        if record.exc_info:
+            prepared.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+        prepared.exc_info = None
+        span_context = trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            prepared.trace_id = trace.format_trace_id(span_context.trace_id)
+            prepared.span_id = trace.format_span_id(span_context.span_id)
+        return prepared
+
+
+def _file_handler(path: str, rotate_when: str, max_bytes: int, backup_count: int) -> logging.Handler:
+    if rotate_when:
+        return TimedRotatingFileHandler(path, when=rotate_when, backupCount=backup_count, encoding="utf-8", utc=True)
+    return RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+
+def configure_logging(
+    level: str = LOG_LEVEL,
+    log_format: str = LOG_FORMAT,
+    log_file: str = LOG_FILE,
+    rotate_when: str = LOG_ROTATE_WHEN,
+    max_bytes: int = LOG_MAX_BYTES,
+    backup_count: int = LOG_BACKUP_COUNT,
+) -> QueueListener:
+    """
+    Route all logging through a queue to stdout and, unless log_file is empty, a rotating log file. Calling this again
+    replaces the previous configuration
+    :param level: The minimum level logged
+    :param log_format: text or json
+    :param log_file: The log file, or an empty string to only log to stdout
+    :param rotate_when: When to rotate the log file, as accepted by TimedRotatingFileHandler (e.g. midnight). Empty to
+    rotate by size instead
+    :param max_bytes: The size the log file is rotated at, when rotating by size
+    :param backup_count: How many rotated log files are kept
+    :return: The listener writing the queued records
+    """
+    global _listener  # noqa: PLW0603
+    if log_format == "json":
+        formatter: logging.Formatter = JSONFormatter()
+    elif log_format == "text":
+        formatter = logging.Formatter(TEXT_FORMAT)
+    else:
+        raise ValueError(f"Unsupported LOG_FORMAT {log_format}")
+
+    handlers: list[logging.Handler] = [logging.StreamHandler(stream=sys.stdout)]
+    if log_file:
+        handlers.append(_file_handler(log_file, rotate_when, max_bytes, backup_count))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    stop_logging()
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_ContextQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Write out any queued records and stop the listener thread
+    :return: None
+    """
+    global _listener  # noqa: PLW0603
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+atexit.register(stop_logging)
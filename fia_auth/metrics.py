@@ -0,0 +1,152 @@
+"""Prometheus metrics for request latency and the latency, errors and concurrency of upstream calls"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from opentelemetry import trace
+from prometheus_client import Counter, Gauge, Histogram
+
+from fia_auth.tracing import TRACER
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Buckets spanning cached lookups through to slow upstream calls, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram(
+    "fia_auth_request_duration_seconds",
+    "Time taken to handle requests",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "fia_auth_upstream_duration_seconds",
+    "Time taken by calls to upstream services",
+    ["upstream", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "fia_auth_upstream_errors_total",
+    "Calls to upstream services that failed",
+    ["upstream", "operation"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "fia_auth_upstream_in_flight",
+    "Calls to upstream services currently in progress",
+    ["upstream", "operation"],
+)
+UPSTREAM_REJECTIONS = Counter(
+    "fia_auth_upstream_rejections_total",
+    "Calls to upstream services rejected without being made, by circuit breakers and bulkheads",
+    ["upstream", "reason"],
+)
+CIRCUIT_STATE = Gauge(
+    "fia_auth_circuit_breaker_state",
+    "State of the circuit breaker of each upstream service: 0 closed, 1 half open, 2 open",
+    ["upstream"],
+)
+COALESCED_CALLS = Counter(
+    "fia_auth_coalesced_calls_total",
+    "Upstream lookups that joined an identical lookup already in flight instead of making their own",
+    ["call"],
+)
+EXPERIMENTS_INDEX_USERS = Gauge("fia_auth_experiments_index_users", "Users in the experiments index")
+EXPERIMENTS_INDEX_AGE = Gauge(
+    "fia_auth_experiments_index_age_seconds", "Time since the experiments index was synced, 0 if it has not been"
+)
+SHARED_CACHE_LOOKUPS = Counter(
+    "fia_auth_shared_cache_lookups_total", "Keys looked up in the shared cache, by hit or miss", ["namespace", "result"]
+)
+SHARED_CACHE_ERRORS = Counter(
+    "fia_auth_shared_cache_errors_total", "Shared cache operations that failed", ["namespace", "operation"]
+)
+DEPENDENCY_UP = Gauge(
+    "fia_auth_dependency_up", "Whether the latest background health check of each dependency passed", ["dependency"]
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+@contextmanager
+def track_upstream(upstream: str, operation: str) -> Iterator[None]:
+    """
+    Record the latency of an upstream call, counting it as in flight while it runs and as an error if it raises. The
+    call is also traced as a client span, which outgoing requests made within it should propagate
+    :param upstream: The upstream service, e.g. uows
+    :param operation: The operation called on the upstream service
+    :return: None
+    """
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream, operation)
+    with TRACER.start_as_current_span(
+        f"{upstream} {operation}",
+        kind=trace.SpanKind.CLIENT,
+        attributes={"peer.service": upstream, "fia_auth.upstream.operation": operation},
+    ):
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            UPSTREAM_ERRORS.labels(upstream, operation).inc()
+            raise
+        finally:
+            UPSTREAM_LATENCY.labels(upstream, operation).observe(time.perf_counter() - start)
+            in_flight.dec()
+
+
+def record_upstream_error(upstream: str, operation: str) -> None:
+    """
+    Count an upstream call that completed but failed, such as one answered with a server error
+    :param upstream: The upstream service
+    :param operation: The operation called on the upstream service
+    :return: None
+    """
+    UPSTREAM_ERRORS.labels(upstream, operation).inc()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of each HTTP request by method, route template and status. Using the route
+    template rather than the path keeps the number of label values bounded
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        """
+        Wrap the app
+        :param app: The ASGI app
+        """
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Handle a request, timing it if it is HTTP
+        :param scope: The ASGI scope
+        :param receive: The ASGI receive channel
+        :param send: The ASGI send channel
+        :return: None
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(scope["method"], getattr(route, "path", UNMATCHED_ROUTE), str(status)).observe(
+                time.perf_counter() - start
+            )
@@ -1,12 +1,20 @@
 """Internal Models to help abstract and encapsulate the authentication process"""
 
 import enum
+import os
 from dataclasses import dataclass
+from typing import Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from fia_auth.db import is_staff_user
 from fia_auth.roles import is_instrument_scientist
+from fia_auth.tokens import TokenStatus
+
+VERIFY_BATCH_MAX_TOKENS = int(os.environ.get("VERIFY_BATCH_MAX_TOKENS", "500"))
+EXPERIMENTS_BATCH_MAX_USERS = int(os.environ.get("EXPERIMENTS_BATCH_MAX_USERS", "1000"))
+EXPERIMENTS_PAGE_DEFAULT_LIMIT = int(os.environ.get("EXPERIMENTS_PAGE_DEFAULT_LIMIT", "100"))
+EXPERIMENTS_PAGE_MAX_LIMIT = int(os.environ.get("EXPERIMENTS_PAGE_MAX_LIMIT", "1000"))
 
 
 class UserCredentials(BaseModel):
@@ -30,13 +38,12 @@ class User:
     user_number: int
     username: str
 
-    @property
-    def role(self) -> Role:
+    async def get_role(self) -> Role:
         """
         Determine and determine the role of the user based on their usernumber
         :return:
         """
-        if is_staff_user(self.user_number) or is_instrument_scientist(self.user_number):
+        if await is_staff_user(self.user_number) or await is_instrument_scientist(self.user_number):
             return Role.STAFF
         return Role.USER
 
@@ -53,3 +60,29 @@ class ScheduledMaintenanceState(BaseModel):
 
     show: bool
     message: str
+
+
+class TokenBatch(BaseModel):
+    """Model for a batch of access tokens to verify"""
+
+    tokens: list[str] = Field(max_length=VERIFY_BATCH_MAX_TOKENS)
+
+
+class TokenVerification(BaseModel):
+    """Model for the verification result of a single access token"""
+
+    status: TokenStatus
+    claims: dict[str, Any] | None = None
+
+
+class UserNumberBatch(BaseModel):
+    """Model for a batch of user numbers to look up experiments for"""
+
+    user_numbers: list[int] = Field(max_length=EXPERIMENTS_BATCH_MAX_USERS)
+
+
+class ExperimentsPage(BaseModel):
+    """Model for a page of experiment (RB) numbers, with the cursor of the next page if there is one"""
+
+    experiments: list[int]
+    next_cursor: str | None = None
@@ -0,0 +1,242 @@
+"""
+Circuit breakers and bulkheads for upstream calls. A breaker stops calling an upstream that is failing or slow and
+periodically lets a probe through to detect recovery. A bulkhead bounds how many calls to an upstream run at once, so
+requests waiting on one sick upstream cannot take every worker
+"""
+
+from __future__ import annotations
+
+import asyncio
+import enum
+import logging
+import os
+import time
+from collections import deque
+from typing import TYPE_CHECKING, NamedTuple, TypeVar
+
+from fia_auth.exceptions import UpstreamUnavailableError
+from fia_auth.metrics import CIRCUIT_STATE, UPSTREAM_REJECTIONS
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.environ.get("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+CIRCUIT_BREAKER_SLOW_CALL_RATE = float(os.environ.get("CIRCUIT_BREAKER_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_SLOW_CALL_SECONDS", "5"))
+CIRCUIT_BREAKER_MINIMUM_CALLS = int(os.environ.get("CIRCUIT_BREAKER_MINIMUM_CALLS", "10"))
+CIRCUIT_BREAKER_WINDOW_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_WINDOW_SECONDS", "30"))
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+
+T = TypeVar("T")
+
+
+class CircuitState(enum.Enum):
+    """The state of a circuit breaker, valued as reported in the circuit state metric"""
+
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class _Outcome(NamedTuple):
+    finished_at: float
+    failed: bool
+    slow: bool
+
+
+def _never_fails(_: object) -> bool:
+    return False
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of calls to an upstream over a rolling window. Once enough calls have been made and the share
+    that failed or were slow crosses its threshold, the circuit opens and calls are rejected without being made. After
+    open_seconds one probe call is let through: if it succeeds quickly the circuit closes, otherwise it opens again
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+        slow_call_rate: float = CIRCUIT_BREAKER_SLOW_CALL_RATE,
+        slow_call_seconds: float = CIRCUIT_BREAKER_SLOW_CALL_SECONDS,
+        minimum_calls: int = CIRCUIT_BREAKER_MINIMUM_CALLS,
+        window_seconds: float = CIRCUIT_BREAKER_WINDOW_SECONDS,
+        open_seconds: float = CIRCUIT_BREAKER_OPEN_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Create a closed circuit breaker
+        :param name: The upstream the breaker protects, used in logs and metrics
+        :param failure_rate: Share of failed calls in the window at which the circuit opens
+        :param slow_call_rate: Share of slow calls in the window at which the circuit opens
+        :param slow_call_seconds: How long a call may take before it counts as slow
+        :param minimum_calls: Calls needed in the window before the rates are acted on
+        :param window_seconds: How far back call outcomes are considered
+        :param open_seconds: How long the circuit stays open before a probe is let through
+        :param clock: Monotonic clock, only expected to be replaced in tests
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._outcomes: deque[_Outcome] = deque()
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        CIRCUIT_STATE.labels(name).set(CircuitState.CLOSED.value)
+
+    @property
+    def state(self) -> CircuitState:
+        """
+        The current state, moving from open to half open once the open period has passed
+        :return: The state
+        """
+        if self._state is CircuitState.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._set_state(CircuitState.HALF_OPEN)
+        return self._state
+
+    async def call(self, operation: Callable[[], Awaitable[T]], is_failure: Callable[[T], bool] = _never_fails) -> T:
+        """
+        Make the call unless the circuit is open, recording whether it failed or was slow
+        :param operation: The call to make
+        :param is_failure: Whether a call that returned counts as failed, e.g. a server error response
+        :return: The result of the call
+        """
+        probe = self._admit()
+        start = self._clock()
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            if probe:
+                self._probing = False
+            raise
+        except Exception:
+            self._record(start, failed=True, probe=probe)
+            raise
+        self._record(start, failed=is_failure(result), probe=probe)
+        return result
+
+    def _admit(self) -> bool:
+        state = self.state
+        if state is CircuitState.CLOSED:
+            return False
+        if state is CircuitState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        UPSTREAM_REJECTIONS.labels(self.name, "circuit_open").inc()
+        raise UpstreamUnavailableError(
+            f"Circuit breaker for {self.name} is open",
+            retry_after_seconds=max(self.open_seconds - (self._clock() - self._opened_at), 1),
+        )
+
+    def _record(self, start: float, failed: bool, probe: bool) -> None:
+        now = self._clock()
+        slow = now - start >= self.slow_call_seconds
+        if probe:
+            self._probing = False
+            if failed or slow:
+                self._open(now)
+            else:
+                logger.info("Closing circuit breaker for %s after a successful probe", self.name)
+                self._outcomes.clear()
+                self._set_state(CircuitState.CLOSED)
+            return
+        if self._state is not CircuitState.CLOSED:
+            # Calls let through before the circuit opened do not affect it once it has
+            return
+        self._outcomes.append(_Outcome(now, failed, slow))
+        while self._outcomes and now - self._outcomes[0].finished_at > self.window_seconds:
+            self._outcomes.popleft()
+        calls = len(self._outcomes)
+        if calls < self.minimum_calls:
+            return
+        failures = sum(outcome.failed for outcome in self._outcomes)
+        slow_calls = sum(outcome.slow for outcome in self._outcomes)
+        if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        logger.warning("Opening circuit breaker for %s for %s seconds", self.name, self.open_seconds)
+        self._outcomes.clear()
+        self._opened_at = now
+        self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        self._state = state
+        CIRCUIT_STATE.labels(self.name).set(state.value)
+
+
+class Bulkhead:
+    """
+    Bounds the number of concurrent calls to an upstream. Calls beyond the bound wait briefly for a slot and are
+    rejected if none frees up, rather than queueing behind a slow upstream
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait_seconds: float) -> None:
+        """
+        Create the bulkhead
+        :param name: The upstream the bulkhead protects, used in metrics
+        :param max_concurrent: How many calls may run at once
+        :param max_wait_seconds: How long a call waits for a free slot before it is rejected
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait_seconds = max_wait_seconds
+        self.in_use = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def call(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """
+        Make the call once a slot is free
+        :param operation: The call to make
+        :return: The result of the call
+        """
+        try:
+            if not self._semaphore.locked():
+                await self._semaphore.acquire()
+            elif self.max_wait_seconds > 0:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait_seconds)
+            else:
+                raise TimeoutError
+        except TimeoutError:
+            UPSTREAM_REJECTIONS.labels(self.name, "bulkhead_full").inc()
+            raise UpstreamUnavailableError(
+                f"Too many calls to {self.name} in progress, limit is {self.max_concurrent}"
+            ) from None
+        self.in_use += 1
+        try:
+            return await operation()
+        finally:
+            self.in_use -= 1
+            self._semaphore.release()
+
+
+class UpstreamGuard:
+    """The bulkhead and circuit breaker protecting one upstream service"""
+
+    def __init__(self, name: str, max_concurrent: int, max_wait_seconds: float) -> None:
+        """
+        Create the guard
+        :param name: The upstream service
+        :param max_concurrent: How many calls to the upstream may run at once
+        :param max_wait_seconds: How long a call waits for a free slot before it is rejected
+        """
+        self.bulkhead = Bulkhead(name, max_concurrent, max_wait_seconds)
+        self.breaker = CircuitBreaker(name)
+
+    async def call(self, operation: Callable[[], Awaitable[T]], is_failure: Callable[[T], bool] = _never_fails) -> T:
+        """
+        Make the call through the bulkhead and circuit breaker
+        :param operation: The call to make
+        :param is_failure: Whether a call that returned counts as failed
+        :return: The result of the call
+        """
+        return await self.bulkhead.call(lambda: self.breaker.call(operation, is_failure))
@@ -4,26 +4,90 @@ import logging
 import os
 from http import HTTPStatus
 
-import requests
+import httpx
+
+from fia_auth.cache import TTLCache
+from fia_auth.exceptions import UpstreamUnavailableError
+from fia_auth.shared_cache import CACHE_LOCAL_COPY_TTL_SECONDS, CacheNamespace
+from fia_auth.singleflight import SingleFlight
+from fia_auth.tracing import TRACER
+from fia_auth.uows import get_uows_client
 
 logger = logging.getLogger(__name__)
 
+ROLE_CACHE_POSITIVE_TTL_SECONDS = float(os.environ.get("ROLE_CACHE_POSITIVE_TTL_SECONDS", "3600"))
+ROLE_CACHE_NEGATIVE_TTL_SECONDS = float(os.environ.get("ROLE_CACHE_NEGATIVE_TTL_SECONDS", "300"))
+ROLE_CACHE_MAX_ENTRIES = int(os.environ.get("ROLE_CACHE_MAX_ENTRIES", "50000"))
+
+ROLE_CACHE: TTLCache[int, bool] = TTLCache(
+    "roles", ttl_seconds=ROLE_CACHE_POSITIVE_TTL_SECONDS, max_entries=ROLE_CACHE_MAX_ENTRIES
+)
+
+ROLE_SHARED_CACHE = CacheNamespace("roles", ttl_seconds=ROLE_CACHE_POSITIVE_TTL_SECONDS)
+
+ROLE_LOOKUPS: SingleFlight[int, bool] = SingleFlight("roles")
 
-def is_instrument_scientist(user_number: int) -> bool:
+
+async def is_instrument_scientist(user_number: int) -> bool:
     """
-    Check if the user number is an instrument scientist according to UOWs (User Office Web Service).
+    Check if the user number is an instrument scientist according to UOWs (User Office Web Service). Definitive
+    answers are cached, positive and negative results for separate lengths of time, and concurrent checks of the same
+    uncached user number share one UOWS call. With a shared cache backend, roles cached by other workers and replicas
+    are used before asking the UOWS.
     :param user_number: The user number assigned to each user from UOWs
     :return: True if the user number is an instrument scientist, false if not or failed connection.
     """
-    uows_url = os.environ.get("UOWS_URL", "https://devapi.facilities.rl.ac.uk/users-service")
-    uows_api_key = os.environ.get("UOWS_API_KEY", "")
-    response = requests.get(
-        url=f"{uows_url}/v1/role/{user_number}",
-        headers={"Authorization": f"Api-key {uows_api_key}", "accept": "application/json"},
-        timeout=5,
-    )
+    cached = ROLE_CACHE.get(int(user_number))
+    if cached is not None:
+        return cached
+    # Only misses are traced, a span costs several times more than a cache hit
+    with TRACER.start_as_current_span("roles.is_instrument_scientist"):
+        return await ROLE_LOOKUPS.do(int(user_number), lambda: _lookup_is_instrument_scientist(user_number))
+
+
+async def _lookup_is_instrument_scientist(user_number: int) -> bool:
+    if ROLE_SHARED_CACHE.shared:
+        shared = await ROLE_SHARED_CACHE.get(int(user_number))
+        if shared is not None:
+            # Kept locally only briefly, so invalidations made through other replicas are picked up
+            ROLE_CACHE.set(int(user_number), bool(shared), ttl_seconds=CACHE_LOCAL_COPY_TTL_SECONDS)
+            return bool(shared)
+    return await _fetch_is_instrument_scientist(user_number)
+
+
+async def _remember(user_number: int, result: bool, ttl_seconds: float) -> None:
+    if ROLE_SHARED_CACHE.shared:
+        await ROLE_SHARED_CACHE.set(int(user_number), result, ttl_seconds=ttl_seconds)
+        # As for copies of shared entries, so invalidations made through other replicas are picked up
+        ttl_seconds = min(ttl_seconds, CACHE_LOCAL_COPY_TTL_SECONDS)
+    ROLE_CACHE.set(int(user_number), result, ttl_seconds=ttl_seconds)
+
+
+async def _fetch_is_instrument_scientist(user_number: int) -> bool:
+    try:
+        response = await get_uows_client().get_roles(user_number)
+    except (httpx.HTTPError, UpstreamUnavailableError) as exc:
+        logger.warning("Could not reach the UOWS to check roles for user number %s: %s", user_number, exc)
+        return False
     if response.status_code != HTTPStatus.OK:
         logger.info("User number %s is not an instrument scientist or UOWS API is down", user_number)
+        if response.status_code < HTTPStatus.INTERNAL_SERVER_ERROR:
+            await _remember(user_number, False, ROLE_CACHE_NEGATIVE_TTL_SECONDS)
         return False
     roles = response.json()
-    return {"name": "ISIS Instrument Scientist"} in roles
+    result = {"name": "ISIS Instrument Scientist"} in roles
+    await _remember(user_number, result, ROLE_CACHE_POSITIVE_TTL_SECONDS if result else ROLE_CACHE_NEGATIVE_TTL_SECONDS)
+    return result
+
+
+async def invalidate_role(user_number: int) -> bool:
+    """
+    Forget the cached role of the given user number so the next check asks the UOWS. Other workers and replicas
+    forget it once their short lived local copy expires
+    :param user_number: The user number
+    :return: True if a role was cached for the user number
+    """
+    invalidated = ROLE_CACHE.invalidate(int(user_number))
+    if ROLE_SHARED_CACHE.shared:
+        invalidated = await ROLE_SHARED_CACHE.delete(int(user_number)) or invalidated
+    return invalidated
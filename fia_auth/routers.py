@@ -4,19 +4,53 @@ from __future__ import annotations
 
 import logging
 import os
+from collections import Counter
 from http import HTTPStatus
-from typing import Annotated, Any, Literal
+from typing import TYPE_CHECKING, Annotated, Any, Literal
 
-from fastapi import APIRouter, Cookie, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Cookie, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from fia_auth.auth import authenticate
-from fia_auth.db import ensure_db_connection
-from fia_auth.exceptions import UOWSError
-from fia_auth.experiments import get_experiments_for_user_number
-from fia_auth.model import MaintenanceState, ScheduledMaintenanceState, UserCredentials  # Required for fastapi
-from fia_auth.tokens import generate_access_token, generate_refresh_token, load_access_token, load_refresh_token
+from fia_auth.cache import cache_statistics
+from fia_auth.db import pool_statistics
+from fia_auth.exceptions import UOWSError, UOWSUnavailableError
+from fia_auth.experiments import (
+    EXPERIMENTS_INDEX,
+    decode_experiments_cursor,
+    encode_experiments_cursor,
+    get_experiments_for_user_number,
+    get_experiments_for_user_numbers,
+    get_experiments_page,
+    iter_experiments_for_user_number,
+)
+from fia_auth.health import HEALTH_MONITOR
+from fia_auth.keys import JWKS_MAX_AGE_SECONDS, get_key_ring, jwks
+from fia_auth.model import (  # Required for fastapi
+    EXPERIMENTS_PAGE_DEFAULT_LIMIT,
+    EXPERIMENTS_PAGE_MAX_LIMIT,
+    ExperimentsPage,
+    MaintenanceState,
+    ScheduledMaintenanceState,
+    TokenBatch,
+    TokenVerification,
+    UserCredentials,
+    UserNumberBatch,
+)
+from fia_auth.roles import invalidate_role
+from fia_auth.tokens import (
+    TokenStatus,
+    check_access_token,
+    generate_access_token,
+    generate_refresh_token,
+    load_access_token,
+    load_refresh_token,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, AsyncIterator
 
 ROUTER = APIRouter()
 
@@ -24,9 +58,16 @@ security = HTTPBearer(scheme_name="APIKey", description="API Key for internal ro
 
 API_KEY = os.environ.get("FIA_AUTH_API_KEY", "shh")
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 logger = logging.getLogger(__name__)
 
 
+def _check_api_key(credentials: HTTPAuthorizationCredentials) -> None:
+    if credentials.credentials != API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
 @ROUTER.get("/healthz", tags=["health"])
 async def health() -> Literal["ok"]:
     """Health check endpoint used by the liveness probe."""
@@ -35,13 +76,44 @@ async def health() -> Literal["ok"]:
 
 @ROUTER.get("/ready", tags=["health"])
 async def ready() -> Literal["ok"]:
-    """Readiness probe endpoint that verifies database connectivity."""
-    try:
-        ensure_db_connection()
-        return "ok"
-    except Exception as exc:  # pragma: no cover - defensive, logged for observability
-        logger.exception("Database connection failed", exc_info=exc)
-        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE) from exc
+    """Readiness probe endpoint, ready once the background health monitor has recently reached the database."""
+    if not HEALTH_MONITOR.ready:
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE)
+    return "ok"
+
+
+@ROUTER.get("/health/dependencies", tags=["health"])
+async def health_dependencies() -> dict[str, Any]:
+    r"""
+    Get the latest background health check of each dependency: whether it passed, how long ago it ran, how long it
+    took and why it failed
+    \f
+    :return: The readiness of the service and the status of each dependency
+    """
+    return HEALTH_MONITOR.report()
+
+
+@ROUTER.get("/metrics", tags=["health"])
+def metrics() -> Response:
+    r"""
+    Get request and upstream call metrics in the Prometheus text format
+    \f
+    :return: The metrics
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@ROUTER.get("/.well-known/jwks.json", tags=["auth"])
+def get_jwks() -> JSONResponse:
+    r"""
+    Get the public keys access tokens are signed with, including retired keys that are still accepted, allowing other
+    services to verify tokens locally. Empty when tokens are signed with a shared secret
+    \f
+    :return: The JSON Web Key Set
+    """
+    return JSONResponse(
+        content=jwks(get_key_ring()), headers={"Cache-Control": f"public, max-age={JWKS_MAX_AGE_SECONDS}"}
+    )
 
 
 @ROUTER.get(
@@ -54,7 +126,7 @@ def get_maintenance_state() -> MaintenanceState:
     This API does not run a maintenance mode, but the frontend library requires this endpoint.
     It always returns False.
     """
-    logger.info("Getting maintenance state")
+    logger.debug("Getting maintenance state")
     return MaintenanceState(show=False, message="Maintenance mode is not supported by this API.")
 
 
@@ -70,25 +142,118 @@ def get_scheduled_maintenance_state() -> ScheduledMaintenanceState:
     This API does not run a maintenance mode, but the frontend library requires this endpoint.
     It always returns False.
     """
-    logger.info("Getting scheduled maintenance state")
+    logger.debug("Getting scheduled maintenance state")
     return ScheduledMaintenanceState(show=False, message="Scheduled maintenance mode is not supported by this API.")
 
 
-@ROUTER.get("/experiments", tags=["internal"])
+async def _ndjson(first_page: list[int], pages: AsyncGenerator[list[int]]) -> AsyncIterator[bytes]:
+    try:
+        yield "".join(f"{experiment}\n" for experiment in first_page).encode()
+        async for page in pages:
+            yield "".join(f"{experiment}\n" for experiment in page).encode()
+    finally:
+        await pages.aclose()
+
+
+@ROUTER.get(
+    "/experiments",
+    tags=["internal"],
+    response_model=None,
+    responses={
+        HTTPStatus.OK: {
+            "model": list[int] | ExperimentsPage,
+            "content": {NDJSON_MEDIA_TYPE: {"schema": {"type": "integer"}}},
+        }
+    },
+)
 async def get_experiments(
+    user_number: int,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    limit: Annotated[int | None, Query(ge=1, le=EXPERIMENTS_PAGE_MAX_LIMIT)] = None,
+    cursor: str | None = None,
+    accept: Annotated[str | None, Header()] = None,
+) -> list[int] | ExperimentsPage | StreamingResponse:
+    r"""
+    Get the experiment (RB) numbers for the given user number provided by query string parameter.
+
+    Given a limit or cursor, one page is returned along with the cursor of the next page, which is null on the last
+    page. Requested with `Accept: application/x-ndjson`, the numbers are streamed one per line as they are fetched
+    from the allocations API, starting from the cursor if one is given.
+
+    \f
+    :param user_number: The user number
+    :param credentials: The API Key
+    :param limit: The most experiments in a page
+    :param cursor: The cursor returned with the previous page
+    :param accept: The accepted media types
+    :return: A list or page of experiment (RB) Numbers for the given user, or a stream of them
+    """
+    _check_api_key(credentials)
+    if limit is None and cursor is None and (accept is None or NDJSON_MEDIA_TYPE not in accept):
+        return await get_experiments_for_user_number(user_number)
+    try:
+        offset = 0 if cursor is None else decode_experiments_cursor(cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor") from exc
+    if accept is not None and NDJSON_MEDIA_TYPE in accept:
+        pages = iter_experiments_for_user_number(user_number, offset)
+        # The first page is fetched before responding, so an unavailable allocations API still fails the request
+        first_page: list[int] = await anext(pages, [])
+        return StreamingResponse(_ndjson(first_page, pages), media_type=NDJSON_MEDIA_TYPE)
+    page, next_offset = await get_experiments_page(user_number, offset, limit or EXPERIMENTS_PAGE_DEFAULT_LIMIT)
+    return ExperimentsPage(
+        experiments=page, next_cursor=None if next_offset is None else encode_experiments_cursor(next_offset)
+    )
+
+
+@ROUTER.post("/experiments/batch", tags=["internal"])
+async def get_experiments_batch(
+    batch: UserNumberBatch, credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
+) -> dict[int, list[int]]:
+    r"""
+    Get the experiment (RB) numbers for many user numbers at once
+
+    \f
+    :param batch: The user numbers
+    :param credentials: The API Key
+    :return: The experiment (RB) numbers keyed by user number
+    """
+    _check_api_key(credentials)
+    return await get_experiments_for_user_numbers(batch.user_numbers)
+
+
+@ROUTER.delete("/roles/{user_number}/cache", tags=["internal"])
+async def delete_cached_role(
     user_number: int, credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
-) -> list[int]:
+) -> dict[str, bool]:
     r"""
-    Get the experiment (RB) numbers for the given user number provided by query string parameter
+    Forget the cached role of the given user number, so a role change in the UOWS is picked up on their next login
 
     \f
     :param user_number: The user number
     :param credentials: The API Key
-    :return: A list of experiment (RB) Numbers for the given user
+    :return: Whether a cached role was removed
     """
-    if credentials.credentials != API_KEY:
-        raise HTTPException(status_code=403, detail="Forbidden")
-    return await get_experiments_for_user_number(user_number)
+    _check_api_key(credentials)
+    return {"invalidated": await invalidate_role(user_number)}
+
+
+@ROUTER.get("/stats", tags=["internal"])
+async def get_stats(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]) -> dict[str, Any]:
+    r"""
+    Get the internal statistics of the service, such as cache hit, miss and eviction counts, database pool usage and
+    the size and age of the experiments index
+
+    \f
+    :param credentials: The API Key
+    :return: The statistics
+    """
+    _check_api_key(credentials)
+    return {
+        "caches": cache_statistics(),
+        "db_pools": pool_statistics(),
+        "experiments_index": EXPERIMENTS_INDEX.snapshot(),
+    }
 
 
 @ROUTER.post("/login", tags=["auth"])
@@ -101,9 +266,9 @@ async def login(credentials: UserCredentials) -> JSONResponse:
     """
     logger.info("Starting login for user %s", (credentials.username[0:3] + "****"))
     try:
-        user_number = authenticate(credentials)
+        user = await authenticate(credentials)
         refresh_token = generate_refresh_token().jwt
-        access_token = generate_access_token(user_number).jwt
+        access_token = (await generate_access_token(user)).jwt
         response = JSONResponse(content=access_token, status_code=200)
         response.set_cookie(
             "refresh_token",
@@ -114,6 +279,8 @@ async def login(credentials: UserCredentials) -> JSONResponse:
             samesite="lax",
         )  # 12 hours
         return response
+    except UOWSUnavailableError:
+        raise
     except UOWSError as exc:
         raise HTTPException(status_code=403, detail="Forbidden") from exc
 
@@ -126,14 +293,33 @@ def verify(token: dict[str, Any]) -> Literal["ok"]:
     :param token: The JWT
     :return: "OK"
     """
-    logger.info("Verifying token")
+    logger.debug("Verifying token")
     load_access_token(token["token"]).verify()
-    logger.info("Token verified successfully")
+    logger.debug("Token verified successfully")
     return "ok"
 
 
+@ROUTER.post("/verify/batch")
+def verify_batch(batch: TokenBatch) -> list[TokenVerification]:
+    r"""
+    Verify many access tokens in one request. Unlike /verify, invalid tokens do not fail the request, instead each
+    token gets its own result in the order given
+    \f
+    :param batch: The JWTs
+    :return: The status of each token, and the claims of the valid ones
+    """
+    results = []
+    for token in batch.tokens:
+        status, claims = check_access_token(token)
+        results.append(TokenVerification(status=status, claims=claims))
+    invalid = Counter(result.status.value for result in results if result.status is not TokenStatus.VALID)
+    if invalid:
+        logger.info("Verified batch of %s tokens, invalid: %s", len(results), dict(invalid))
+    return results
+
+
 @ROUTER.post("/refresh")
-def refresh(
+async def refresh(
     body: dict[str, Any], refresh_token: Annotated[str | None, Cookie(alias="refresh_token")] = None
 ) -> JSONResponse:
     r"""
@@ -146,5 +332,5 @@ def refresh(
     access_token = load_access_token(body["token"])
     loaded_refresh_token = load_refresh_token(refresh_token)
     loaded_refresh_token.verify()
-    access_token.refresh()
+    await access_token.refresh()
     return JSONResponse(content=access_token.jwt)
@@ -0,0 +1,335 @@
+"""
+Caches of upstream lookups that may be shared between uvicorn workers and replicas. Values are stored as JSON under
+namespaced keys in a backend: an in-process LRU by default, or Redis so that every worker and replica shares one copy
+and the UOWS sees one lookup per user rather than one per worker
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Protocol
+
+from fia_auth.cache import TTLCache
+from fia_auth.metrics import SHARED_CACHE_ERRORS, SHARED_CACHE_LOOKUPS
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "local")
+CACHE_KEY_PREFIX = os.environ.get("CACHE_KEY_PREFIX", "fia-auth")
+CACHE_LOCAL_MAX_ENTRIES = int(os.environ.get("CACHE_LOCAL_MAX_ENTRIES", "50000"))
+CACHE_LOCAL_COPY_TTL_SECONDS = float(os.environ.get("CACHE_LOCAL_COPY_TTL_SECONDS", "60"))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_TIMEOUT_SECONDS = float(os.environ.get("CACHE_REDIS_TIMEOUT_SECONDS", "0.25"))
+
+
+class CacheBackend(Protocol):
+    """Stores bytes under string keys, each with a time to live"""
+
+    @property
+    def shared(self) -> bool:
+        """
+        Whether other workers and replicas see the same entries
+        :return: True if the backend is shared
+        """
+
+    async def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        """
+        Get the values of the keys
+        :param keys: The keys
+        :return: The value of each key in order, None where it is missing
+        """
+
+    async def set_many(self, items: Mapping[str, bytes], ttl_seconds: float) -> None:
+        """
+        Store the values
+        :param items: The values keyed by key
+        :param ttl_seconds: How long the values are kept for
+        :return: None
+        """
+
+    async def delete_many(self, keys: Sequence[str]) -> int:
+        """
+        Remove the keys
+        :param keys: The keys
+        :return: The number of keys that were stored
+        """
+
+    async def close(self) -> None:
+        """
+        Release any connections held by the backend
+        :return: None
+        """
+
+
+class LocalCacheBackend:
+    """In-process LRU backend, entries are only seen by the worker that stored them"""
+
+    shared = False
+
+    def __init__(self, max_entries: int = CACHE_LOCAL_MAX_ENTRIES) -> None:
+        """
+        Create the backend
+        :param max_entries: Maximum number of entries before the least recently used is evicted
+        """
+        self.cache: TTLCache[str, bytes] = TTLCache("shared", ttl_seconds=0, max_entries=max_entries)
+
+    async def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        """
+        Get the values of the keys
+        :param keys: The keys
+        :return: The value of each key in order, None where it is missing or expired
+        """
+        return [self.cache.get(key) for key in keys]
+
+    async def set_many(self, items: Mapping[str, bytes], ttl_seconds: float) -> None:
+        """
+        Store the values
+        :param items: The values keyed by key
+        :param ttl_seconds: How long the values are kept for
+        :return: None
+        """
+        for key, value in items.items():
+            self.cache.set(key, value, ttl_seconds=ttl_seconds)
+
+    async def delete_many(self, keys: Sequence[str]) -> int:
+        """
+        Remove the keys
+        :param keys: The keys
+        :return: The number of keys that were stored
+        """
+        return sum(self.cache.invalidate(key) for key in keys)
+
+    async def close(self) -> None:
+        """
+        Nothing to release for the in-process backend
+        :return: None
+        """
+
+
+class RedisClient(Protocol):
+    """The part of the redis.asyncio.Redis interface used by the Redis backend"""
+
+    async def mget(self, keys: Sequence[str]) -> list[bytes | None]: ...  # noqa: D102
+
+    async def delete(self, *names: str) -> int: ...  # noqa: D102
+
+    def pipeline(self, transaction: bool = True) -> Any: ...  # noqa: D102
+
+    async def aclose(self) -> None: ...  # noqa: D102
+
+
+class RedisCacheBackend:
+    """
+    Redis backend shared by every worker and replica using the same Redis. Bulk gets are a single MGET and bulk sets
+    are pipelined, so each costs one round trip whatever the number of keys
+    """
+
+    shared = True
+
+    def __init__(self, client: RedisClient) -> None:
+        """
+        Create the backend
+        :param client: A redis.asyncio client, or anything with the same interface
+        """
+        self._client = client
+
+    async def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        """
+        Get the values of the keys with one MGET
+        :param keys: The keys
+        :return: The value of each key in order, None where it is missing
+        """
+        if not keys:
+            return []
+        return await self._client.mget(keys)
+
+    async def set_many(self, items: Mapping[str, bytes], ttl_seconds: float) -> None:
+        """
+        Store the values in one pipelined round trip
+        :param items: The values keyed by key
+        :param ttl_seconds: How long the values are kept for
+        :return: None
+        """
+        if not items:
+            return
+        ttl_milliseconds = max(1, int(ttl_seconds * 1000))
+        pipeline = self._client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipeline.set(key, value, px=ttl_milliseconds)
+        await pipeline.execute()
+
+    async def delete_many(self, keys: Sequence[str]) -> int:
+        """
+        Remove the keys
+        :param keys: The keys
+        :return: The number of keys that were stored
+        """
+        if not keys:
+            return 0
+        return await self._client.delete(*keys)
+
+    async def close(self) -> None:
+        """
+        Close the connection pool of the client
+        :return: None
+        """
+        await self._client.aclose()
+
+
+def _create_backend(kind: str) -> CacheBackend:
+    if kind == "local":
+        return LocalCacheBackend()
+    if kind == "redis":
+        try:
+            from redis.asyncio import Redis  # type: ignore[import-not-found,unused-ignore]  # noqa: PLC0415
+        except ImportError as exc:
+            raise RuntimeError("CACHE_BACKEND is redis but redis is not installed, install fia-auth[redis]") from exc
+        logger.info("Using the Redis cache backend")
+        client = Redis.from_url(
+            CACHE_REDIS_URL,
+            socket_timeout=CACHE_REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=CACHE_REDIS_TIMEOUT_SECONDS,
+        )
+        return RedisCacheBackend(client)
+    raise ValueError(f"Unknown CACHE_BACKEND {kind!r}, expected local or redis")
+
+
+_BACKEND: CacheBackend | None = None
+
+
+def get_cache_backend() -> CacheBackend:
+    """
+    Return the configured cache backend, creating it on first use
+    :return: The cache backend
+    """
+    global _BACKEND  # noqa: PLW0603
+    if _BACKEND is None:
+        _BACKEND = _create_backend(CACHE_BACKEND)
+    return _BACKEND
+
+
+async def close_cache_backend() -> None:
+    """
+    Close the cache backend if it has been created
+    :return: None
+    """
+    global _BACKEND  # noqa: PLW0603
+    if _BACKEND is not None:
+        await _BACKEND.close()
+        _BACKEND = None
+
+
+class CacheNamespace:
+    """
+    The entries of one kind of lookup in the cache backend, stored as JSON under keys prefixed with the namespace.
+    Backend errors are logged and treated as misses, so an unavailable cache slows lookups down rather than failing them
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, backend: CacheBackend | None = None) -> None:
+        """
+        Create the namespace
+        :param name: The namespace, used in keys and metrics
+        :param ttl_seconds: Default time to live of the entries
+        :param backend: The backend, defaulting to the configured one
+        """
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._backend = backend
+
+    @property
+    def backend(self) -> CacheBackend:
+        """
+        The backend holding the entries
+        :return: The backend
+        """
+        return get_cache_backend() if self._backend is None else self._backend
+
+    @property
+    def shared(self) -> bool:
+        """
+        Whether entries are shared with other workers and replicas. Callers that keep their own in-process cache only
+        need to consult a shared namespace
+        :return: True if the backend is shared
+        """
+        return self.backend.shared
+
+    def key(self, key: object) -> str:
+        """
+        Return the backend key for a key in the namespace
+        :param key: The key
+        :return: The backend key
+        """
+        return f"{CACHE_KEY_PREFIX}:{self.name}:{key}"
+
+    async def get(self, key: object) -> Any | None:
+        """
+        Get the value of the key
+        :param key: The key
+        :return: The value, or None if it is missing
+        """
+        return (await self.get_many([key])).get(key)
+
+    async def get_many(self, keys: Iterable[Any]) -> dict[Any, Any]:
+        """
+        Get the values of many keys at once
+        :param keys: The keys
+        :return: The values of the keys found
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = await self.backend.get_many([self.key(key) for key in keys])
+        except Exception as exc:
+            self._failed("get", exc)
+            return {}
+        found = {key: json.loads(value) for key, value in zip(keys, values, strict=True) if value is not None}
+        SHARED_CACHE_LOOKUPS.labels(self.name, "hit").inc(len(found))
+        SHARED_CACHE_LOOKUPS.labels(self.name, "miss").inc(len(keys) - len(found))
+        return found
+
+    async def set(self, key: object, value: Any, ttl_seconds: float | None = None) -> None:
+        """
+        Store the value of the key
+        :param key: The key
+        :param value: The value, which must be JSON serialisable
+        :param ttl_seconds: Optional ttl overriding the namespace default
+        :return: None
+        """
+        await self.set_many({key: value}, ttl_seconds)
+
+    async def set_many(self, items: Mapping[Any, Any], ttl_seconds: float | None = None) -> None:
+        """
+        Store the values of many keys at once
+        :param items: The values keyed by key, which must be JSON serialisable
+        :param ttl_seconds: Optional ttl overriding the namespace default
+        :return: None
+        """
+        if not items:
+            return
+        encoded = {self.key(key): json.dumps(value, separators=(",", ":")).encode() for key, value in items.items()}
+        try:
+            await self.backend.set_many(encoded, self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        except Exception as exc:
+            self._failed("set", exc)
+
+    async def delete(self, key: object) -> bool:
+        """
+        Remove the key
+        :param key: The key
+        :return: True if the key was stored
+        """
+        try:
+            return await self.backend.delete_many([self.key(key)]) > 0
+        except Exception as exc:
+            self._failed("delete", exc)
+            return False
+
+    def _failed(self, operation: str, exc: Exception) -> None:
+        SHARED_CACHE_ERRORS.labels(self.name, operation).inc()
+        logger.warning("Could not %s %s entries in the cache: %s", operation, self.name, exc)
@@ -0,0 +1,61 @@
+"""Coalescing of concurrent identical upstream calls, so callers asking for the same thing at once share one call"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Generic, TypeVar
+
+from fia_auth.metrics import COALESCED_CALLS
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Hashable
+
+K = TypeVar("K", bound="Hashable")
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Runs at most one call per key at a time. Callers arriving while a call for their key is in flight wait for it and
+    receive the same result, or the same exception, instead of making their own. Once the call finishes the key is
+    forgotten, so results are not cached
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        Create the group
+        :param name: The call being coalesced, used in metrics
+        """
+        self.name = name
+        self._calls: dict[K, asyncio.Task[V]] = {}
+
+    def __len__(self) -> int:
+        """
+        Return the number of calls in flight
+        :return: The number of calls
+        """
+        return len(self._calls)
+
+    async def do(self, key: K, call: Callable[[], Awaitable[V]]) -> V:
+        """
+        Make the call for the key, or join the one already in flight
+        :param key: Identifies the call, e.g. its arguments
+        :param call: Makes the call, only used if none is in flight for the key
+        :return: The result of the call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            COALESCED_CALLS.labels(self.name).inc()
+        # Shielded so one caller being cancelled does not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: K, task: asyncio.Task[V]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every caller was cancelled before the call failed
+            task.exception()
@@ -2,62 +2,289 @@
 
 from __future__ import annotations
 
+import binascii
+import enum
+import functools
+import hashlib
+import hmac
+import json
 import logging
 import os
+import time
 from abc import ABC
+from calendar import timegm
 from datetime import UTC, datetime, timedelta
 from typing import TYPE_CHECKING, Any
 
 import jwt
+from jwt.utils import base64url_decode, base64url_encode
 
-from fia_auth.exceptions import BadJWTError
+from fia_auth.cache import TTLCache
+from fia_auth.exceptions import BadJWTError, BadJWTSignatureError, ExpiredJWTError, ProposalAllocationsError
+from fia_auth.experiments import get_experiments_for_user_number
+from fia_auth.keys import get_key_ring
 
 if TYPE_CHECKING:
+    from fia_auth.keys import KeyRing, SigningKey
     from fia_auth.model import User
 
 
-PRIVATE_KEY = os.environ.get("JWT_SECRET", "shh")
 ACCESS_TOKEN_LIFETIME_MINUTES = int(os.environ.get("ACCESS_TOKEN_LIFETIME_MINUTES", str(10)))
+VERIFIED_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("VERIFIED_TOKEN_CACHE_MAX_ENTRIES", "100000"))
+ACCESS_TOKEN_EXPERIMENTS_CLAIM = os.environ.get("ACCESS_TOKEN_EXPERIMENTS_CLAIM", "false").lower() == "true"
+ACCESS_TOKEN_EXPERIMENTS_MAX = int(os.environ.get("ACCESS_TOKEN_EXPERIMENTS_MAX", "200"))
+
+# Value of the experiments claim when the user's experiments must be looked up via /experiments instead
+EXPERIMENTS_LOOKUP_REQUIRED = "lookup"
 
 logger = logging.getLogger(__name__)
 
+# Payloads of tokens that passed verification, keyed by a digest of the token and expiring with the token
+VERIFIED_TOKEN_CACHE: TTLCache[bytes, dict[str, Any]] = TTLCache(
+    "verified_tokens", ttl_seconds=0, max_entries=VERIFIED_TOKEN_CACHE_MAX_ENTRIES
+)
+_verified_token_key_ring: KeyRing = get_key_ring()
+
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def token_fingerprint(token: str) -> str:
+    """
+    Short digest identifying a token in logs without revealing it
+    :param token: The encoded token
+    :return: The first 12 hex characters of the token's sha256
+    """
+    return hashlib.sha256(token.encode()).hexdigest()[:12]
+
+
+def _get_verified_payload(token: str) -> dict[str, Any] | None:
+    global _verified_token_key_ring  # noqa: PLW0603
+    key_ring = get_key_ring()
+    if _verified_token_key_ring is not key_ring:
+        # The keys have changed, so nothing verified with a removed key can be trusted
+        VERIFIED_TOKEN_CACHE.clear()
+        _verified_token_key_ring = key_ring
+    payload = VERIFIED_TOKEN_CACHE.get(_token_digest(token))
+    return None if payload is None else dict(payload)
+
+
+def _cache_verified_payload(token: str, payload: dict[str, Any]) -> None:
+    exp = payload.get("exp")
+    if isinstance(exp, int | float) and _verified_token_key_ring is get_key_ring():
+        VERIFIED_TOKEN_CACHE.set(_token_digest(token), dict(payload), ttl_seconds=exp - time.time())
+
+
+def _verification_key(token: str) -> SigningKey:
+    """
+    Select the key a token was signed with from the kid in its header. Tokens without a kid, or whose header cannot be
+    read, are checked against the active key so that decoding reports the problem
+    :param token: The jwt string
+    :return: The key to verify the token with
+    """
+    key_ring = get_key_ring()
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except jwt.DecodeError:
+        return key_ring.active
+    key = key_ring.get(kid if isinstance(kid, str) else None)
+    if key is None:
+        raise jwt.InvalidSignatureError(f"Token was signed with unknown key {kid}")
+    return key
+
+
+class HS256Codec:
+    """
+    Encoder and decoder for HS256 tokens signed with one key, producing the same bytes as PyJWT. The header segment
+    and HMAC key are prepared once, rather than on every token as PyJWT does. Only tokens with exactly the expected
+    header and an integer exp, and none of the registered claims the codec does not check, are decoded directly, other
+    tokens return None so they can be decoded by PyJWT
+    """
+
+    # Registered claims PyJWT validates that are never issued by fia-auth
+    _DELEGATED_CLAIMS = frozenset(("iat", "nbf", "aud", "iss", "sub", "jti"))
+
+    def __init__(self, kid: str, secret: bytes) -> None:
+        """
+        Create the codec
+        :param kid: The key id placed in the token header
+        :param secret: The HMAC secret, which must not be empty
+        """
+        if not secret:
+            raise ValueError("HMAC key must not be empty")
+        header = json.dumps({"alg": "HS256", "kid": kid, "typ": "JWT"}, separators=(",", ":"), sort_keys=True)
+        self._header_segment = base64url_encode(header.encode())
+        self.prefix = self._header_segment.decode() + "."
+        self._hmac = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        mac = self._hmac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, payload: dict[str, Any]) -> str:
+        """
+        Encode and sign the payload. Datetime time claims are converted to integers as PyJWT does
+        :param payload: The claims
+        :return: The jwt string
+        """
+        claims = dict(payload)
+        for claim in ("exp", "iat", "nbf"):
+            if isinstance(claims.get(claim), datetime):
+                claims[claim] = timegm(claims[claim].utctimetuple())
+        signing_input = (
+            self._header_segment + b"." + base64url_encode(json.dumps(claims, separators=(",", ":")).encode())
+        )
+        return (signing_input + b"." + base64url_encode(self._sign(signing_input))).decode()
+
+    def decode(self, token: str, verify_exp: bool = True) -> dict[str, Any] | None:
+        """
+        Verify the signature and exp of a token, raising the same errors as PyJWT
+        :param token: The jwt string
+        :param verify_exp: Whether an expired token is rejected
+        :return: The claims, or None if the token is not one the codec decodes
+        """
+        if not token.startswith(self.prefix):
+            return None
+        if token.count(".") != 2:  # noqa: PLR2004
+            raise jwt.DecodeError("Wrong number of segments")
+        signing_input, _, signature_segment = token.encode().rpartition(b".")
+        try:
+            payload_segment = signing_input[len(self._header_segment) + 1 :]
+            payload_json = base64url_decode(payload_segment)
+            signature = base64url_decode(signature_segment)
+        except (TypeError, binascii.Error) as e:
+            raise jwt.DecodeError("Invalid token padding") from e
+        if not hmac.compare_digest(signature, self._sign(signing_input)):
+            raise jwt.InvalidSignatureError("Signature verification failed")
+        try:
+            payload = json.loads(payload_json)
+        except ValueError as e:
+            raise jwt.DecodeError(f"Invalid payload string: {e}") from e
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError("Invalid payload string: must be a json object")
+        exp = payload.get("exp")
+        if exp is None:
+            raise jwt.MissingRequiredClaimError("exp")
+        if type(exp) is not int or not self._DELEGATED_CLAIMS.isdisjoint(payload):
+            return None
+        if verify_exp and exp <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return payload
+
+
+@functools.lru_cache(maxsize=16)
+def _hs256_codec(kid: str, secret: bytes) -> HS256Codec:
+    return HS256Codec(kid, secret)
+
+
+@functools.lru_cache(maxsize=4)
+def _hs256_codecs(key_ring: KeyRing) -> tuple[HS256Codec, ...]:
+    return tuple(_hs256_codec(key.kid, key.signing_key) for key in key_ring if key.algorithm == "HS256")
+
+
+def _decode(token: str, verify_exp: bool) -> dict[str, Any]:
+    """
+    Verify and decode a token with the key it was signed with, using the HS256 codec where possible and PyJWT
+    otherwise. The header segment of each HS256 key's tokens is fixed and includes the kid, so the codec is chosen by
+    prefix without parsing the header
+    :param token: The jwt string
+    :param verify_exp: Whether an expired token is rejected
+    :return: The claims
+    """
+    for codec in _hs256_codecs(get_key_ring()):
+        if token.startswith(codec.prefix):
+            payload = codec.decode(token, verify_exp=verify_exp)
+            if payload is not None:
+                return payload
+            break
+    key = _verification_key(token)
+    decoded: dict[str, Any] = jwt.decode(
+        token,
+        key.verification_key,
+        algorithms=[key.algorithm],
+        options={"verify_signature": True, "require": ["exp"], "verify_exp": verify_exp},
+    )
+    return decoded
+
+
+class TokenStatus(enum.Enum):
+    """Outcome of verifying a token"""
+
+    VALID = "valid"
+    EXPIRED = "expired"
+    BAD_SIGNATURE = "bad_signature"
+    MALFORMED = "malformed"
+
+
+def _check_expiry(payload: dict[str, Any]) -> None:
+    """
+    Check the exp claim of a payload whose signature has already been verified, raising the same errors as PyJWT
+    :param payload: The claims
+    :return: None
+    """
+    exp = payload.get("exp")
+    if not isinstance(exp, int | float) or isinstance(exp, bool):
+        raise jwt.DecodeError("Expiration Time claim (exp) must be an integer.")
+    if exp <= time.time():
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
 
 class Token(ABC):
     """Abstract token class defines verify method"""
 
     jwt: str
+    # Set when the payload was decoded from jwt with its signature checked but not its expiry
+    _signature_verified: bool = False
+
+    @property
+    def claims(self) -> dict[str, Any]:
+        """
+        A copy of the claims held in the token
+        :return: The claims
+        """
+        return dict(self._payload)
 
     def verify(self) -> None:
         """
         Verify the token, ensuring that it has a valid format, signature, and has not expired. Will raise a
-        BadJWTError if verification fails
+        BadJWTError if verification fails. Tokens that have already been verified are not decoded again until they
+        expire
         :return: None
         """
+        cached_payload = _get_verified_payload(self.jwt)
+        if cached_payload is not None:
+            self._payload = cached_payload
+            return
         try:
-            # class is abstract and all subclasses define payload within the init
-            self._payload = jwt.decode(
-                self.jwt,
-                PRIVATE_KEY,
-                algorithms=["HS256"],
-                options={"verify_signature": True, "require": ["exp"], "verify_exp": True},
-            )
-
+            if self._signature_verified:
+                _check_expiry(self._payload)
+            else:
+                # class is abstract and all subclasses define payload within the init
+                self._payload = _decode(self.jwt, verify_exp=True)
+            _cache_verified_payload(self.jwt, self._payload)
             return
-        except jwt.InvalidSignatureError:
-            logger.warning("token has bad signature - %s", self.jwt)
-        except jwt.ExpiredSignatureError:
-            logger.warning("token signature is expired - %s", self.jwt)
+        except jwt.InvalidSignatureError as e:
+            logger.warning("token has bad signature - %s", token_fingerprint(self.jwt))
+            raise BadJWTSignatureError("jwt token verification failed") from e
+        except jwt.ExpiredSignatureError as e:
+            logger.warning("token signature is expired - %s", token_fingerprint(self.jwt))
+            raise ExpiredJWTError("jwt token verification failed") from e
         except jwt.InvalidTokenError:
-            logger.warning("Issue decoding token - %s", self.jwt)
+            logger.warning("Issue decoding token - %s", token_fingerprint(self.jwt))
         except Exception:
             logger.exception("JWT verification Failed for unknown reason")
 
         raise BadJWTError("jwt token verification failed")
 
     def _encode(self) -> None:
-        bytes_key = bytes(PRIVATE_KEY, encoding="utf8")
-
-        self.jwt = jwt.encode(self._payload, bytes_key, algorithm="HS256")
+        self._signature_verified = False
+        key = get_key_ring().active
+        if key.algorithm == "HS256":
+            self.jwt = _hs256_codec(key.kid, key.signing_key).encode(self._payload)
+        else:
+            self.jwt = jwt.encode(self._payload, key.signing_key, algorithm=key.algorithm, headers={"kid": key.kid})
 
 
 class AccessToken(Token):
@@ -74,25 +301,35 @@ class AccessToken(Token):
             self._payload["exp"] = datetime.now(UTC) + timedelta(minutes=float(ACCESS_TOKEN_LIFETIME_MINUTES))
             self._encode()
         elif jwt_token and not payload:
+            cached_payload = _get_verified_payload(jwt_token)
+            if cached_payload is not None:
+                self._payload = cached_payload
+                self.jwt = jwt_token
+                return
             try:
-                self._payload = jwt.decode(
-                    jwt_token,
-                    PRIVATE_KEY,
-                    algorithms=["HS256"],
-                    options={"verify_signature": True, "require": ["exp"], "verify_exp": False},
-                )
+                self._payload = _decode(jwt_token, verify_exp=False)
                 self.jwt = jwt_token
+                self._signature_verified = True
+            except jwt.InvalidSignatureError as e:
+                logger.warning("Access token has a bad signature")
+                raise BadJWTSignatureError("Token signature is not valid") from e
             except jwt.DecodeError as e:
                 logger.exception("Error decoding jwt")
                 raise BadJWTError("Token could not be decoded") from e
+            except jwt.InvalidTokenError as e:
+                logger.warning("Access token is missing required claims")
+                raise BadJWTError("Token is missing required claims") from e
         else:
             raise BadJWTError("Access token creation requires jwt_token string XOR a payload")
 
-    def refresh(self) -> None:
+    async def refresh(self) -> None:
         """
-        Refresh the access token by extending the expiry time by 10 minutes and resigning
+        Refresh the access token by extending the expiry time by 10 minutes and resigning with the active key. If the
+        token holds an experiments claim it is resolved again, so it follows changes to the user's experiments
         :return: None
         """
+        if "experiments" in self._payload:
+            self._payload["experiments"] = await _experiments_claim(self._payload["usernumber"])
         self._payload["exp"] = datetime.now(UTC) + timedelta(minutes=float(ACCESS_TOKEN_LIFETIME_MINUTES))
         self._encode()
 
@@ -112,12 +349,7 @@ class RefreshToken(Token):
         else:
             self.jwt = jwt_token
             try:
-                self._payload = jwt.decode(
-                    self.jwt,
-                    PRIVATE_KEY,
-                    algorithms=["HS256"],
-                    options={"verify_signature": True, "require": ["exp"], "verify_exp": True},
-                )
+                self._payload = _decode(self.jwt, verify_exp=True)
             except jwt.DecodeError as e:
                 raise BadJWTError("Badly formed JWT given") from e
             except jwt.ExpiredSignatureError as e:
@@ -126,13 +358,34 @@ class RefreshToken(Token):
                 raise BadJWTError("Problem decoding JWT") from e
 
 
-def generate_access_token(user: User) -> AccessToken:
+async def _experiments_claim(user_number: int) -> list[int] | str:
+    """
+    Resolve the experiments claim for a user through the experiments cache. Users with more experiments than the cap,
+    or whose experiments cannot currently be fetched, get the lookup required marker instead
+    :param user_number: The user number
+    :return: The sorted experiment (RB) numbers, or the lookup required marker
+    """
+    try:
+        experiments = sorted(set(await get_experiments_for_user_number(user_number)))
+    except ProposalAllocationsError:
+        logger.warning("Could not resolve experiments claim for user number %s", user_number)
+        return EXPERIMENTS_LOOKUP_REQUIRED
+    if len(experiments) > ACCESS_TOKEN_EXPERIMENTS_MAX:
+        return EXPERIMENTS_LOOKUP_REQUIRED
+    return experiments
+
+
+async def generate_access_token(user: User, include_experiments: bool = ACCESS_TOKEN_EXPERIMENTS_CLAIM) -> AccessToken:
     """
     Given a user, generate an AccessToken for them
     :param user: The user
+    :param include_experiments: Whether to embed the user's experiment (RB) numbers as the experiments claim
     :return: The generated Access Token
     """
-    payload = {"usernumber": user.user_number, "role": user.role.value, "username": user.username}
+    role = await user.get_role()
+    payload: dict[str, Any] = {"usernumber": user.user_number, "role": role.value, "username": user.username}
+    if include_experiments:
+        payload["experiments"] = await _experiments_claim(user.user_number)
     return AccessToken(payload=payload)
 
 
@@ -145,6 +398,31 @@ def load_access_token(token: str) -> AccessToken:
     return AccessToken(jwt_token=token)
 
 
+def check_access_token(token: str) -> tuple[TokenStatus, dict[str, Any] | None]:
+    """
+    Verify an access token without raising, reporting why verification failed. Failures are only logged at debug
+    level, as one request may carry many bad tokens
+    :param token: the jwt string
+    :return: The verification status and, for valid tokens, the claims
+    """
+    payload = _get_verified_payload(token)
+    if payload is not None:
+        return TokenStatus.VALID, payload
+    try:
+        payload = _decode(token, verify_exp=True)
+    except jwt.InvalidSignatureError:
+        logger.debug("token has bad signature - %s", token_fingerprint(token))
+        return TokenStatus.BAD_SIGNATURE, None
+    except jwt.ExpiredSignatureError:
+        logger.debug("token signature is expired - %s", token_fingerprint(token))
+        return TokenStatus.EXPIRED, None
+    except Exception:
+        logger.debug("Issue decoding token - %s", token_fingerprint(token))
+        return TokenStatus.MALFORMED, None
+    _cache_verified_payload(token, payload)
+    return TokenStatus.VALID, dict(payload)
+
+
 def load_refresh_token(token: str | None) -> RefreshToken:
     """
     Given a jwt string, return a refresh token object for it
@@ -162,3 +440,12 @@ def generate_refresh_token() -> RefreshToken:
     :return: The refresh token object
     """
     return RefreshToken()
+
+
+def warm_up_signing() -> None:
+    """
+    Sign and verify a throwaway token with the active key, so the key objects and signing state are set up before the
+    first request
+    :return: None
+    """
+    _decode(generate_refresh_token().jwt, verify_exp=True)
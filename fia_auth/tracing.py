@@ -0,0 +1,144 @@
+"""OpenTelemetry tracing: the span exporter configuration and middleware continuing traces from incoming requests"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from opentelemetry.sdk.trace import ReadableSpan
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.environ.get("TRACING_FILE", "traces.jsonl")
+
+TRACER = trace.get_tracer("fia_auth")
+
+
+class FileSpanExporter(SpanExporter):
+    """Exporter appending each finished span to a file as a line of JSON, for inspecting traces offline"""
+
+    def __init__(self, path: str) -> None:
+        """
+        Create the exporter
+        :param path: The file spans are appended to
+        """
+        self._path = Path(path)
+        self._lock = Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        """
+        Append the spans to the file
+        :param spans: The finished spans
+        :return: Whether the export succeeded
+        """
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock, self._path.open("a", encoding="utf-8") as file:
+                file.write(lines)
+        except OSError:
+            logger.warning("Could not write spans to %s", self._path)
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+
+def configure_tracing(exporter: str = TRACING_EXPORTER) -> InMemorySpanExporter | None:
+    """
+    Export spans with the given exporter, installing a tracer provider unless one has already been installed. The
+    global provider can only be set once per process, so later calls add their exporter to the existing provider.
+    With "none" spans are not recorded at all
+    :param exporter: One of none, console, file or memory
+    :return: The in-memory exporter holding the finished spans when exporter is memory, otherwise None
+    """
+    if exporter == "none":
+        return None
+    memory_exporter = None
+    processor: SpanProcessor
+    if exporter == "memory":
+        memory_exporter = InMemorySpanExporter()
+        processor = SimpleSpanProcessor(memory_exporter)
+    elif exporter == "console":
+        processor = BatchSpanProcessor(ConsoleSpanExporter())
+    elif exporter == "file":
+        processor = BatchSpanProcessor(FileSpanExporter(TRACING_FILE))
+    else:
+        raise ValueError(f"Unsupported TRACING_EXPORTER {exporter}")
+    provider = trace.get_tracer_provider()
+    if not isinstance(provider, TracerProvider):
+        provider = TracerProvider(resource=Resource.create({"service.name": "fia-auth"}))
+        trace.set_tracer_provider(provider)
+    provider.add_span_processor(processor)
+    return memory_exporter
+
+
+def inject_trace_context(headers: dict[str, str]) -> dict[str, str]:
+    """
+    Add the traceparent of the current span to outgoing request headers
+    :param headers: The headers of the outgoing request
+    :return: The same headers
+    """
+    propagate.inject(headers)
+    return headers
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware starting a server span for each HTTP request, continuing the trace given in the request's
+    traceparent header if there is one
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        """
+        Wrap the app
+        :param app: The ASGI app
+        """
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Handle a request inside a server span if it is HTTP
+        :param scope: The ASGI scope
+        :param receive: The ASGI receive channel
+        :param send: The ASGI send channel
+        :return: None
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        with TRACER.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context=propagate.extract(carrier),
+            kind=trace.SpanKind.SERVER,
+            attributes={"http.request.method": scope["method"], "url.path": scope["path"]},
+        ) as span:
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
+            route = scope.get("route")
+            if route is not None:
+                span.update_name(f"{scope['method']} {route.path}")
+                span.set_attribute("http.route", route.path)
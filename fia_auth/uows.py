@@ -0,0 +1,163 @@
+"""Async client for the User Office Web Service (UOWS) sharing a keep-alive connection pool"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any
+
+import httpx
+
+from fia_auth.metrics import record_upstream_error, track_upstream
+from fia_auth.resilience import UpstreamGuard
+from fia_auth.singleflight import SingleFlight
+from fia_auth.tracing import inject_trace_context
+
+logger = logging.getLogger(__name__)
+
+UOWS_URL = os.environ.get("UOWS_URL", "https://devapi.facilities.rl.ac.uk/users-service")
+UOWS_API_KEY = os.environ.get("UOWS_API_KEY", "")
+UOWS_MAX_CONNECTIONS = int(os.environ.get("UOWS_MAX_CONNECTIONS", "100"))
+UOWS_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("UOWS_MAX_KEEPALIVE_CONNECTIONS", "20"))
+UOWS_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("UOWS_KEEPALIVE_EXPIRY_SECONDS", "30"))
+UOWS_BULKHEAD_MAX_CALLS = int(os.environ.get("UOWS_BULKHEAD_MAX_CALLS", "50"))
+UOWS_BULKHEAD_MAX_WAIT_SECONDS = float(os.environ.get("UOWS_BULKHEAD_MAX_WAIT_SECONDS", "0.5"))
+
+SESSION_TIMEOUT_SECONDS = 30
+PERSON_DETAILS_TIMEOUT_SECONDS = 30
+ROLE_TIMEOUT_SECONDS = 5
+
+
+class UOWSClient:
+    """
+    Async wrapper around the UOWS endpoints used by fia-auth. Connections are pooled and kept alive between calls, and
+    calls go through a bulkhead and circuit breaker, raising UpstreamUnavailableError when either rejects them
+    """
+
+    def __init__(self, base_url: str, api_key: str, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        """
+        Create the client
+        :param base_url: The UOWS base url
+        :param api_key: The api key used for the authenticated UOWS endpoints
+        :param transport: Optional httpx transport, only expected to be given in tests
+        """
+        if not api_key:
+            logger.warning("UOWS_API_KEY is not set, person details and role lookups will not be authorised")
+        # httpx rejects a header ending in a space, so with no key the header is left out for the UOWS to refuse
+        self._authorization = {"Authorization": f"Api-key {api_key}"} if api_key else {}
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=UOWS_MAX_CONNECTIONS,
+                max_keepalive_connections=UOWS_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=UOWS_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            transport=transport,
+        )
+        self.guard = UpstreamGuard("uows", UOWS_BULKHEAD_MAX_CALLS, UOWS_BULKHEAD_MAX_WAIT_SECONDS)
+        self._person_details: SingleFlight[int, httpx.Response] = SingleFlight("basic_person_details")
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        async def send() -> httpx.Response:
+            with track_upstream("uows", operation):
+                headers = inject_trace_context(dict(kwargs.pop("headers", {})))
+                response = await self._client.request(method, url, headers=headers, **kwargs)
+            if response.is_server_error:
+                record_upstream_error("uows", operation)
+            return response
+
+        return await self.guard.call(send, is_failure=lambda response: response.is_server_error)
+
+    async def create_session(self, username: str, password: str) -> httpx.Response:
+        """
+        Create a UOWS session for the given credentials
+        :param username: The username
+        :param password: The password
+        :return: The UOWS response
+        """
+        return await self._request(
+            "create_session",
+            "POST",
+            "/v1/sessions",
+            json={"username": username, "password": password},
+            headers={"Content-Type": "application/json"},
+            timeout=SESSION_TIMEOUT_SECONDS,
+        )
+
+    async def get_basic_person_details(self, user_number: int) -> httpx.Response:
+        """
+        Get the basic person details for the given user number. Concurrent calls for the same user number share one
+        request and response
+        :param user_number: The user number
+        :return: The UOWS response
+        """
+        return await self._person_details.do(
+            user_number,
+            lambda: self._request(
+                "basic_person_details",
+                "GET",
+                "/v1/basic-person-details",
+                params={"userNumbers": user_number},
+                headers={**self._authorization, "Content-Type": "application/json"},
+                timeout=PERSON_DETAILS_TIMEOUT_SECONDS,
+            ),
+        )
+
+    async def get_roles(self, user_number: int) -> httpx.Response:
+        """
+        Get the roles assigned to the given user number
+        :param user_number: The user number
+        :return: The UOWS response
+        """
+        return await self._request(
+            "roles",
+            "GET",
+            f"/v1/role/{user_number}",
+            headers={**self._authorization, "accept": "application/json"},
+            timeout=ROLE_TIMEOUT_SECONDS,
+        )
+
+    async def ping(self) -> None:
+        """
+        Check the UOWS is reachable. Any response other than a server error counts, so no credentials are needed
+        :return: None
+        """
+        response = await self._client.get("/", timeout=ROLE_TIMEOUT_SECONDS)
+        if response.is_server_error:
+            raise httpx.HTTPStatusError(
+                f"UOWS responded with {response.status_code}", request=response.request, response=response
+            )
+
+    async def aclose(self) -> None:
+        """
+        Close all pooled connections
+        :return: None
+        """
+        await self._client.aclose()
+
+
+_CLIENT: UOWSClient | None = None
+
+
+def get_uows_client() -> UOWSClient:
+    """
+    Return the shared UOWS client, creating it on first use
+    :return: The UOWS client
+    """
+    global _CLIENT  # noqa: PLW0603
+    if _CLIENT is None:
+        logger.info("Opening UOWS connection pool")
+        _CLIENT = UOWSClient(UOWS_URL, UOWS_API_KEY)
+    return _CLIENT
+
+
+async def close_uows_client() -> None:
+    """
+    Close the shared UOWS client if it has been opened
+    :return: None
+    """
+    global _CLIENT  # noqa: PLW0603
+    if _CLIENT is not None:
+        logger.info("Closing UOWS connection pool")
+        await _CLIENT.aclose()
+        _CLIENT = None
@@ -0,0 +1,94 @@
+"""Startup warm-up, so the first requests a new replica serves do not pay for connection setup and initialisation"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from fia_auth.db import STAFF_SNAPSHOT
+from fia_auth.health import HEALTH_MONITOR
+from fia_auth.tokens import warm_up_signing
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    from fastapi import FastAPI
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get("WARMUP_TIMEOUT_SECONDS", "20"))
+
+
+async def _signing() -> None:
+    # Run on the threadpool like the sync routes, which also loads the event loop backend they are dispatched with
+    await run_in_threadpool(warm_up_signing)
+
+
+async def _staff_snapshot() -> None:
+    await asyncio.to_thread(STAFF_SNAPSHOT.refresh)
+
+
+async def _routes(app: FastAPI) -> None:
+    # FastAPI prepares its routes on the first request they are matched against, so serve one in process
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://warmup") as client:
+        (await client.get("/healthz")).raise_for_status()
+
+
+def warmup_steps(app: FastAPI) -> dict[str, Callable[[], Awaitable[None]]]:
+    """
+    Return the steps warming up the app. Checking the dependencies opens the first connection of the async database
+    pool and to the UOWS, and connects the allocations session, fetching its schema. Loading the staff snapshot opens
+    the first sync database connection
+    :param app: The app being started
+    :return: The steps keyed by name
+    """
+    return {
+        "signing": _signing,
+        "routes": lambda: _routes(app),
+        "staff_snapshot": _staff_snapshot,
+        "dependencies": HEALTH_MONITOR.check_all,
+    }
+
+
+async def _timed(name: str, step: Callable[[], Awaitable[None]]) -> float:
+    start = time.perf_counter()
+    await step()
+    elapsed = time.perf_counter() - start
+    logger.info("Warmed up %s in %.3f seconds", name, elapsed)
+    return elapsed
+
+
+async def warm_up(
+    steps: dict[str, Callable[[], Awaitable[None]]], timeout_seconds: float = WARMUP_TIMEOUT_SECONDS
+) -> dict[str, float | None]:
+    """
+    Run the warm-up steps concurrently. A step that fails or is still running at the timeout is logged and skipped,
+    so startup is never blocked for longer than the timeout; readiness then reflects whatever is still unhealthy
+    :param steps: The steps keyed by name
+    :param timeout_seconds: How long to wait for all the steps
+    :return: How long each step took, or None for steps that failed or timed out
+    """
+    start = time.perf_counter()
+    tasks = {name: asyncio.create_task(_timed(name, step)) for name, step in steps.items()}
+    _, pending = await asyncio.wait(tasks.values(), timeout=timeout_seconds)
+    for task in pending:
+        task.cancel()
+    timings: dict[str, float | None] = {}
+    for name, task in tasks.items():
+        if task in pending:
+            logger.warning("Warm up of %s did not finish within %s seconds", name, timeout_seconds)
+            timings[name] = None
+        elif task.exception() is not None:
+            logger.warning("Warm up of %s failed", name, exc_info=task.exception())
+            timings[name] = None
+        else:
+            timings[name] = task.result()
+    logger.info("Warm up finished in %.3f seconds", time.perf_counter() - start)
+    return timings
@@ -0,0 +1,208 @@
+"""
+Load driver running a weighted mix of login, verify, refresh and experiments requests against a running fia-auth,
+reporting throughput and p50/p95/p99 latency per route. Start the stubs (python -m loadtest.stubs) and fia-auth
+pointed at them first, then run from the repository root with:
+
+    python -m loadtest.driver --target http://localhost:8001 --duration 30 --concurrency 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any
+
+import httpx
+
+DEFAULT_MIX = "login=1,verify=12,refresh=2,experiments=4"
+
+
+@dataclass
+class RouteResults:
+    """How many requests were made to a route, how many failed, and the latency in seconds of each response"""
+
+    requests: int = 0
+    errors: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+
+@dataclass
+class Session:
+    """The tokens a simulated user holds after logging in"""
+
+    user_number: int
+    access_token: str
+    refresh_token: str
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values
+    :param sorted_values: The values, in ascending order
+    :param percent: The percentile, from 0 to 100
+    :return: The percentile value
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """
+    Parse a scenario mix such as "login=1,verify=10"
+    :param mix: The mix
+    :return: The weight of each scenario
+    """
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = int(weight)
+    unknown = set(weights) - {"login", "verify", "refresh", "experiments"}
+    if unknown:
+        raise ValueError(f"Unknown scenarios {', '.join(sorted(unknown))}")
+    return weights
+
+
+class LoadDriver:
+    """Runs the scenarios from many concurrent workers, each acting as one user"""
+
+    def __init__(self, client: httpx.AsyncClient, api_key: str, users: int, weights: dict[str, int]) -> None:
+        """
+        Create the driver
+        :param client: Client for the fia-auth under test
+        :param api_key: The FIA_AUTH_API_KEY of the fia-auth under test
+        :param users: How many distinct user numbers to spread the load over
+        :param weights: The weight of each scenario
+        """
+        self._client = client
+        self._api_key = api_key
+        self._users = users
+        self._scenarios = list(weights)
+        self._weights = list(weights.values())
+        self.results: dict[str, RouteResults] = defaultdict(RouteResults)
+
+    async def _request(self, route: str, method: str, url: str, **kwargs: Any) -> httpx.Response | None:
+        self.results[route].requests += 1
+        start = time.perf_counter()
+        try:
+            response = await self._client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.results[route].errors += 1
+            return None
+        self.results[route].latencies.append(time.perf_counter() - start)
+        if response.status_code >= HTTPStatus.BAD_REQUEST:
+            self.results[route].errors += 1
+            return None
+        return response
+
+    async def _login(self, user_number: int) -> Session | None:
+        response = await self._request(
+            "POST /login", "POST", "/login", json={"username": f"user{user_number}", "password": "load-test"}
+        )
+        if response is None:
+            return None
+        return Session(user_number, response.json(), response.cookies.get("refresh_token") or "")
+
+    async def _run_scenario(self, scenario: str, session: Session) -> Session | None:
+        if scenario == "login":
+            return await self._login(random.randint(1, self._users)) or session  # noqa: S311
+        if scenario == "verify":
+            await self._request("POST /verify", "POST", "/verify", json={"token": session.access_token})
+        elif scenario == "refresh":
+            response = await self._request(
+                "POST /refresh",
+                "POST",
+                "/refresh",
+                json={"token": session.access_token},
+                headers={"Cookie": f"refresh_token={session.refresh_token}"},
+            )
+            if response is not None:
+                session.access_token = response.json()
+        else:
+            await self._request(
+                "GET /experiments",
+                "GET",
+                "/experiments",
+                params={"user_number": session.user_number},
+                headers={"Authorization": f"Bearer {self._api_key}"},
+            )
+        return session
+
+    async def worker(self, deadline: float) -> None:
+        """
+        Log in as a random user, then run randomly chosen scenarios until the deadline
+        :param deadline: The perf_counter time to stop at
+        :return: None
+        """
+        session = None
+        while session is None and time.perf_counter() < deadline:
+            session = await self._login(random.randint(1, self._users))  # noqa: S311
+        while session is not None and time.perf_counter() < deadline:
+            scenario = random.choices(self._scenarios, weights=self._weights)[0]  # noqa: S311
+            session = await self._run_scenario(scenario, session)
+
+
+def report(results: dict[str, RouteResults], elapsed: float) -> None:
+    """
+    Write the throughput, error count and latency percentiles of each route
+    :param results: The results keyed by route
+    :param elapsed: The length of the run in seconds
+    :return: None
+    """
+    sys.stdout.write(
+        f"{'route':<20}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}\n"
+    )
+    for route, route_results in sorted(results.items()):
+        latencies = sorted(route_results.latencies)
+        sys.stdout.write(
+            f"{route:<20}{route_results.requests:>10}{route_results.errors:>8}{route_results.requests / elapsed:>10.1f}"
+            f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 95) * 1000:>10.1f}"
+            f"{percentile(latencies, 99) * 1000:>10.1f}\n"
+        )
+
+
+async def run(target: str, api_key: str, duration: float, concurrency: int, users: int, mix: str) -> None:
+    """
+    Run the load test and report the results
+    :param target: Base url of the fia-auth under test
+    :param api_key: The FIA_AUTH_API_KEY of the fia-auth under test
+    :param duration: How long to run for in seconds
+    :param concurrency: How many simulated users run at once
+    :param users: How many distinct user numbers to spread the load over
+    :param mix: The scenario mix
+    :return: None
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=30) as client:
+        driver = LoadDriver(client, api_key, users, parse_mix(mix))
+        start = time.perf_counter()
+        await asyncio.gather(*(driver.worker(start + duration) for _ in range(concurrency)))
+        report(driver.results, time.perf_counter() - start)
+
+
+def main() -> None:
+    """
+    Parse the load test options from the command line and run it
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://localhost:8001", help="base url of fia-auth")
+    parser.add_argument("--api-key", default="shh", help="FIA_AUTH_API_KEY of fia-auth")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run for")
+    parser.add_argument("--concurrency", type=int, default=50, help="simulated users running at once")
+    parser.add_argument("--users", type=int, default=1000, help="distinct user numbers to log in as")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    args = parser.parse_args()
+    asyncio.run(run(args.target, args.api_key, args.duration, args.concurrency, args.users, args.mix))
+
+
+if __name__ == "__main__":
+    main()
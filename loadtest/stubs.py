@@ -0,0 +1,213 @@
+"""
+Local stand-ins for the UOWS and proposal allocations APIs, so fia-auth can be load tested without calling the real
+facilities APIs. Latency, error rate and data volume are configurable. Run from the repository root with:
+
+    python -m loadtest.stubs --latency-ms 40 --error-rate 0.01 --experiments 25
+
+then start fia-auth with UOWS_URL=http://localhost:8101 and ALLOCATIONS_URL=http://localhost:8102/graphql.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import uuid
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from graphql import build_schema, graphql
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+ALLOCATIONS_SCHEMA = build_schema(
+    """
+    input ProposalFilter {
+      un: String
+      facilities: [String]
+      includeWithdrawn: Boolean
+    }
+
+    type Member {
+      userNumber: String
+    }
+
+    type Proposal {
+      referenceNumber: String
+      members: [Member]
+    }
+
+    type Query {
+      proposals(filter: ProposalFilter, offset: Int, limit: Int): [Proposal]
+    }
+    """
+)
+
+INSTRUMENT_SCIENTIST_ROLE = {"name": "ISIS Instrument Scientist"}
+BAD_PASSWORD = "bad-password"  # noqa: S105
+
+
+@dataclass(frozen=True)
+class StubConfig:
+    """How the stubs behave: latency in milliseconds, the fraction of requests failing, and how much data they hold"""
+
+    latency_ms: float = 20.0
+    latency_jitter_ms: float = 10.0
+    error_rate: float = 0.0
+    experiments_per_user: int = 10
+    instrument_scientist_rate: float = 0.05
+    index_users: int = 1000
+
+
+def user_number_for(username: str) -> int:
+    """
+    Map a load test username to its user number, users are named user<number>
+    :param username: The username
+    :return: The user number
+    """
+    digits = username.removeprefix("user")
+    return int(digits) if digits.isdigit() else 1
+
+
+def experiments_for(user_number: int, config: StubConfig) -> list[int]:
+    """
+    Build the experiment (RB) numbers the stub holds for a user, stable between requests
+    :param user_number: The user number
+    :param config: The stub configuration
+    :return: The experiment numbers
+    """
+    return [2_000_000 + user_number * 1000 + index for index in range(config.experiments_per_user)]
+
+
+def _add_behaviour(app: FastAPI, config: StubConfig) -> None:
+    @app.middleware("http")
+    async def delay_and_fail(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        delay = max(0.0, random.gauss(config.latency_ms, config.latency_jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        if random.random() < config.error_rate:  # noqa: S311
+            return JSONResponse({"error": "injected failure"}, status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+        return await call_next(request)
+
+
+def create_uows_stub(config: StubConfig) -> FastAPI:
+    """
+    Create the UOWS stub, serving sessions, basic person details and roles
+    :param config: The stub configuration
+    :return: The stub app
+    """
+    app = FastAPI()
+    _add_behaviour(app, config)
+
+    @app.post("/v1/sessions")
+    async def create_session(body: dict[str, str]) -> JSONResponse:
+        if body.get("password") == BAD_PASSWORD:
+            return JSONResponse({"error": "bad credentials"}, status_code=HTTPStatus.UNAUTHORIZED)
+        user_number = user_number_for(body.get("username", ""))
+        return JSONResponse({"userId": user_number, "sessionId": str(uuid.uuid4())}, status_code=HTTPStatus.CREATED)
+
+    @app.get("/v1/basic-person-details")
+    async def basic_person_details(userNumbers: int) -> list[dict[str, Any]]:  # noqa: N803
+        return [{"userNumber": userNumbers, "displayName": f"Load Test User {userNumbers}"}]
+
+    @app.get("/v1/role/{user_number}")
+    async def roles(user_number: int) -> list[dict[str, Any]]:
+        # Stable per user, so role caching behaves as it would against the real service
+        if random.Random(user_number).random() < config.instrument_scientist_rate:  # noqa: S311
+            return [INSTRUMENT_SCIENTIST_ROLE]
+        return [{"name": "User"}]
+
+    return app
+
+
+def create_allocations_stub(config: StubConfig) -> FastAPI:
+    """
+    Create the proposal allocations stub, executing GraphQL requests, including introspection, against a local schema
+    :param config: The stub configuration
+    :return: The stub app
+    """
+    app = FastAPI()
+    _add_behaviour(app, config)
+
+    def proposals(_: Any, **kwargs: Any) -> list[dict[str, Any]]:
+        user_number = kwargs["filter"].get("un")
+        if user_number is None:
+            # Every proposal, as fetched when syncing the experiments index
+            return [
+                {"referenceNumber": str(rb), "members": [{"userNumber": str(member)}]}
+                for member in range(1, config.index_users + 1)
+                for rb in experiments_for(member, config)
+            ]
+        experiments = experiments_for(int(user_number), config)
+        offset = kwargs.get("offset") or 0
+        limit = kwargs.get("limit")
+        page = experiments[offset:] if limit is None else experiments[offset : offset + limit]
+        return [{"referenceNumber": str(rb)} for rb in page]
+
+    @app.post("/graphql")
+    async def execute(body: dict[str, Any]) -> dict[str, Any]:
+        result = await graphql(
+            ALLOCATIONS_SCHEMA,
+            body["query"],
+            root_value={"proposals": proposals},
+            variable_values=body.get("variables"),
+            operation_name=body.get("operationName"),
+        )
+        return dict(result.formatted)
+
+    return app
+
+
+async def serve(config: StubConfig, host: str, uows_port: int, allocations_port: int) -> None:
+    """
+    Serve both stubs until interrupted
+    :param config: The stub configuration
+    :param host: The host to bind
+    :param uows_port: The port of the UOWS stub
+    :param allocations_port: The port of the allocations stub
+    :return: None
+    """
+    servers = [
+        uvicorn.Server(uvicorn.Config(create_uows_stub(config), host=host, port=uows_port, log_level="warning")),
+        uvicorn.Server(
+            uvicorn.Config(create_allocations_stub(config), host=host, port=allocations_port, log_level="warning")
+        ),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main() -> None:
+    """
+    Parse the stub configuration from the command line and serve the stubs
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--uows-port", type=int, default=8101)
+    parser.add_argument("--allocations-port", type=int, default=8102)
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms, help="mean response latency")
+    parser.add_argument("--latency-jitter-ms", type=float, default=StubConfig.latency_jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate, help="fraction of requests failing")
+    parser.add_argument("--experiments", type=int, default=StubConfig.experiments_per_user, help="RB numbers per user")
+    parser.add_argument("--instrument-scientist-rate", type=float, default=StubConfig.instrument_scientist_rate)
+    parser.add_argument(
+        "--index-users", type=int, default=StubConfig.index_users, help="users on proposals when listing every proposal"
+    )
+    args = parser.parse_args()
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        experiments_per_user=args.experiments,
+        instrument_scientist_rate=args.instrument_scientist_rate,
+        index_users=args.index_users,
+    )
+    asyncio.run(serve(config, args.host, args.uows_port, args.allocations_port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Fixtures shared by the unit tests"""
+# ruff: noqa: D101, D102, D107
+
+import time
+
+import pytest
+
+
+class FakeRedis:
+    """In-memory stand-in for redis.asyncio.Redis, recording the commands sent to it"""
+
+    def __init__(self):
+        self.values = {}
+        self.commands = []
+
+    def _get(self, key):
+        value, expires_at = self.values.get(key, (None, 0.0))
+        return value if time.monotonic() < expires_at else None
+
+    async def mget(self, keys):
+        self.commands.append(("MGET", *keys))
+        return [self._get(key) for key in keys]
+
+    async def delete(self, *names):
+        self.commands.append(("DEL", *names))
+        return sum(self.values.pop(name, None) is not None for name in names)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self, transaction)
+
+    async def aclose(self):
+        self.commands.append(("CLOSE",))
+
+
+class FakePipeline:
+    def __init__(self, redis, transaction):
+        self.redis = redis
+        self.transaction = transaction
+        self.queued = []
+
+    def set(self, name, value, px):
+        self.queued.append((name, value, px))
+        return self
+
+    async def execute(self):
+        self.redis.commands.append(("PIPELINE", len(self.queued)))
+        for name, value, px in self.queued:
+            self.redis.values[name] = (value, time.monotonic() + px / 1000)
+        return [True] * len(self.queued)
+
+
+@pytest.fixture
+def fake_redis():
+    """Return an empty in-memory redis client"""
+    return FakeRedis()
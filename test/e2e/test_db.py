@@ -1,6 +1,22 @@
 """Test cases for db module"""
 
-from fia_auth.db import SESSION, Staff, is_staff_user
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import func, select
+
+from fia_auth.db import (
+    SESSION,
+    STAFF_SNAPSHOT,
+    Staff,
+    UserExperiment,
+    ensure_db_connection,
+    experiments_index_synced_at,
+    is_staff_user,
+    load_experiments_index,
+    store_experiments_index,
+)
 
 
 def test_is_staff_staff_user_exists():
@@ -10,9 +26,65 @@ def test_is_staff_staff_user_exists():
         session.add(staff)
         session.commit()
 
-    assert is_staff_user(54321)
+    assert asyncio.run(is_staff_user(54321))
 
 
 def test_is_staff_user_does_not_exist():
     """Test is staff returns false when not staff"""
-    assert not is_staff_user(5678)
+    assert not asyncio.run(is_staff_user(5678))
+
+
+def test_staff_snapshot_refresh_picks_up_new_staff():
+    """Test the staff snapshot is reloaded once the staff table changes"""
+    STAFF_SNAPSHOT.refresh()
+    assert not asyncio.run(is_staff_user(98765))
+
+    with SESSION() as session:
+        session.add(Staff(user_number=98765))
+        session.commit()
+
+    assert STAFF_SNAPSHOT.refresh()
+    assert asyncio.run(is_staff_user(98765))
+    assert not STAFF_SNAPSHOT.refresh()
+    STAFF_SNAPSHOT.clear()
+
+
+def test_ensure_db_connection():
+    """Test the async engine can reach the database"""
+    asyncio.run(ensure_db_connection())
+
+
+def test_experiments_index_round_trip():
+    """Test a stored experiments index replaces the previous one and is loaded back"""
+    first_sync = datetime(2024, 1, 1, tzinfo=UTC)
+    store_experiments_index({1: [100], 2: [300, 200]}, first_sync)
+    store_experiments_index({2: [200], 3: [400]}, first_sync + timedelta(hours=1))
+
+    assert experiments_index_synced_at() == first_sync + timedelta(hours=1)
+    assert load_experiments_index() == ({2: (200,), 3: (400,)}, first_sync + timedelta(hours=1))
+
+    store_experiments_index({}, first_sync)
+    assert load_experiments_index() is None
+
+
+def test_concurrent_experiments_index_stores_do_not_duplicate_rows():
+    """Test replicas storing the experiments index at the same time leave one copy of it"""
+    synced_at = datetime(2024, 1, 1, tzinfo=UTC)
+    experiments = {user_number: list(range(user_number, user_number + 50)) for user_number in range(200)}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: store_experiments_index(experiments, synced_at), range(4)))
+
+    with SESSION() as session:
+        assert session.scalar(select(func.count()).select_from(UserExperiment)) == 200 * 50
+    store_experiments_index({}, synced_at)
+
+
+def test_load_experiments_index_ignores_duplicate_rows():
+    """Test duplicated rows in the persisted experiments index are loaded once"""
+    synced_at = datetime(2024, 1, 1, tzinfo=UTC)
+    store_experiments_index({1: [100, 200]}, synced_at)
+    with SESSION.begin() as session:
+        session.add(UserExperiment(user_number=1, experiment_number=100, synced_at=synced_at))
+
+    assert load_experiments_index() == ({1: (100, 200)}, synced_at)
+    store_experiments_index({}, synced_at)
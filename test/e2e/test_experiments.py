@@ -1,11 +1,15 @@
 """e2e test cases"""
 # ruff: noqa: D103
 
+from datetime import UTC, datetime
 from http import HTTPStatus
 from unittest.mock import patch
 
+import pytest
 from starlette.testclient import TestClient
 
+from fia_auth.exceptions import UpstreamUnavailableError
+from fia_auth.experiments import EXPERIMENTS_CACHE, EXPERIMENTS_INDEX
 from fia_auth.fia_auth import app
 
 client = TestClient(app)
@@ -26,6 +30,11 @@ ALLOCATIONS_RESPONSE = {
 }
 
 
+@pytest.fixture(autouse=True)
+def _clear_experiments_cache():
+    EXPERIMENTS_CACHE.cache.clear()
+
+
 def test_get_experiments_with_missing_api_key_returns_401():
     response = client.get("/experiments?user_number=123")
     assert response.status_code == HTTPStatus.UNAUTHORIZED
@@ -36,7 +45,7 @@ def test_get_experiments_with_bad_api_key_returns_403():
     assert response.status_code == HTTPStatus.FORBIDDEN
 
 
-@patch("fia_auth.experiments.Client.execute_async")
+@patch("fia_auth.experiments.AllocationsClient.execute")
 def test_get_experiments_none_exist_for_user_returns_empty(mock_exec):
     mock_exec.return_value = ALLOCATIONS_EMPTY_RESPONSE
     response = client.get("/experiments?user_number=123", headers={"Authorization": "Bearer shh"})
@@ -44,9 +53,139 @@ def test_get_experiments_none_exist_for_user_returns_empty(mock_exec):
     assert response.json() == []
 
 
-@patch("fia_auth.experiments.Client.execute_async")
+@patch("fia_auth.experiments.AllocationsClient.execute")
 def test_get_experiments_for_user(mock_exec):
     mock_exec.return_value = ALLOCATIONS_RESPONSE
     response = client.get("/experiments?user_number=123", headers={"Authorization": "Bearer shh"})
     assert response.status_code == HTTPStatus.OK
     assert response.json() == [9723, 2200087, 2200084, 2200081, 2200083, 2200085, 2200086, 2200082, 1620354]
+
+
+@patch("fia_auth.experiments.AllocationsClient.execute")
+def test_get_experiments_for_user_is_cached(mock_exec):
+    mock_exec.return_value = ALLOCATIONS_RESPONSE
+    client.get("/experiments?user_number=123", headers={"Authorization": "Bearer shh"})
+    response = client.get("/experiments?user_number=123", headers={"Authorization": "Bearer shh"})
+    assert response.json() == [9723, 2200087, 2200084, 2200081, 2200083, 2200085, 2200086, 2200082, 1620354]
+    mock_exec.assert_called_once()
+
+    stats = client.get("/stats", headers={"Authorization": "Bearer shh"}).json()
+    assert stats["caches"]["experiments"]["hits"] >= 1
+    assert stats["experiments_index"] == {"users": 0, "synced_at": None, "age_seconds": None}
+
+
+@patch("fia_auth.experiments.AllocationsClient.execute")
+def test_get_experiments_for_user_from_index(mock_exec):
+    EXPERIMENTS_INDEX.replace({4321: (1920354, 2200087)}, datetime.now(UTC))
+    try:
+        response = client.get("/experiments?user_number=4321", headers={"Authorization": "Bearer shh"})
+        stats = client.get("/stats", headers={"Authorization": "Bearer shh"}).json()
+    finally:
+        EXPERIMENTS_INDEX.clear()
+
+    assert response.json() == [1920354, 2200087]
+    mock_exec.assert_not_called()
+    assert stats["experiments_index"]["users"] == 1
+
+
+def test_get_stats_with_bad_api_key_returns_403():
+    response = client.get("/stats", headers={"Authorization": "Bearer 123"})
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+@patch("fia_auth.experiments.AllocationsClient.execute")
+def test_get_experiments_batch(mock_exec):
+    mock_exec.return_value = {"u0": ALLOCATIONS_RESPONSE["proposals"][:2], "u1": []}
+    response = client.post(
+        "/experiments/batch", json={"user_numbers": [123, 456]}, headers={"Authorization": "Bearer shh"}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"123": [9723, 2200087], "456": []}
+
+
+def test_get_experiments_batch_with_bad_api_key_returns_403():
+    response = client.post("/experiments/batch", json={"user_numbers": [123]}, headers={"Authorization": "Bearer 1"})
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+def test_get_experiments_pages_with_cursor():
+    EXPERIMENTS_CACHE.cache.set(123, [1, 2, 3, 4, 5])
+    headers = {"Authorization": "Bearer shh"}
+
+    first = client.get("/experiments?user_number=123&limit=2", headers=headers).json()
+    second = client.get(f"/experiments?user_number=123&limit=2&cursor={first['next_cursor']}", headers=headers).json()
+    third = client.get(f"/experiments?user_number=123&limit=2&cursor={second['next_cursor']}", headers=headers).json()
+
+    assert [first["experiments"], second["experiments"], third["experiments"]] == [[1, 2], [3, 4], [5]]
+    assert third["next_cursor"] is None
+
+
+@patch("fia_auth.experiments.AllocationsClient.execute")
+def test_get_experiments_page_from_allocations_api(mock_exec):
+    mock_exec.return_value = ALLOCATIONS_RESPONSE
+    response = client.get("/experiments?user_number=123&limit=3", headers={"Authorization": "Bearer shh"})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["experiments"] == [9723, 2200087, 2200084]
+    assert response.json()["next_cursor"] is not None
+    (request, _), _ = mock_exec.call_args
+    assert request.variable_values == {"userNumber": "123", "offset": 0, "limit": 4}
+
+
+def test_get_experiments_with_invalid_cursor_returns_400():
+    response = client.get("/experiments?user_number=123&cursor=nope", headers={"Authorization": "Bearer shh"})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_get_experiments_with_too_large_limit_returns_422():
+    response = client.get("/experiments?user_number=123&limit=100000", headers={"Authorization": "Bearer shh"})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@patch("fia_auth.experiments.AllocationsClient.execute")
+def test_get_experiments_streams_ndjson(mock_exec):
+    mock_exec.return_value = ALLOCATIONS_RESPONSE
+    with client.stream(
+        "GET",
+        "/experiments?user_number=123",
+        headers={"Authorization": "Bearer shh", "Accept": "application/x-ndjson"},
+    ) as response:
+        lines = list(response.iter_lines())
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [int(line) for line in lines] == [
+        9723,
+        2200087,
+        2200084,
+        2200081,
+        2200083,
+        2200085,
+        2200086,
+        2200082,
+        1620354,
+    ]
+
+
+def test_get_experiments_stream_resumes_from_cursor():
+    EXPERIMENTS_CACHE.cache.set(123, [1, 2, 3, 4, 5])
+    headers = {"Authorization": "Bearer shh"}
+    page = client.get("/experiments?user_number=123&limit=3", headers=headers).json()
+
+    response = client.get(
+        f"/experiments?user_number=123&cursor={page['next_cursor']}",
+        headers={**headers, "Accept": "application/x-ndjson"},
+    )
+
+    assert response.text == "4\n5\n"
+
+
+@pytest.mark.parametrize("query", ["", "&limit=2"])
+@patch("fia_auth.experiments.AllocationsClient.execute")
+def test_get_experiments_when_allocations_api_is_unavailable_returns_503(mock_exec, query):
+    mock_exec.side_effect = UpstreamUnavailableError("Circuit breaker for allocations is open", retry_after_seconds=30)
+
+    response = client.get(f"/experiments?user_number=123{query}", headers={"Authorization": "Bearer shh"})
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "30"
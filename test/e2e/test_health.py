@@ -0,0 +1,76 @@
+# ruff: noqa: D100, D103
+import asyncio
+from http import HTTPStatus
+from unittest.mock import AsyncMock, patch
+
+from starlette.testclient import TestClient
+
+from fia_auth.fia_auth import app
+from fia_auth.health import HEALTH_MONITOR, HealthCheck
+
+client = TestClient(app)
+
+
+def _checks(postgres, uows, allocations):
+    return {
+        "postgres": HealthCheck(postgres, required=True),
+        "uows": HealthCheck(uows, required=False),
+        "allocations": HealthCheck(allocations, required=False),
+    }
+
+
+def test_ready_is_unavailable_until_database_checked():
+    with patch.dict(HEALTH_MONITOR.statuses, clear=True):
+        response = client.get("/ready")
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+
+def test_ready_serves_cached_status_without_checking():
+    postgres = AsyncMock()
+    with (
+        patch.dict(HEALTH_MONITOR.statuses, clear=True),
+        patch.dict(HEALTH_MONITOR.checks, _checks(postgres, AsyncMock(), AsyncMock())),
+    ):
+        asyncio.run(HEALTH_MONITOR.check_all())
+        responses = [client.get("/ready") for _ in range(3)]
+
+    assert [response.status_code for response in responses] == [HTTPStatus.OK] * 3
+    postgres.assert_awaited_once()
+
+
+def test_ready_is_unavailable_when_database_check_failed():
+    with (
+        patch.dict(HEALTH_MONITOR.statuses, clear=True),
+        patch.dict(HEALTH_MONITOR.checks, _checks(AsyncMock(side_effect=OSError), AsyncMock(), AsyncMock())),
+    ):
+        asyncio.run(HEALTH_MONITOR.check_all())
+        response = client.get("/ready")
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+
+def test_health_dependencies_reports_each_dependency():
+    with (
+        patch.dict(HEALTH_MONITOR.statuses, clear=True),
+        patch.dict(
+            HEALTH_MONITOR.checks,
+            _checks(AsyncMock(), AsyncMock(side_effect=ConnectionError("refused")), AsyncMock()),
+        ),
+    ):
+        asyncio.run(HEALTH_MONITOR.check_all())
+        response = client.get("/health/dependencies")
+
+    assert response.status_code == HTTPStatus.OK
+    report = response.json()
+    assert report["ready"] is True
+    assert report["dependencies"]["postgres"]["healthy"] is True
+    assert report["dependencies"]["postgres"]["error"] is None
+    assert report["dependencies"]["uows"] == {
+        "required": False,
+        "healthy": False,
+        "checked_age_seconds": report["dependencies"]["uows"]["checked_age_seconds"],
+        "latency_seconds": report["dependencies"]["uows"]["latency_seconds"],
+        "error": "ConnectionError",
+    }
+    assert report["dependencies"]["allocations"]["healthy"] is True
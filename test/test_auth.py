@@ -1,69 +1,106 @@
 # ruff: noqa: D100, D103
-import os
+import asyncio
+import json
 from http import HTTPStatus
-from unittest import mock
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
+import httpx
 import pytest
 
+from fia_auth import shared_cache
 from fia_auth.auth import authenticate
 from fia_auth.exceptions import BadCredentialsError, UOWSError
 from fia_auth.model import UserCredentials
+from fia_auth.shared_cache import LocalCacheBackend
+from fia_auth.uows import UOWSClient
 
 
-@patch("requests.get")
-@patch("requests.post")
-def test_authenticate_success(mock_post, mock_get):
-    uows_api_key = str(mock.MagicMock())
-    os.environ["UOWS_API_KEY"] = uows_api_key
-    mock_post_response = Mock(
-        status_code=HTTPStatus.CREATED, json=lambda: {"userId": "12345", "displayName": "Mr Cool"}
-    )
-    mock_get_response = Mock(status_code=HTTPStatus.OK, json=lambda: [{"displayName": "Mr Cool"}])
-    mock_post.return_value = mock_post_response
-    mock_get.return_value = mock_get_response
+@pytest.fixture(autouse=True)
+def _empty_shared_cache():
+    with patch.object(shared_cache, "_BACKEND", LocalCacheBackend()):
+        yield
+
+
+def _uows_client(handler):
+    return UOWSClient("https://uows.test/users-service", "uows_api_key", transport=httpx.MockTransport(handler))
+
+
+def test_authenticate_success():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path.endswith("/v1/sessions"):
+            return httpx.Response(HTTPStatus.CREATED, json={"userId": "12345", "displayName": "Mr Cool"})
+        return httpx.Response(HTTPStatus.OK, json=[{"displayName": "Mr Cool"}])
 
     credentials = UserCredentials(username="valid_user", password="valid_password")  # noqa: S106
 
-    user = authenticate(credentials)
+    with patch("fia_auth.auth.get_uows_client", return_value=_uows_client(handler)):
+        user = asyncio.run(authenticate(credentials))
 
     assert user.user_number == "12345"
     assert user.username == "Mr Cool"
 
-    mock_post.assert_called_once_with(
-        "https://devapi.facilities.rl.ac.uk/users-service/v1/sessions",
-        json={"username": "valid_user", "password": "valid_password"},
-        headers={"Content-Type": "application/json"},
-        timeout=30,
-    )
-    mock_get.assert_called_once_with(
-        "https://devapi.facilities.rl.ac.uk/users-service/v1/basic-person-details?userNumbers=12345",
-        headers={"Authorization": f"Api-key {uows_api_key}", "Content-Type": "application/json"},
-        timeout=30,
-    )
+    session_request, details_request = requests
+    assert session_request.method == "POST"
+    assert str(session_request.url) == "https://uows.test/users-service/v1/sessions"
+    assert json.loads(session_request.content) == {"username": "valid_user", "password": "valid_password"}
+    assert details_request.method == "GET"
+    assert str(details_request.url) == "https://uows.test/users-service/v1/basic-person-details?userNumbers=12345"
+    assert details_request.headers["Authorization"] == "Api-key uows_api_key"
 
 
-@patch("requests.post")
-def test_authenticate_bad_credentials(mock_post):
-    mock_response = Mock(status_code=HTTPStatus.UNAUTHORIZED, json=lambda: {})
-    mock_post.return_value = mock_response
+def test_authenticate_caches_display_name():
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        if request.url.path.endswith("/v1/sessions"):
+            return httpx.Response(HTTPStatus.CREATED, json={"userId": 12345})
+        return httpx.Response(HTTPStatus.OK, json=[{"displayName": "Mr Cool"}])
+
+    credentials = UserCredentials(username="valid_user", password="valid_password")  # noqa: S106
+
+    with patch("fia_auth.auth.get_uows_client", return_value=_uows_client(handler)):
+        users = [asyncio.run(authenticate(credentials)) for _ in range(2)]
 
+    assert [user.username for user in users] == ["Mr Cool", "Mr Cool"]
+    assert requests == [
+        "/users-service/v1/sessions",
+        "/users-service/v1/basic-person-details",
+        "/users-service/v1/sessions",
+    ]
+
+
+def test_authenticate_bad_credentials():
     credentials = UserCredentials(username="invalid_user", password="invalid_password")  # noqa: S106
+    client = _uows_client(lambda _: httpx.Response(HTTPStatus.UNAUTHORIZED, json={}))
 
-    with pytest.raises(BadCredentialsError) as exc_info:
-        authenticate(credentials)
+    with (
+        patch("fia_auth.auth.get_uows_client", return_value=client),
+        pytest.raises(BadCredentialsError) as exc_info,
+    ):
+        asyncio.run(authenticate(credentials))
 
     assert str(exc_info.value) == "Invalid user credentials provided to authenticate with the user office web service."
 
 
-@patch("requests.post")
-def test_authenticate_unexpected_error(mock_post):
-    mock_response = Mock(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, json=lambda: {"error": "Server error"})
-    mock_post.return_value = mock_response
-
+def test_authenticate_unexpected_error():
     credentials = UserCredentials(username="user", password="password")  # noqa: S106
+    client = _uows_client(lambda _: httpx.Response(HTTPStatus.INTERNAL_SERVER_ERROR, json={"error": "Server error"}))
 
-    with pytest.raises(UOWSError) as exc_info:
-        authenticate(credentials)
+    with patch("fia_auth.auth.get_uows_client", return_value=client), pytest.raises(UOWSError) as exc_info:
+        asyncio.run(authenticate(credentials))
 
     assert "An unexpected error occurred when authenticating with the user office web service" in str(exc_info.value)
+
+
+def test_authenticate_uows_unreachable():
+    credentials = UserCredentials(username="user", password="password")  # noqa: S106
+
+    def handler(request):
+        raise httpx.ConnectTimeout("timed out", request=request)
+
+    with patch("fia_auth.auth.get_uows_client", return_value=_uows_client(handler)), pytest.raises(UOWSError):
+        asyncio.run(authenticate(credentials))
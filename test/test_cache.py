@@ -0,0 +1,183 @@
+# ruff: noqa: D100, D103
+import asyncio
+import sys
+import threading
+from unittest.mock import AsyncMock
+
+import pytest
+
+from fia_auth.cache import CACHES, AsyncLoadingCache, TTLCache, approximate_size, cache_statistics
+
+
+class FakeClock:
+    """Manually advanced clock"""
+
+    def __init__(self):
+        """Start the clock at zero"""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time"""
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_get_returns_value_until_ttl(clock):
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, clock=clock)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.expirations == 1
+
+
+def test_stale_entries_are_reported_as_not_fresh(clock):
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, stale_seconds=5, clock=clock)
+    cache.set("a", 1)
+
+    clock.now = 12
+    assert cache.lookup("a") == (1, False)
+    assert cache.get("a") is None
+    clock.now = 15
+    assert cache.lookup("a") is None
+    assert cache.stats.stale_hits == 2  # noqa: PLR2004
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache("test", ttl_seconds=10, max_entries=2, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3  # noqa: PLR2004
+    assert cache.stats.evictions == 1
+
+
+def test_entries_are_evicted_when_over_memory_bound(clock):
+    value = list(range(100))
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, max_bytes=approximate_size(value) * 2, clock=clock)
+    cache.set("a", value)
+    cache.set("b", value)
+    cache.set("c", value)
+
+    assert len(cache) == 2  # noqa: PLR2004
+    assert cache.memory_bytes == approximate_size(value) * 2
+    assert cache.get("a") is None
+
+
+def test_set_with_ttl_overrides_default(clock):
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, clock=clock)
+    cache.set("a", 1, ttl_seconds=1)
+    clock.now = 2
+
+    assert cache.get("a") is None
+
+
+def test_invalidate_and_clear(clock):
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.invalidate("a")
+    assert not cache.invalidate("a")
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.memory_bytes == 0
+
+
+def test_cache_is_safe_to_share_between_threads():
+    cache = TTLCache("threads-test", ttl_seconds=0.0001, max_entries=8, stale_seconds=0.0001)
+    errors = []
+
+    def hammer(worker):
+        try:
+            for i in range(2000):
+                key = (worker + i) % 16
+                cache.set(key, i)
+                cache.lookup((key + 1) % 16)
+                cache.invalidate((key + 2) % 16)
+                cache.snapshot()
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=hammer, args=(worker,)) for worker in range(8)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+        CACHES.pop("threads-test")
+
+    assert errors == []
+    assert len(cache) <= 8  # noqa: PLR2004
+    cache.clear()
+    assert cache.memory_bytes == 0
+
+
+def test_cache_statistics_reports_registered_caches(clock):
+    cache = TTLCache("statistics-test", ttl_seconds=10, max_entries=10, clock=clock)
+    cache.set("a", 1)
+    cache.get("a")
+
+    stats = cache_statistics()["statistics-test"]
+
+    assert stats["hits"] == 1
+    assert stats["entries"] == 1
+    CACHES.pop("statistics-test")
+
+
+def test_loading_cache_loads_on_miss_then_hits(clock):
+    loader = AsyncMock(return_value=[1, 2])
+    loading_cache = AsyncLoadingCache(TTLCache("test", ttl_seconds=10, max_entries=10, clock=clock), loader)
+
+    async def run():
+        return await loading_cache.get(1), await loading_cache.get(1)
+
+    assert asyncio.run(run()) == ([1, 2], [1, 2])
+    loader.assert_awaited_once_with(1)
+
+
+def test_loading_cache_serves_stale_while_refreshing(clock):
+    loader = AsyncMock(side_effect=[[1], [2]])
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, stale_seconds=100, clock=clock)
+    loading_cache = AsyncLoadingCache(cache, loader)
+
+    async def run():
+        await loading_cache.get(1)
+        clock.now = 20
+        stale = await loading_cache.get(1)
+        await asyncio.sleep(0)
+        return stale, await loading_cache.get(1)
+
+    assert asyncio.run(run()) == ([1], [2])
+    assert cache.stats.refreshes == 1
+
+
+def test_loading_cache_keeps_stale_value_when_refresh_fails(clock):
+    loader = AsyncMock(side_effect=[[1], RuntimeError("upstream down")])
+    cache = TTLCache("test", ttl_seconds=10, max_entries=10, stale_seconds=100, clock=clock)
+    loading_cache = AsyncLoadingCache(cache, loader)
+
+    async def run():
+        await loading_cache.get(1)
+        clock.now = 20
+        stale = await loading_cache.get(1)
+        await asyncio.sleep(0)
+        return stale, cache.lookup(1)
+
+    assert asyncio.run(run()) == ([1], ([1], False))
+    assert cache.stats.refresh_failures == 1
@@ -0,0 +1,101 @@
+# ruff: noqa: D100, D103
+import asyncio
+from unittest import mock
+
+import pytest
+
+from fia_auth.db import (
+    STAFF_SNAPSHOT,
+    StaffSnapshot,
+    is_staff_user,
+    pool_statistics,
+    refresh_staff_snapshot_periodically,
+)
+
+
+@pytest.fixture(autouse=True)
+def _clear_snapshot():
+    yield
+    STAFF_SNAPSHOT.clear()
+
+
+def _mock_session(user_numbers):
+    session = mock.MagicMock()
+    session.__enter__.return_value = session
+    session.scalars.return_value.all.return_value = user_numbers
+    return session
+
+
+def test_is_staff_user_uses_loaded_snapshot_without_db():
+    STAFF_SNAPSHOT.replace(frozenset({1234}))
+
+    with mock.patch("fia_auth.db.SESSION") as mock_session:
+        assert asyncio.run(is_staff_user(1234))
+        assert asyncio.run(is_staff_user("1234"))
+        assert not asyncio.run(is_staff_user(5678))
+
+    mock_session.assert_not_called()
+
+
+def test_refresh_loads_staff_table():
+    snapshot = StaffSnapshot()
+
+    with mock.patch("fia_auth.db.SESSION", return_value=_mock_session([1, 2])):
+        assert snapshot.refresh()
+
+    assert snapshot.loaded
+    assert 1 in snapshot
+    assert len(snapshot) == 2  # noqa: PLR2004
+
+
+def test_refresh_keeps_snapshot_when_staff_unchanged():
+    snapshot = StaffSnapshot()
+
+    with mock.patch("fia_auth.db.SESSION", return_value=_mock_session([1, 2])):
+        snapshot.refresh()
+        loaded_at = snapshot.loaded_at
+        assert not snapshot.refresh()
+
+    assert snapshot.loaded_at == loaded_at
+
+
+def test_refresh_replaces_snapshot_when_staff_change():
+    snapshot = StaffSnapshot()
+
+    with mock.patch("fia_auth.db.SESSION", return_value=_mock_session([1, 2])):
+        snapshot.refresh()
+    # Same count and sum of user numbers as before
+    with mock.patch("fia_auth.db.SESSION", return_value=_mock_session([0, 3])):
+        assert snapshot.refresh()
+
+    assert 3 in snapshot  # noqa: PLR2004
+    assert 1 not in snapshot
+
+
+def test_periodic_refresh_keeps_previous_snapshot_on_failure():
+    STAFF_SNAPSHOT.replace(frozenset({1}))
+
+    async def run():
+        with mock.patch("fia_auth.db.SESSION", side_effect=ConnectionError("db down")):
+            task = asyncio.create_task(refresh_staff_snapshot_periodically(interval_seconds=0))
+            await asyncio.sleep(0.01)
+            task.cancel()
+
+    asyncio.run(run())
+
+    assert 1 in STAFF_SNAPSHOT
+
+
+def test_is_staff_user_queries_db_until_snapshot_loaded():
+    with mock.patch("fia_auth.db.SESSION", return_value=_mock_session(None)) as mock_session:
+        assert asyncio.run(is_staff_user(1234))
+
+    mock_session.return_value.execute.return_value.one.assert_called_once()
+
+
+def test_pool_statistics():
+    statistics = pool_statistics()
+
+    assert set(statistics) == {"sync", "async"}
+    assert statistics["sync"]["size"] == 5  # noqa: PLR2004
+    assert statistics["async"]["checkouts"] >= 0
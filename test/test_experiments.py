@@ -0,0 +1,530 @@
+# ruff: noqa: D100, D101, D102, D103, D107
+import asyncio
+import contextlib
+import json
+from datetime import UTC, datetime, timedelta
+from unittest import mock
+
+import pytest
+from gql.transport.async_transport import AsyncTransport
+from gql.transport.exceptions import TransportServerError
+from graphql import build_schema, execute
+
+from fia_auth.exceptions import ProposalAllocationsError
+from fia_auth.experiments import (
+    EXPERIMENTS_CACHE,
+    EXPERIMENTS_INDEX,
+    EXPERIMENTS_SHARED_CACHE,
+    AllocationsClient,
+    ExperimentsIndex,
+    decode_experiments_cursor,
+    encode_experiments_cursor,
+    get_experiments_for_user_number,
+    get_experiments_for_user_numbers,
+    get_experiments_page,
+    iter_experiments_for_user_number,
+    sync_experiments_index,
+)
+from fia_auth.resilience import CircuitState
+from fia_auth.shared_cache import RedisCacheBackend
+
+SCHEMA = build_schema(
+    """
+    input ProposalFilter {
+      un: String
+      facilities: [String]
+      includeWithdrawn: Boolean
+    }
+
+    type Member {
+      userNumber: String
+    }
+
+    type Proposal {
+      referenceNumber: String
+      members: [Member]
+    }
+
+    type Query {
+      proposals(filter: ProposalFilter, offset: Int, limit: Int): [Proposal]
+    }
+    """
+)
+
+
+class LocalSchemaTransport(AsyncTransport):
+    """Executes requests against an in-memory schema, recording each one"""
+
+    schema = SCHEMA
+
+    def __init__(self, proposals):
+        self.proposals = proposals
+        self.requests = []
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def execute(self, request, *_, **__):
+        self.requests.append(request)
+        return execute(
+            self.schema,
+            request.document,
+            root_value={"proposals": self._proposals},
+            variable_values=request.variable_values,
+        )
+
+    def _proposals(self, _, **kwargs):
+        proposals = self.proposals.get(kwargs["filter"].get("un"), [])
+        offset = kwargs.get("offset") or 0
+        limit = kwargs.get("limit")
+        return proposals[offset:] if limit is None else proposals[offset : offset + limit]
+
+    def subscribe(self, request):
+        raise NotImplementedError
+
+
+class OldSchemaTransport(LocalSchemaTransport):
+    """Serves a schema without paging or proposal members, so queries using them fail validation"""
+
+    schema = build_schema(
+        """
+        input ProposalFilter {
+          un: String
+          facilities: [String]
+          includeWithdrawn: Boolean
+        }
+
+        type Proposal {
+          referenceNumber: String
+        }
+
+        type Query {
+          proposals(filter: ProposalFilter): [Proposal]
+        }
+        """
+    )
+
+
+class FailingTransport(LocalSchemaTransport):
+    async def execute(self, request, *_, **__):
+        if request.variable_values:
+            raise TransportServerError("Service Unavailable", 503)
+        return await super().execute(request)
+
+
+@pytest.fixture(autouse=True)
+def _reset_caches():
+    EXPERIMENTS_CACHE.cache.clear()
+    EXPERIMENTS_INDEX.clear()
+    with mock.patch("fia_auth.experiments._SCHEMA_INTROSPECTION", None):
+        yield
+
+
+def test_get_experiments_for_user_number_is_cached():
+    transport = LocalSchemaTransport({"1234": [{"referenceNumber": "2200087"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            return await get_experiments_for_user_number(1234), await get_experiments_for_user_number(1234)
+
+    assert asyncio.run(run()) == ([2200087], [2200087])
+    # one introspection query followed by a single proposal query
+    assert len(transport.requests) == 2  # noqa: PLR2004
+
+
+def test_get_experiments_for_user_number_sends_variables():
+    transport = LocalSchemaTransport({"1234": [{"referenceNumber": "2200087"}, {"referenceNumber": "9723"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+        result = asyncio.run(get_experiments_for_user_number(1234))
+
+    assert result == [2200087, 9723]
+    assert transport.requests[-1].variable_values == {"userNumber": "1234"}
+
+
+def test_schema_is_fetched_once_per_process():
+    transport = LocalSchemaTransport({})
+
+    async def run():
+        client = AllocationsClient("https://allocations.test", "key", transport=transport)
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            await get_experiments_for_user_number(1)
+            await get_experiments_for_user_number(2)
+            await client.close()
+            EXPERIMENTS_CACHE.cache.clear()
+            await get_experiments_for_user_number(3)
+
+    asyncio.run(run())
+
+    # one introspection query followed by three proposal queries
+    assert len(transport.requests) == 4  # noqa: PLR2004
+    assert all(request.variable_values for request in transport.requests[1:])
+
+
+def test_schema_is_written_to_and_read_from_disk(tmp_path):
+    schema_path = tmp_path / "schema.json"
+    with mock.patch("fia_auth.experiments.ALLOCATIONS_SCHEMA_CACHE", str(schema_path)):
+        first_transport = LocalSchemaTransport({})
+        client = AllocationsClient("https://allocations.test", "key", transport=first_transport)
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            asyncio.run(get_experiments_for_user_number(1))
+        assert "__schema" in json.loads(schema_path.read_text())
+
+        EXPERIMENTS_CACHE.cache.clear()
+        with mock.patch("fia_auth.experiments._SCHEMA_INTROSPECTION", None):
+            second_transport = LocalSchemaTransport({})
+            client = AllocationsClient("https://allocations.test", "key", transport=second_transport)
+            with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+                asyncio.run(get_experiments_for_user_number(1))
+
+    assert len(second_transport.requests) == 1
+
+
+def test_get_experiments_for_user_number_raises_on_transport_error():
+    client = AllocationsClient("https://allocations.test", "key", transport=FailingTransport({}))
+
+    with (
+        mock.patch("fia_auth.experiments.get_allocations_client", return_value=client),
+        pytest.raises(ProposalAllocationsError),
+    ):
+        asyncio.run(get_experiments_for_user_number(1))
+
+
+def test_get_experiments_for_user_numbers_chunks_aliased_queries():
+    transport = LocalSchemaTransport(
+        {"1": [{"referenceNumber": "100"}], "2": [{"referenceNumber": "200"}, {"referenceNumber": "201"}]}
+    )
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    with (
+        mock.patch("fia_auth.experiments.get_allocations_client", return_value=client),
+        mock.patch("fia_auth.experiments.EXPERIMENTS_BATCH_CHUNK_SIZE", 2),
+    ):
+        result = asyncio.run(get_experiments_for_user_numbers([1, 2, 3, 1]))
+
+    assert result == {1: [100], 2: [200, 201], 3: []}
+    # one introspection query followed by one query per chunk of two users
+    assert len(transport.requests) == 3  # noqa: PLR2004
+    assert transport.requests[1].variable_values == {"u0": "1", "u1": "2"}
+    assert transport.requests[2].variable_values == {"u0": "3"}
+
+
+def test_get_experiments_for_user_numbers_uses_and_fills_cache():
+    EXPERIMENTS_CACHE.cache.set(1, [100])
+    transport = LocalSchemaTransport({"2": [{"referenceNumber": "200"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            batch = await get_experiments_for_user_numbers([1, 2])
+            return batch, await get_experiments_for_user_number(2)
+
+    assert asyncio.run(run()) == ({1: [100], 2: [200]}, [200])
+    assert transport.requests[-1].variable_values == {"u0": "2"}
+
+
+def test_experiments_are_shared_through_shared_cache(fake_redis):
+    transport = LocalSchemaTransport({"1": [{"referenceNumber": "100"}], "2": [{"referenceNumber": "200"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            first = await get_experiments_for_user_number(1)
+            # Another worker has its own in-process cache, but finds user 1 in the shared cache
+            EXPERIMENTS_CACHE.cache.clear()
+            batch = await get_experiments_for_user_numbers([1, 2])
+            EXPERIMENTS_CACHE.cache.clear()
+            return first, batch, await get_experiments_for_user_number(2)
+
+    with mock.patch.object(EXPERIMENTS_SHARED_CACHE, "_backend", RedisCacheBackend(fake_redis)):
+        assert asyncio.run(run()) == ([100], {1: [100], 2: [200]}, [200])
+
+    # one introspection query, then one query for user 1 and one batch query for user 2 only
+    assert [request.variable_values for request in transport.requests[1:]] == [{"userNumber": "1"}, {"u0": "2"}]
+    assert ("MGET", "fia-auth:experiments:1", "fia-auth:experiments:2") in fake_redis.commands
+
+
+def test_get_experiments_for_user_numbers_raises_on_transport_error():
+    client = AllocationsClient("https://allocations.test", "key", transport=FailingTransport({}))
+
+    with (
+        mock.patch("fia_auth.experiments.get_allocations_client", return_value=client),
+        pytest.raises(ProposalAllocationsError),
+    ):
+        asyncio.run(get_experiments_for_user_numbers([1, 2]))
+
+
+def test_open_allocations_circuit_fails_fast():
+    failed_queries = []
+
+    class CountingFailingTransport(FailingTransport):
+        async def execute(self, request, *args, **kwargs):
+            if request.variable_values:
+                failed_queries.append(request)
+            return await super().execute(request, *args, **kwargs)
+
+    client = AllocationsClient("https://allocations.test", "key", transport=CountingFailingTransport({}))
+    client.guard.breaker.minimum_calls = 2
+
+    with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+        for user_number in range(3):
+            with pytest.raises(ProposalAllocationsError):
+                asyncio.run(get_experiments_for_user_number(user_number))
+
+    assert len(failed_queries) == 2  # noqa: PLR2004
+    assert client.guard.breaker.state is CircuitState.OPEN
+
+
+def test_concurrent_lookups_share_one_allocations_query():
+    transport = LocalSchemaTransport({"1234": [{"referenceNumber": "2200087"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        return await asyncio.gather(*(get_experiments_for_user_number(1234) for _ in range(3)))
+
+    with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+        assert asyncio.run(run()) == [[2200087], [2200087], [2200087]]
+
+    # one introspection query followed by a single proposals query
+    assert len(transport.requests) == 2  # noqa: PLR2004
+
+
+ALL_PROPOSALS = {
+    None: [
+        {"referenceNumber": "100", "members": [{"userNumber": "1"}, {"userNumber": "2"}]},
+        {"referenceNumber": "200", "members": [{"userNumber": "2"}]},
+        {"referenceNumber": "300", "members": None},
+    ]
+}
+
+
+def test_experiments_index_answers_until_too_old():
+    now = datetime(2024, 1, 1, tzinfo=UTC)
+    clock = mock.Mock(return_value=now.timestamp())
+    index = ExperimentsIndex(max_age_seconds=60, clock=clock)
+    assert index.get(1) is None
+
+    index.replace({1: (100, 200)}, now)
+
+    assert index.get(1) == [100, 200]
+    assert index.get(2) is None
+    assert len(index) == 1
+    clock.return_value += 61
+    assert index.get(1) is None
+    assert index.snapshot() == {"users": 1, "synced_at": "2024-01-01T00:00:00+00:00", "age_seconds": 61}
+
+
+@contextlib.contextmanager
+def _index_sync(client, synced_at=None, persisted=None):
+    store = mock.Mock()
+    with (
+        mock.patch("fia_auth.experiments.get_allocations_client", return_value=client),
+        mock.patch("fia_auth.experiments.experiments_index_synced_at", return_value=synced_at),
+        mock.patch("fia_auth.experiments.load_experiments_index", return_value=persisted),
+        mock.patch("fia_auth.experiments.store_experiments_index", store),
+    ):
+        yield store
+
+
+def test_sync_experiments_index_builds_inverted_index_and_persists_it():
+    client = AllocationsClient("https://allocations.test", "key", transport=LocalSchemaTransport(ALL_PROPOSALS))
+    with _index_sync(client) as store:
+        assert asyncio.run(sync_experiments_index())
+        assert not asyncio.run(sync_experiments_index())
+
+    assert EXPERIMENTS_INDEX.get(1) == [100]
+    assert EXPERIMENTS_INDEX.get(2) == [100, 200]
+    store.assert_called_once_with({1: (100,), 2: (100, 200)}, EXPERIMENTS_INDEX.synced_at)
+
+
+def test_sync_experiments_index_loads_recent_index_from_database():
+    synced_at = datetime.now(UTC) - timedelta(minutes=5)
+    client = mock.Mock()
+    with _index_sync(client, synced_at, ({1: (100,)}, synced_at)) as store:
+        assert asyncio.run(sync_experiments_index())
+        assert not asyncio.run(sync_experiments_index())
+
+    assert EXPERIMENTS_INDEX.get(1) == [100]
+    assert EXPERIMENTS_INDEX.synced_at == synced_at
+    client.execute.assert_not_called()
+    store.assert_not_called()
+
+
+def test_sync_experiments_index_refetches_old_persisted_index():
+    synced_at = datetime.now(UTC) - timedelta(hours=2)
+    client = AllocationsClient("https://allocations.test", "key", transport=LocalSchemaTransport(ALL_PROPOSALS))
+    with _index_sync(client, synced_at, ({1: (999,)}, synced_at)) as store:
+        assert asyncio.run(sync_experiments_index(sync_seconds=3600))
+
+    assert EXPERIMENTS_INDEX.get(1) == [100]
+    store.assert_called_once()
+
+
+def test_sync_experiments_index_swaps_in_memory_when_database_is_down():
+    client = AllocationsClient("https://allocations.test", "key", transport=LocalSchemaTransport(ALL_PROPOSALS))
+
+    with (
+        mock.patch("fia_auth.experiments.get_allocations_client", return_value=client),
+        mock.patch("fia_auth.experiments.experiments_index_synced_at", side_effect=ConnectionError),
+        mock.patch("fia_auth.experiments.store_experiments_index", side_effect=ConnectionError),
+    ):
+        assert asyncio.run(sync_experiments_index())
+
+    assert EXPERIMENTS_INDEX.get(2) == [100, 200]
+
+
+def test_sync_experiments_index_keeps_previous_index_on_allocations_error():
+    EXPERIMENTS_INDEX.replace({1: (100,)}, datetime.now(UTC) - timedelta(hours=2))
+    client = mock.Mock(execute=mock.AsyncMock(side_effect=TransportServerError("Service Unavailable", 503)))
+    with _index_sync(client), pytest.raises(ProposalAllocationsError):
+        asyncio.run(sync_experiments_index())
+
+    assert EXPERIMENTS_INDEX.get(1) == [100]
+
+
+def test_experiments_are_answered_from_index_before_allocations_api():
+    EXPERIMENTS_INDEX.replace({1: (100,)}, datetime.now(UTC))
+    transport = LocalSchemaTransport({"2": [{"referenceNumber": "200"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        return (
+            await get_experiments_for_user_number(1),
+            await get_experiments_for_user_number(2),
+            await get_experiments_for_user_numbers([1, 2]),
+        )
+
+    with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+        assert asyncio.run(run()) == ([100], [200], {1: [100], 2: [200]})
+
+    assert all(request.variable_values != {"userNumber": "1"} for request in transport.requests)
+
+
+def _many_proposals(user_number, count):
+    return {str(user_number): [{"referenceNumber": str(1000 + index)} for index in range(count)]}
+
+
+def test_experiments_cursor_round_trips():
+    assert decode_experiments_cursor(encode_experiments_cursor(0)) == 0
+    assert decode_experiments_cursor(encode_experiments_cursor(12345)) == 12345  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_experiments_cursor(1)[:-1] + "x", "b2Zmc2V0Oi0x"])
+def test_invalid_experiments_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_experiments_cursor(cursor)
+
+
+def test_get_experiments_page_fetches_only_the_page():
+    transport = LocalSchemaTransport(_many_proposals(1234, 5))
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            return [
+                await get_experiments_page(1234, 0, 2),
+                await get_experiments_page(1234, 2, 2),
+                await get_experiments_page(1234, 4, 2),
+            ]
+
+    assert asyncio.run(run()) == [([1000, 1001], 2), ([1002, 1003], 4), ([1004], None)]
+    # one more than the page is asked for, to know whether another page follows
+    assert transport.requests[1].variable_values == {"userNumber": "1234", "offset": 0, "limit": 3}
+    assert len(EXPERIMENTS_CACHE.cache) == 0
+
+
+def test_queries_invalid_for_schema_raise_without_opening_circuit():
+    transport = OldSchemaTransport({"1234": [{"referenceNumber": "2200087"}]})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+    client.guard.breaker.minimum_calls = 2
+
+    with _index_sync(client):
+        for _ in range(3):
+            with pytest.raises(ProposalAllocationsError):
+                asyncio.run(get_experiments_page(1234, 0, 2))
+            with pytest.raises(ProposalAllocationsError):
+                asyncio.run(sync_experiments_index())
+        assert asyncio.run(get_experiments_for_user_number(1234)) == [2200087]
+
+    assert client.guard.breaker.state is CircuitState.CLOSED
+    # only the introspection query and the valid query were sent
+    assert len(transport.requests) == 2  # noqa: PLR2004
+
+
+def test_get_experiments_page_is_sliced_from_cache():
+    EXPERIMENTS_CACHE.cache.set(1234, [1, 2, 3, 4])
+    transport = LocalSchemaTransport({})
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            return await get_experiments_page(1234, 1, 2), await get_experiments_page(1234, 2, 2)
+
+    assert asyncio.run(run()) == (([2, 3], 3), ([3, 4], None))
+    assert transport.requests == []
+
+
+def test_iter_experiments_fetches_pages_as_they_are_consumed():
+    transport = LocalSchemaTransport(_many_proposals(1234, 5))
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            pages = iter_experiments_for_user_number(1234, page_size=2)
+            first = await anext(pages)
+            requests_after_first = len(transport.requests)
+            return first, requests_after_first, [page async for page in pages]
+
+    first, requests_after_first, rest = asyncio.run(run())
+
+    assert first == [1000, 1001]
+    # introspection and the first page only
+    assert requests_after_first == 2  # noqa: PLR2004
+    assert rest == [[1002, 1003], [1004]]
+    assert [request.variable_values["offset"] for request in transport.requests[1:]] == [0, 2, 4]
+
+
+def test_iter_experiments_stops_after_full_last_page():
+    transport = LocalSchemaTransport(_many_proposals(1234, 4))
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            return [page async for page in iter_experiments_for_user_number(1234, offset=1, page_size=3)]
+
+    assert asyncio.run(run()) == [[1001, 1002, 1003]]
+    assert [request.variable_values["offset"] for request in transport.requests[1:]] == [1, 4]
+
+
+def test_iter_experiments_uses_cache():
+    EXPERIMENTS_CACHE.cache.set(1234, [3, 1, 2])
+
+    async def run():
+        return [page async for page in iter_experiments_for_user_number(1234, offset=1, page_size=1)]
+
+    assert asyncio.run(run()) == [[1], [2]]
+
+
+def test_experiments_pages_follow_allocations_api_order_whichever_source_answers():
+    # The index is sorted by RB number, the allocations API and the cache are not
+    proposals = {"1234": [{"referenceNumber": str(number)} for number in (1003, 1001, 1004, 1000, 1002)]}
+    EXPERIMENTS_INDEX.replace({1234: (1000, 1001, 1002, 1003, 1004)}, datetime.now(UTC))
+    transport = LocalSchemaTransport(proposals)
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def run():
+        with mock.patch("fia_auth.experiments.get_allocations_client", return_value=client):
+            first, offset = await get_experiments_page(1234, 0, 2)
+            # Another request caches the user's experiments between pages
+            EXPERIMENTS_CACHE.cache.set(1234, [1003, 1001, 1004, 1000, 1002])
+            second, offset = await get_experiments_page(1234, offset, 2)
+            EXPERIMENTS_CACHE.cache.clear()
+            third, offset = await get_experiments_page(1234, offset, 2)
+            return first + second + third, offset
+
+    assert asyncio.run(run()) == ([1003, 1001, 1004, 1000, 1002], None)
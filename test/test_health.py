@@ -0,0 +1,102 @@
+# ruff: noqa: D100, D103
+import asyncio
+from http import HTTPStatus
+from unittest import mock
+
+import httpx
+import pytest
+
+from fia_auth.health import HealthCheck, HealthMonitor
+from fia_auth.uows import UOWSClient
+
+
+async def _passes():
+    pass
+
+
+async def _fails():
+    raise ConnectionError("refused")
+
+
+async def _hangs():
+    await asyncio.sleep(10)
+
+
+def _monitor(clock, **checks):
+    return HealthMonitor(checks, timeout_seconds=0.01, max_age_seconds=60, clock=clock)
+
+
+def test_not_ready_until_checked():
+    monitor = _monitor(mock.Mock(return_value=0.0), postgres=HealthCheck(_passes, required=True))
+
+    assert not monitor.ready
+    assert monitor.report()["dependencies"]["postgres"]["error"] == "Not checked yet"
+
+    asyncio.run(monitor.check_all())
+
+    assert monitor.ready
+
+
+def test_optional_dependencies_do_not_affect_readiness(caplog):
+    monitor = _monitor(
+        mock.Mock(return_value=0.0),
+        postgres=HealthCheck(_passes, required=True),
+        uows=HealthCheck(_fails, required=False),
+    )
+
+    asyncio.run(monitor.check_all())
+
+    assert monitor.ready
+    report = monitor.report()
+    assert report["dependencies"]["uows"]["healthy"] is False
+    # The message may name hosts and ports, so it is only logged
+    assert report["dependencies"]["uows"]["error"] == "ConnectionError"
+    assert "ConnectionError: refused" in caplog.text
+
+
+@pytest.mark.parametrize("check", [_fails, _hangs])
+def test_failed_or_slow_required_dependency_is_not_ready(check):
+    monitor = _monitor(mock.Mock(return_value=0.0), postgres=HealthCheck(check, required=True))
+
+    asyncio.run(monitor.check_all())
+
+    assert not monitor.ready
+    assert monitor.report()["dependencies"]["postgres"]["healthy"] is False
+
+
+def test_old_checks_do_not_count_as_ready():
+    clock = mock.Mock(return_value=0.0)
+    monitor = _monitor(clock, postgres=HealthCheck(_passes, required=True))
+    asyncio.run(monitor.check_all())
+
+    clock.return_value = 61.0
+
+    assert not monitor.ready
+    assert monitor.report()["dependencies"]["postgres"]["checked_age_seconds"] == 61.0  # noqa: PLR2004
+
+
+def test_report_does_not_run_checks():
+    check = mock.AsyncMock()
+    monitor = _monitor(mock.Mock(return_value=0.0), postgres=HealthCheck(check, required=True))
+    asyncio.run(monitor.check_all())
+
+    for _ in range(10):
+        monitor.report()
+        assert monitor.ready
+
+    check.assert_awaited_once()
+
+
+@pytest.mark.parametrize(
+    ("status_code", "reachable"),
+    [(HTTPStatus.OK, True), (HTTPStatus.NOT_FOUND, True), (HTTPStatus.SERVICE_UNAVAILABLE, False)],
+)
+def test_uows_ping(status_code, reachable):
+    transport = httpx.MockTransport(lambda _: httpx.Response(status_code))
+    client = UOWSClient("https://uows.test", "key", transport=transport)
+
+    if reachable:
+        asyncio.run(client.ping())
+    else:
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(client.ping())
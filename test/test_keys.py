@@ -0,0 +1,223 @@
+# ruff: noqa: D100, D103
+import asyncio
+import json
+import os
+from datetime import UTC, datetime, timedelta
+from unittest.mock import patch
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+from fia_auth.exceptions import BadJWTSignatureError
+from fia_auth.keys import (
+    KeyRing,
+    get_key_ring,
+    jwks,
+    load_key_ring_file,
+    load_signing_key,
+    reload_key_ring_if_changed,
+)
+from fia_auth.tokens import AccessToken, RefreshToken
+
+
+def _pem(private_key):
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+@pytest.fixture(scope="module")
+def rsa_pem():
+    return _pem(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+
+
+@pytest.fixture(scope="module")
+def ed25519_pem():
+    return _pem(ed25519.Ed25519PrivateKey.generate())
+
+
+@pytest.mark.parametrize("secret", ["", None])
+def test_hs256_key_requires_secret(secret):
+    with pytest.raises(ValueError, match="non-empty secret"):
+        load_signing_key("HS256", secret=secret)
+
+
+def test_hs256_key_is_not_published():
+    signing_key = load_signing_key("HS256", secret="secret")  # noqa: S106
+
+    assert signing_key.signing_key == b"secret"
+    assert jwks(KeyRing(signing_key)) == {"keys": []}
+
+
+@pytest.mark.parametrize(
+    ("algorithm", "pem_fixture", "kty"), [("RS256", "rsa_pem", "RSA"), ("EdDSA", "ed25519_pem", "OKP")]
+)
+def test_asymmetric_tokens_verify_against_published_jwks(algorithm, pem_fixture, kty, request):
+    signing_key = load_signing_key(algorithm, private_key_pem=request.getfixturevalue(pem_fixture))
+
+    with patch("fia_auth.keys._KEY_RING", KeyRing(signing_key)):
+        access_token = AccessToken(payload={"usernumber": 1234})
+        access_token.verify()
+        RefreshToken(jwt_token=RefreshToken().jwt).verify()
+
+    (jwk,) = jwks(KeyRing(signing_key))["keys"]
+    assert jwk["kty"] == kty
+    assert jwk["alg"] == algorithm
+    assert jwk["use"] == "sig"
+    assert "d" not in jwk
+    public_key = jwt.PyJWK(jwk).key
+    assert jwt.decode(access_token.jwt, public_key, algorithms=[algorithm])["usernumber"] == 1234  # noqa: PLR2004
+
+
+def test_private_key_can_be_loaded_from_file(tmp_path, ed25519_pem):
+    key_file = tmp_path / "key.pem"
+    key_file.write_text(ed25519_pem)
+
+    signing_key = load_signing_key("EdDSA", private_key_pem=None, private_key_file=str(key_file))
+
+    assert signing_key.public_jwk["crv"] == "Ed25519"
+
+
+def test_kid_is_stable_thumbprint(rsa_pem):
+    first = load_signing_key("RS256", private_key_pem=rsa_pem)
+    second = load_signing_key("RS256", private_key_pem=rsa_pem)
+
+    assert first.public_jwk["kid"] == second.public_jwk["kid"]
+
+
+def test_key_must_match_algorithm(rsa_pem):
+    with pytest.raises(ValueError, match="cannot be used with EdDSA"):
+        load_signing_key("EdDSA", private_key_pem=rsa_pem)
+
+
+def test_asymmetric_algorithm_requires_key():
+    with pytest.raises(ValueError, match="requires JWT_PRIVATE_KEY"):
+        load_signing_key("RS256", private_key_pem=None, private_key_file=None)
+
+
+def test_unsupported_algorithm():
+    with pytest.raises(ValueError, match="Unsupported"):
+        load_signing_key("none")
+
+
+def test_token_signed_by_other_asymmetric_key_is_rejected(rsa_pem):
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    token = jwt.encode({"exp": datetime.now(UTC) + timedelta(minutes=1)}, other_key, algorithm="RS256")
+
+    with (
+        patch("fia_auth.keys._KEY_RING", KeyRing(load_signing_key("RS256", private_key_pem=rsa_pem))),
+        pytest.raises(BadJWTSignatureError),
+    ):
+        AccessToken(jwt_token=token)
+
+
+def _write_key_ring(path, active, keys):
+    path.write_text(json.dumps({"active": active, "keys": keys}))
+
+
+def test_tokens_signed_by_retired_key_still_verify():
+    old_key = load_signing_key(secret="old-secret", kid="old")  # noqa: S106
+    new_key = load_signing_key(secret="new-secret", kid="new")  # noqa: S106
+    with patch("fia_auth.keys._KEY_RING", KeyRing(old_key)):
+        old_token = AccessToken(payload={"usernumber": 1234})
+
+    with patch("fia_auth.keys._KEY_RING", KeyRing(new_key, (old_key,))):
+        access_token = AccessToken(jwt_token=old_token.jwt)
+        access_token.verify()
+        asyncio.run(access_token.refresh())
+
+    assert jwt.get_unverified_header(old_token.jwt)["kid"] == "old"
+    assert jwt.get_unverified_header(access_token.jwt)["kid"] == "new"
+
+
+def test_token_with_unknown_kid_is_rejected():
+    token = jwt.encode(
+        {"exp": datetime.now(UTC) + timedelta(minutes=1)}, "shh", algorithm="HS256", headers={"kid": "unknown"}
+    )
+
+    with pytest.raises(BadJWTSignatureError):
+        AccessToken(jwt_token=token)
+
+
+def test_key_ring_requires_active_key_to_sign(rsa_pem):
+    public_pem = (
+        serialization.load_pem_private_key(rsa_pem.encode(), password=None)
+        .public_key()
+        .public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+        .decode()
+    )
+    verification_only = load_signing_key("RS256", private_key_pem=None, public_key_pem=public_pem)
+
+    assert verification_only.kid == load_signing_key("RS256", private_key_pem=rsa_pem).kid
+    with pytest.raises(ValueError, match="cannot sign"):
+        KeyRing(verification_only)
+    assert len(jwks(KeyRing(load_signing_key(), (verification_only,)))["keys"]) == 1
+
+
+def test_key_ring_file_is_reloaded_when_changed(tmp_path, ed25519_pem):
+    key_ring_file = tmp_path / "keys.json"
+    _write_key_ring(key_ring_file, "a", [{"kid": "a", "algorithm": "HS256", "secret": "first"}])
+
+    with (
+        patch("fia_auth.keys.JWT_KEYRING_FILE", str(key_ring_file)),
+        patch("fia_auth.keys._KEY_RING", load_key_ring_file(str(key_ring_file))),
+        patch("fia_auth.keys._key_ring_mtime", key_ring_file.stat().st_mtime),
+    ):
+        assert not reload_key_ring_if_changed()
+
+        _write_key_ring(
+            key_ring_file,
+            "b",
+            [
+                {"kid": "a", "algorithm": "HS256", "secret": "first"},
+                {"kid": "b", "algorithm": "EdDSA", "private_key": ed25519_pem},
+            ],
+        )
+        os.utime(key_ring_file, (0, 0))
+        assert reload_key_ring_if_changed()
+
+        key_ring = get_key_ring()
+        assert key_ring.active.kid == "b"
+        assert len(key_ring) == 2  # noqa: PLR2004
+        assert [jwk["kid"] for jwk in jwks(key_ring)["keys"]] == ["b"]
+
+        key_ring_file.write_text("not json")
+        os.utime(key_ring_file, (1, 1))
+        assert not reload_key_ring_if_changed()
+        assert get_key_ring() is key_ring
+
+
+def test_key_ring_file_active_key_must_exist(tmp_path):
+    key_ring_file = tmp_path / "keys.json"
+    _write_key_ring(key_ring_file, "missing", [{"kid": "a", "algorithm": "HS256", "secret": "first"}])
+
+    with pytest.raises(ValueError, match="not in the key ring"):
+        load_key_ring_file(str(key_ring_file))
+
+
+@pytest.mark.parametrize("spec", [{"secert": "typo"}, {"secret": ""}])
+def test_key_ring_file_hs256_keys_require_secret(tmp_path, spec):
+    key_ring_file = tmp_path / "keys.json"
+    _write_key_ring(key_ring_file, "a", [{"kid": "a", "algorithm": "HS256", **spec}])
+
+    with pytest.raises(ValueError, match="has no secret"):
+        load_key_ring_file(str(key_ring_file))
+
+
+def test_key_ring_without_secret_keeps_current_keys_on_reload(tmp_path):
+    key_ring_file = tmp_path / "keys.json"
+    _write_key_ring(key_ring_file, "a", [{"kid": "a", "algorithm": "HS256", "secret": "first"}])
+
+    with (
+        patch("fia_auth.keys.JWT_KEYRING_FILE", str(key_ring_file)),
+        patch("fia_auth.keys._KEY_RING", load_key_ring_file(str(key_ring_file))),
+        patch("fia_auth.keys._key_ring_mtime", key_ring_file.stat().st_mtime),
+    ):
+        key_ring = get_key_ring()
+        _write_key_ring(key_ring_file, "b", [{"kid": "b", "algorithm": "HS256", "secert": "second"}])
+        os.utime(key_ring_file, (0, 0))
+
+        assert not reload_key_ring_if_changed()
+        assert get_key_ring() is key_ring
@@ -0,0 +1,108 @@
+# ruff: noqa: D100, D103
+import json
+import logging
+import threading
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+
+from fia_auth.logs import JSONFormatter, configure_logging, stop_logging
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    stop_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def _log_lines(path):
+    return path.read_text(encoding="utf-8").splitlines()
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_records_are_written_by_listener_thread(tmp_path):
+    written_by = []
+
+    class RecordingHandler(logging.Handler):
+        def emit(self, _):
+            written_by.append(threading.current_thread())
+
+    listener = configure_logging(log_file=str(tmp_path / "fia-auth.log"))
+    listener.handlers = (*listener.handlers, RecordingHandler())
+
+    logging.getLogger("fia_auth.test").info("hello %s", "world")
+    stop_logging()
+
+    assert written_by
+    assert threading.current_thread() not in written_by
+    assert _log_lines(tmp_path / "fia-auth.log")[0].endswith("-fia_auth.test-INFO: hello world")
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_json_format(tmp_path):
+    configure_logging(log_format="json", log_file=str(tmp_path / "fia-auth.log"))
+
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        logging.getLogger("fia_auth.test").exception("failed for user %s", 1234)
+    stop_logging()
+
+    entry = json.loads(_log_lines(tmp_path / "fia-auth.log")[0])
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "fia_auth.test"
+    assert entry["message"] == "failed for user 1234"
+    assert "ValueError: broken" in entry["exception"]
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_json_format_includes_trace_context(tmp_path):
+    configure_logging(log_format="json", log_file=str(tmp_path / "fia-auth.log"))
+
+    with TracerProvider().get_tracer("test").start_as_current_span("test") as span:
+        logging.getLogger("fia_auth.test").warning("inside span")
+    stop_logging()
+
+    entry = json.loads(_log_lines(tmp_path / "fia-auth.log")[0])
+    assert entry["trace_id"] == f"{span.get_span_context().trace_id:032x}"
+    assert entry["span_id"] == f"{span.get_span_context().span_id:016x}"
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_log_file_rotates_by_size(tmp_path):
+    configure_logging(log_file=str(tmp_path / "fia-auth.log"), max_bytes=200, backup_count=2)
+
+    for index in range(20):
+        logging.getLogger("fia_auth.test").info("message number %s", index)
+    stop_logging()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["fia-auth.log", "fia-auth.log.1", "fia-auth.log.2"]
+
+
+@pytest.mark.usefixtures("restore_logging")
+def test_level_is_respected(tmp_path):
+    configure_logging(level="WARNING", log_file=str(tmp_path / "fia-auth.log"))
+
+    logging.getLogger("fia_auth.test").info("hidden")
+    logging.getLogger("fia_auth.test").warning("shown")
+    stop_logging()
+
+    assert [line.rsplit(": ", 1)[1] for line in _log_lines(tmp_path / "fia-auth.log")] == ["shown"]
+
+
+def test_unsupported_format():
+    with pytest.raises(ValueError, match="LOG_FORMAT"):
+        configure_logging(log_format="xml")
+
+
+def test_json_formatter_without_queue():
+    record = logging.LogRecord("fia_auth.test", logging.INFO, __file__, 1, "value %s", (1,), None)
+
+    assert json.loads(JSONFormatter().format(record))["message"] == "value 1"
@@ -0,0 +1,63 @@
+# ruff: noqa: D100, D103
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from fia_auth.metrics import MetricsMiddleware, track_upstream
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_track_upstream_records_latency():
+    labels = {"upstream": "test", "operation": "succeeds"}
+    before = _sample("fia_auth_upstream_duration_seconds_count", **labels)
+
+    with track_upstream("test", "succeeds"):
+        assert _sample("fia_auth_upstream_in_flight", **labels) == 1
+
+    assert _sample("fia_auth_upstream_duration_seconds_count", **labels) == before + 1
+    assert _sample("fia_auth_upstream_in_flight", **labels) == 0
+    assert _sample("fia_auth_upstream_errors_total", **labels) == 0
+
+
+def test_track_upstream_counts_errors():
+    labels = {"upstream": "test", "operation": "fails"}
+    before = _sample("fia_auth_upstream_errors_total", **labels)
+
+    with pytest.raises(ConnectionError), track_upstream("test", "fails"):
+        raise ConnectionError
+
+    assert _sample("fia_auth_upstream_errors_total", **labels) == before + 1
+    assert _sample("fia_auth_upstream_in_flight", **labels) == 0
+
+
+def test_track_upstream_in_async_code():
+    async def call():
+        with track_upstream("test", "async"):
+            await asyncio.sleep(0)
+
+    asyncio.run(call())
+
+    assert _sample("fia_auth_upstream_duration_seconds_count", upstream="test", operation="async") >= 1
+
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int) -> int:
+        return item_id
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/missing")
+
+    assert _sample("fia_auth_request_duration_seconds_count", method="GET", route="/items/{item_id}", status="200") >= 2  # noqa: PLR2004
+    assert _sample("fia_auth_request_duration_seconds_count", method="GET", route="unmatched", status="404") >= 1
@@ -1,5 +1,6 @@
 """Model Tests"""
 
+import asyncio
 from unittest.mock import MagicMock, patch
 
 from fia_auth.model import Role, User
@@ -13,7 +14,7 @@ def test_role_is_user(mock_is_staff_user, mock_is_instrument_scientist):
     mock_is_instrument_scientist.return_value = False
 
     user = User(user_number=1234, username=MagicMock())
-    assert user.role == Role.USER
+    assert asyncio.run(user.get_role()) == Role.USER
 
 
 @patch("fia_auth.model.is_staff_user")
@@ -24,7 +25,7 @@ def test_role_is_staff_in_db(mock_is_staff_user, mock_is_instrument_scientist):
     mock_is_instrument_scientist.return_value = False
 
     user = User(user_number=1234, username=MagicMock())
-    assert user.role == Role.STAFF
+    assert asyncio.run(user.get_role()) == Role.STAFF
 
 
 @patch("fia_auth.model.is_staff_user")
@@ -35,7 +36,7 @@ def test_role_is_staff_in_db_and_inst_scientist(mock_is_staff_user, mock_is_inst
     mock_is_instrument_scientist.return_value = True
 
     user = User(user_number=1234, username=MagicMock())
-    assert user.role == Role.STAFF
+    assert asyncio.run(user.get_role()) == Role.STAFF
 
 
 @patch("fia_auth.model.is_staff_user")
@@ -46,4 +47,4 @@ def test_role_is_staff_inst_scientist(mock_is_staff_user, mock_is_instrument_sci
     mock_is_instrument_scientist.return_value = True
 
     user = User(user_number=1234, username=MagicMock())
-    assert user.role == Role.STAFF
+    assert asyncio.run(user.get_role()) == Role.STAFF
@@ -0,0 +1,280 @@
+# ruff: noqa: D100, D101, D102, D103, D107
+import asyncio
+from http import HTTPStatus
+from unittest import mock
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from fia_auth.auth import authenticate
+from fia_auth.exceptions import UOWSError, UpstreamUnavailableError
+from fia_auth.model import UserCredentials
+from fia_auth.resilience import Bulkhead, CircuitBreaker, CircuitState
+from fia_auth.roles import ROLE_CACHE, is_instrument_scientist
+from fia_auth.uows import UOWSClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _succeed():
+    return "ok"
+
+
+async def _fail():
+    raise ConnectionError
+
+
+def _breaker(clock, **kwargs):
+    options = {
+        "failure_rate": 0.5,
+        "slow_call_rate": 0.5,
+        "slow_call_seconds": 1,
+        "minimum_calls": 4,
+        "window_seconds": 10,
+        "open_seconds": 30,
+        "clock": clock,
+    }
+    return CircuitBreaker("test", **(options | kwargs))
+
+
+def _call(breaker, operation, **kwargs):
+    return asyncio.run(breaker.call(operation, **kwargs))
+
+
+def _trip(breaker):
+    for _ in range(breaker.minimum_calls):
+        with pytest.raises(ConnectionError):
+            _call(breaker, _fail)
+
+
+def test_breaker_stays_closed_below_minimum_calls():
+    breaker = _breaker(FakeClock())
+
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            _call(breaker, _fail)
+
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_breaker_opens_at_failure_rate_and_rejects_calls():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    operation = mock.AsyncMock()
+    _call(breaker, _succeed)
+    _call(breaker, _succeed)
+    with pytest.raises(ConnectionError):
+        _call(breaker, _fail)
+    assert breaker.state is CircuitState.CLOSED
+
+    with pytest.raises(ConnectionError):
+        _call(breaker, _fail)
+
+    assert breaker.state is CircuitState.OPEN
+    clock.now += 10
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        _call(breaker, operation)
+    operation.assert_not_called()
+    assert exc_info.value.retry_after_seconds == 20  # noqa: PLR2004
+
+
+def test_breaker_counts_failed_results():
+    breaker = _breaker(FakeClock())
+
+    for _ in range(4):
+        assert _call(breaker, _succeed, is_failure=lambda result: result == "ok") == "ok"
+
+    assert breaker.state is CircuitState.OPEN
+
+
+def test_breaker_opens_on_slow_calls():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+
+    async def slow():
+        clock.now += 2
+        return "ok"
+
+    for _ in range(4):
+        _call(breaker, slow)
+
+    assert breaker.state is CircuitState.OPEN
+
+
+def test_breaker_forgets_outcomes_outside_window():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            _call(breaker, _fail)
+
+    clock.now += 11
+    _call(breaker, _succeed)
+    _call(breaker, _succeed)
+    _call(breaker, _succeed)
+    _call(breaker, _succeed)
+
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_breaker_closes_after_successful_probe():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    _trip(breaker)
+
+    clock.now += 30
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert _call(breaker, _succeed) == "ok"
+
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_breaker_reopens_after_failed_probe():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    _trip(breaker)
+
+    clock.now += 30
+    with pytest.raises(ConnectionError):
+        _call(breaker, _fail)
+
+    assert breaker.state is CircuitState.OPEN
+    clock.now += 29
+    assert breaker.state is CircuitState.OPEN
+
+
+def test_breaker_lets_one_probe_through_at_a_time():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    _trip(breaker)
+    clock.now += 30
+
+    async def run():
+        release = asyncio.Event()
+
+        async def probe():
+            await release.wait()
+            return "ok"
+
+        probe_task = asyncio.create_task(breaker.call(probe))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamUnavailableError):
+            await breaker.call(_succeed)
+        release.set()
+        return await probe_task
+
+    assert asyncio.run(run()) == "ok"
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_breaker_reports_state_and_rejections():
+    clock = FakeClock()
+    breaker = CircuitBreaker("metrics_test", minimum_calls=1, clock=clock)
+    before = REGISTRY.get_sample_value(
+        "fia_auth_upstream_rejections_total", {"upstream": "metrics_test", "reason": "circuit_open"}
+    )
+
+    with pytest.raises(ConnectionError):
+        _call(breaker, _fail)
+    with pytest.raises(UpstreamUnavailableError):
+        _call(breaker, _succeed)
+
+    assert REGISTRY.get_sample_value("fia_auth_circuit_breaker_state", {"upstream": "metrics_test"}) == 2  # noqa: PLR2004
+    assert (
+        REGISTRY.get_sample_value(
+            "fia_auth_upstream_rejections_total", {"upstream": "metrics_test", "reason": "circuit_open"}
+        )
+        == (before or 0) + 1
+    )
+
+
+def test_bulkhead_rejects_calls_over_limit():
+    bulkhead = Bulkhead("test", max_concurrent=2, max_wait_seconds=0.01)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+            return "ok"
+
+        held = [asyncio.create_task(bulkhead.call(hold)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert bulkhead.in_use == 2  # noqa: PLR2004
+        with pytest.raises(UpstreamUnavailableError):
+            await bulkhead.call(_succeed)
+        release.set()
+        results = await asyncio.gather(*held)
+        assert bulkhead.in_use == 0
+        return [*results, await bulkhead.call(_succeed)]
+
+    assert asyncio.run(run()) == ["ok", "ok", "ok"]
+
+
+def test_bulkhead_waits_for_a_free_slot():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_wait_seconds=1)
+
+    async def run():
+        async def hold():
+            await asyncio.sleep(0.01)
+            return "first"
+
+        first = asyncio.create_task(bulkhead.call(hold))
+        await asyncio.sleep(0)
+        return await bulkhead.call(_succeed), await first
+
+    assert asyncio.run(run()) == ("ok", "first")
+
+
+def test_bulkhead_releases_slot_on_error():
+    bulkhead = Bulkhead("test", max_concurrent=1, max_wait_seconds=0)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(bulkhead.call(_fail))
+
+    assert bulkhead.in_use == 0
+    assert asyncio.run(bulkhead.call(_succeed)) == "ok"
+
+
+def _failing_uows_client(requests):
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(HTTPStatus.SERVICE_UNAVAILABLE)
+
+    client = UOWSClient("https://uows.test", "key", transport=httpx.MockTransport(handler))
+    client.guard.breaker.minimum_calls = 2
+    return client
+
+
+def test_open_uows_circuit_fails_login_fast():
+    requests = []
+    client = _failing_uows_client(requests)
+    credentials = UserCredentials(username="user", password="password")  # noqa: S106
+
+    with mock.patch("fia_auth.auth.get_uows_client", return_value=client):
+        for _ in range(3):
+            with pytest.raises(UOWSError):
+                asyncio.run(authenticate(credentials))
+
+    assert len(requests) == 2  # noqa: PLR2004
+    assert client.guard.breaker.state is CircuitState.OPEN
+
+
+def test_open_uows_circuit_is_not_cached_as_role():
+    ROLE_CACHE.clear()
+    requests = []
+    client = _failing_uows_client(requests)
+
+    with mock.patch("fia_auth.roles.get_uows_client", return_value=client):
+        for _ in range(3):
+            assert asyncio.run(is_instrument_scientist(1234)) is False
+
+    assert len(requests) == 2  # noqa: PLR2004
+    assert ROLE_CACHE.get(1234) is None
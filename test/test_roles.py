@@ -1,71 +1,178 @@
 # ruff: noqa: D100, D103
-import os
+import asyncio
 import random
 from http import HTTPStatus
 from unittest import mock
 
-from fia_auth.roles import is_instrument_scientist
+import httpx
+import pytest
 
+from fia_auth.roles import ROLE_CACHE, ROLE_SHARED_CACHE, invalidate_role, is_instrument_scientist
+from fia_auth.shared_cache import CACHE_LOCAL_COPY_TTL_SECONDS, RedisCacheBackend
+from fia_auth.uows import UOWSClient
 
-@mock.patch("fia_auth.roles.requests")
-def test_is_instrument_scientist_true(requests):
-    uows_url = str(mock.MagicMock())
-    uows_api_key = str(mock.MagicMock())
-    os.environ["UOWS_URL"] = uows_url
-    os.environ["UOWS_API_KEY"] = uows_api_key
+
+@pytest.fixture(autouse=True)
+def _clear_role_cache():
+    ROLE_CACHE.clear()
+
+
+def _uows_client(handler):
+    return UOWSClient("https://uows.test/users-service", "uows_api_key", transport=httpx.MockTransport(handler))
+
+
+def _role_handler(requests, status_code, roles=None):
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(status_code, json=roles)
+
+    return handler
+
+
+def _assert_role_request(requests, user_number):
+    (request,) = requests
+    assert str(request.url) == f"https://uows.test/users-service/v1/role/{user_number}"
+    assert request.headers["Authorization"] == "Api-key uows_api_key"
+    assert request.headers["accept"] == "application/json"
+
+
+def test_is_instrument_scientist_true():
     user_number = random.randint(0, 100000)  # noqa: S311
-    requests.get.return_value.status_code = HTTPStatus.OK
-    requests.get.return_value.json.return_value = [{"name": "ISIS Instrument Scientist"}]
+    requests = []
+    client = _uows_client(_role_handler(requests, HTTPStatus.OK, [{"name": "ISIS Instrument Scientist"}]))
 
-    result = is_instrument_scientist(user_number)
+    with mock.patch("fia_auth.roles.get_uows_client", return_value=client):
+        result = asyncio.run(is_instrument_scientist(user_number))
 
-    requests.get.assert_called_once_with(
-        url=f"{uows_url}/v1/role/{user_number}",
-        headers={"Authorization": f"Api-key {uows_api_key}", "accept": "application/json"},
-        timeout=5,
-    )
+    _assert_role_request(requests, user_number)
     assert result
-    os.environ.pop("UOWS_URL")
-    os.environ.pop("UOWS_API_KEY")
 
 
-@mock.patch("fia_auth.roles.requests")
-def test_is_instrument_scientist_false(requests):
-    uows_url = str(mock.MagicMock())
-    uows_api_key = str(mock.MagicMock())
-    os.environ["UOWS_URL"] = uows_url
-    os.environ["UOWS_API_KEY"] = uows_api_key
+def test_is_instrument_scientist_false():
     user_number = random.randint(0, 100000)  # noqa: S311
-    requests.get.return_value.status_code = HTTPStatus.OK
-    requests.get.return_value.json.return_value = [{"name": "Not ISIS Instrument Scientist"}]
+    requests = []
+    client = _uows_client(_role_handler(requests, HTTPStatus.OK, [{"name": "Not ISIS Instrument Scientist"}]))
 
-    result = is_instrument_scientist(user_number)
+    with mock.patch("fia_auth.roles.get_uows_client", return_value=client):
+        result = asyncio.run(is_instrument_scientist(user_number))
 
-    requests.get.assert_called_once_with(
-        url=f"{uows_url}/v1/role/{user_number}",
-        headers={"Authorization": f"Api-key {uows_api_key}", "accept": "application/json"},
-        timeout=5,
-    )
+    _assert_role_request(requests, user_number)
     assert not result
-    os.environ.pop("UOWS_URL")
-    os.environ.pop("UOWS_API_KEY")
 
 
-@mock.patch("fia_auth.roles.requests")
-def test_is_instrument_scientist_false_when_forbidden(requests):
-    uows_url = str(mock.MagicMock())
-    uows_api_key = str(mock.MagicMock())
-    os.environ["UOWS_URL"] = uows_url
-    os.environ["UOWS_API_KEY"] = uows_api_key
+def test_is_instrument_scientist_false_when_forbidden():
     user_number = random.randint(0, 100000)  # noqa: S311
-    requests.get.return_value.status_code = HTTPStatus.FORBIDDEN
-    result = is_instrument_scientist(user_number)
-
-    requests.get.assert_called_once_with(
-        url=f"{uows_url}/v1/role/{user_number}",
-        headers={"Authorization": f"Api-key {uows_api_key}", "accept": "application/json"},
-        timeout=5,
-    )
+    requests = []
+    client = _uows_client(_role_handler(requests, HTTPStatus.FORBIDDEN))
+
+    with mock.patch("fia_auth.roles.get_uows_client", return_value=client):
+        result = asyncio.run(is_instrument_scientist(user_number))
+
+    _assert_role_request(requests, user_number)
     assert not result
-    os.environ.pop("UOWS_URL")
-    os.environ.pop("UOWS_API_KEY")
+
+
+def test_is_instrument_scientist_false_when_uows_unreachable():
+    def handler(request):
+        raise httpx.ConnectError("unreachable", request=request)
+
+    with mock.patch("fia_auth.roles.get_uows_client", return_value=_uows_client(handler)):
+        assert not asyncio.run(is_instrument_scientist(1234))
+
+
+@pytest.mark.parametrize(
+    ("status_code", "roles", "expected", "ttl"),
+    [
+        (HTTPStatus.OK, [{"name": "ISIS Instrument Scientist"}], True, 3600),
+        (HTTPStatus.OK, [], False, 300),
+        (HTTPStatus.NOT_FOUND, None, False, 300),
+    ],
+)
+def test_is_instrument_scientist_caches_definitive_results(status_code, roles, expected, ttl):
+    requests = []
+    client = _uows_client(_role_handler(requests, status_code, roles))
+
+    async def run():
+        with (
+            mock.patch("fia_auth.roles.get_uows_client", return_value=client),
+            mock.patch.object(ROLE_CACHE, "set", wraps=ROLE_CACHE.set) as cache_set,
+        ):
+            results = [await is_instrument_scientist(1234), await is_instrument_scientist(1234)]
+            cache_set.assert_called_once_with(1234, expected, ttl_seconds=ttl)
+            return results
+
+    assert asyncio.run(run()) == [expected, expected]
+    assert len(requests) == 1
+
+
+def test_is_instrument_scientist_does_not_cache_uows_errors():
+    requests = []
+    client = _uows_client(_role_handler(requests, HTTPStatus.SERVICE_UNAVAILABLE))
+
+    async def run():
+        with mock.patch("fia_auth.roles.get_uows_client", return_value=client):
+            return [await is_instrument_scientist(1234), await is_instrument_scientist(1234)]
+
+    assert asyncio.run(run()) == [False, False]
+    assert len(requests) == 2  # noqa: PLR2004
+
+
+def test_invalidate_role():
+    ROLE_CACHE.set(1234, True)
+
+    assert asyncio.run(invalidate_role(1234))
+    assert not asyncio.run(invalidate_role(1234))
+    assert ROLE_CACHE.get(1234) is None
+
+
+def test_roles_are_shared_through_shared_cache(fake_redis):
+    requests = []
+    client = _uows_client(_role_handler(requests, HTTPStatus.OK, [{"name": "ISIS Instrument Scientist"}]))
+
+    with (
+        mock.patch.object(ROLE_SHARED_CACHE, "_backend", RedisCacheBackend(fake_redis)),
+        mock.patch("fia_auth.roles.get_uows_client", return_value=client),
+    ):
+        assert asyncio.run(is_instrument_scientist(1234))
+        # Another worker has its own in-process cache, but finds the role in the shared cache
+        ROLE_CACHE.clear()
+        assert asyncio.run(is_instrument_scientist(1234))
+        assert ROLE_CACHE.get(1234)
+
+        assert asyncio.run(invalidate_role(1234))
+        ROLE_CACHE.clear()
+        assert asyncio.run(is_instrument_scientist(1234))
+
+    assert len(requests) == 2  # noqa: PLR2004
+
+
+def test_roles_fetched_with_shared_cache_are_kept_locally_briefly(fake_redis):
+    client = _uows_client(_role_handler([], HTTPStatus.OK, [{"name": "ISIS Instrument Scientist"}]))
+
+    with (
+        mock.patch.object(ROLE_SHARED_CACHE, "_backend", RedisCacheBackend(fake_redis)),
+        mock.patch("fia_auth.roles.get_uows_client", return_value=client),
+        mock.patch.object(ROLE_CACHE, "set", wraps=ROLE_CACHE.set) as cache_set,
+        mock.patch.object(ROLE_SHARED_CACHE, "set", wraps=ROLE_SHARED_CACHE.set) as shared_set,
+    ):
+        assert asyncio.run(is_instrument_scientist(1234))
+
+    cache_set.assert_called_once_with(1234, True, ttl_seconds=CACHE_LOCAL_COPY_TTL_SECONDS)
+    shared_set.assert_called_once_with(1234, True, ttl_seconds=3600)
+
+
+def test_concurrent_role_checks_share_one_uows_call():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(HTTPStatus.OK, json=[{"name": "ISIS Instrument Scientist"}])
+
+    async def run():
+        return await asyncio.gather(*(is_instrument_scientist(1234) for _ in range(3)))
+
+    with mock.patch("fia_auth.roles.get_uows_client", return_value=_uows_client(handler)):
+        assert asyncio.run(run()) == [True, True, True]
+
+    _assert_role_request(requests, 1234)
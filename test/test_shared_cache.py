@@ -0,0 +1,156 @@
+# ruff: noqa: D100, D101, D102, D103
+import asyncio
+from unittest import mock
+
+import pytest
+
+from fia_auth import shared_cache
+from fia_auth.shared_cache import (
+    CacheNamespace,
+    LocalCacheBackend,
+    RedisCacheBackend,
+    close_cache_backend,
+    get_cache_backend,
+)
+
+
+class FailingBackend(LocalCacheBackend):
+    async def get_many(self, keys):
+        raise ConnectionError("refused")
+
+    async def set_many(self, items, ttl_seconds):
+        raise ConnectionError("refused")
+
+    async def delete_many(self, keys):
+        raise ConnectionError("refused")
+
+
+@pytest.fixture(params=["local", "redis"])
+def backend(request, fake_redis):
+    return LocalCacheBackend() if request.param == "local" else RedisCacheBackend(fake_redis)
+
+
+def test_namespace_round_trips_json_values(backend):
+    namespace = CacheNamespace("test", ttl_seconds=60, backend=backend)
+
+    async def run():
+        await namespace.set(1, [1, 2, 3])
+        await namespace.set("name", {"displayName": "Mr Cool"})
+        return await namespace.get(1), await namespace.get("name"), await namespace.get(2)
+
+    assert asyncio.run(run()) == ([1, 2, 3], {"displayName": "Mr Cool"}, None)
+
+
+def test_namespaces_do_not_share_keys(backend):
+    roles = CacheNamespace("roles", ttl_seconds=60, backend=backend)
+    experiments = CacheNamespace("experiments", ttl_seconds=60, backend=backend)
+
+    async def run():
+        await roles.set(1234, True)
+        return await experiments.get(1234)
+
+    assert asyncio.run(run()) is None
+    assert roles.key(1234) == "fia-auth:roles:1234"
+
+
+def test_bulk_get_returns_only_keys_found(backend):
+    namespace = CacheNamespace("test", ttl_seconds=60, backend=backend)
+
+    async def run():
+        await namespace.set_many({1: [10], 2: [], 3: [30, 31]})
+        return await namespace.get_many([1, 2, 4])
+
+    assert asyncio.run(run()) == {1: [10], 2: []}
+
+
+def test_entries_expire_after_their_ttl(backend):
+    namespace = CacheNamespace("test", ttl_seconds=60, backend=backend)
+
+    async def run():
+        await namespace.set(1, True, ttl_seconds=0.01)
+        await namespace.set(2, True)
+        await asyncio.sleep(0.02)
+        return await namespace.get_many([1, 2])
+
+    assert asyncio.run(run()) == {2: True}
+
+
+def test_delete(backend):
+    namespace = CacheNamespace("test", ttl_seconds=60, backend=backend)
+
+    async def run():
+        await namespace.set(1, True)
+        return await namespace.delete(1), await namespace.delete(1), await namespace.get(1)
+
+    assert asyncio.run(run()) == (True, False, None)
+
+
+def test_redis_bulk_operations_take_one_round_trip_each(fake_redis):
+    namespace = CacheNamespace("experiments", ttl_seconds=300, backend=RedisCacheBackend(fake_redis))
+
+    async def run():
+        await namespace.set_many({user_number: [user_number] for user_number in range(50)})
+        return await namespace.get_many(range(60))
+
+    assert len(asyncio.run(run())) == 50  # noqa: PLR2004
+    assert [command[0] for command in fake_redis.commands] == ["PIPELINE", "MGET"]
+    assert fake_redis.commands[0] == ("PIPELINE", 50)
+
+
+def test_redis_ttl_is_set_in_milliseconds(fake_redis):
+    pipelines = []
+    original = fake_redis.pipeline
+
+    def pipeline(transaction=True):
+        pipelines.append(original(transaction))
+        return pipelines[-1]
+
+    fake_redis.pipeline = pipeline
+
+    asyncio.run(RedisCacheBackend(fake_redis).set_many({"key": b"1"}, ttl_seconds=1.5))
+
+    (used,) = pipelines
+    assert not used.transaction
+    assert used.queued == [("key", b"1", 1500)]
+
+
+def test_backend_errors_are_treated_as_misses(caplog):
+    namespace = CacheNamespace("test", ttl_seconds=60, backend=FailingBackend())
+
+    async def run():
+        await namespace.set(1, True)
+        return await namespace.get(1), await namespace.get_many([1, 2]), await namespace.delete(1)
+
+    assert asyncio.run(run()) == (None, {}, False)
+    assert "Could not get test entries in the cache" in caplog.text
+
+
+def test_shared_reflects_the_backend(fake_redis):
+    assert not CacheNamespace("test", 60, backend=LocalCacheBackend()).shared
+    assert CacheNamespace("test", 60, backend=RedisCacheBackend(fake_redis)).shared
+
+
+def test_namespace_uses_configured_backend_by_default():
+    backend = LocalCacheBackend()
+
+    with mock.patch.object(shared_cache, "_BACKEND", backend):
+        assert CacheNamespace("test", 60).backend is backend
+
+
+def test_get_cache_backend_defaults_to_local_and_closes():
+    with mock.patch.object(shared_cache, "_BACKEND", None):
+        backend = get_cache_backend()
+        assert isinstance(backend, LocalCacheBackend)
+        assert get_cache_backend() is backend
+
+        asyncio.run(close_cache_backend())
+        assert shared_cache._BACKEND is None
+
+
+def test_unknown_backend_is_rejected():
+    with (
+        mock.patch.object(shared_cache, "_BACKEND", None),
+        mock.patch.object(shared_cache, "CACHE_BACKEND", "memcached"),
+        pytest.raises(ValueError, match="Unknown CACHE_BACKEND"),
+    ):
+        get_cache_backend()
@@ -0,0 +1,88 @@
+# ruff: noqa: D100, D103
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from fia_auth.singleflight import SingleFlight
+
+
+def test_concurrent_calls_for_same_key_share_one_call():
+    flights = SingleFlight("test_shared")
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["result"]
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", call) for _ in range(5)))
+
+    before = REGISTRY.get_sample_value("fia_auth_coalesced_calls_total", {"call": "test_shared"}) or 0
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert REGISTRY.get_sample_value("fia_auth_coalesced_calls_total", {"call": "test_shared"}) == before + 4
+    assert len(flights) == 0
+
+
+def test_concurrent_calls_for_different_keys_are_not_shared():
+    flights = SingleFlight("test")
+
+    async def call(key):
+        await asyncio.sleep(0.01)
+        return key
+
+    async def run():
+        return await asyncio.gather(*(flights.do(key, lambda key=key: call(key)) for key in (1, 2, 1)))
+
+    assert asyncio.run(run()) == [1, 2, 1]
+
+
+def test_concurrent_callers_receive_same_exception():
+    flights = SingleFlight("test")
+    error = ConnectionError("upstream down")
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise error
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", call) for _ in range(3)), return_exceptions=True)
+
+    assert asyncio.run(run()) == [error, error, error]
+
+
+def test_finished_calls_are_not_reused():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        return await flights.do("key", call), await flights.do("key", call)
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    flights = SingleFlight("test")
+
+    async def call():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def run():
+        first = asyncio.create_task(flights.do("key", call))
+        second = asyncio.create_task(flights.do("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
@@ -1,13 +1,38 @@
 # ruff: noqa: D100, D103
+import asyncio
+import hashlib
+import hmac
+import json
 from datetime import UTC, datetime, timedelta
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 import jwt
 import pytest
+from jwt.utils import base64url_encode
 
-from fia_auth.exceptions import BadJWTError
+from fia_auth import tokens
+from fia_auth.exceptions import BadJWTError, ExpiredJWTError, ProposalAllocationsError
+from fia_auth.keys import KeyRing, get_key_ring, load_signing_key
 from fia_auth.model import Role
-from fia_auth.tokens import AccessToken, RefreshToken, Token, generate_access_token
+from fia_auth.tokens import (
+    EXPERIMENTS_LOOKUP_REQUIRED,
+    VERIFIED_TOKEN_CACHE,
+    AccessToken,
+    HS256Codec,
+    RefreshToken,
+    Token,
+    TokenStatus,
+    check_access_token,
+    generate_access_token,
+    load_access_token,
+    token_fingerprint,
+    warm_up_signing,
+)
+
+
+@pytest.fixture(autouse=True)
+def _clear_verified_token_cache():
+    VERIFIED_TOKEN_CACHE.clear()
 
 
 @patch("jwt.decode")
@@ -37,7 +62,7 @@ def test_verify_invalid_signature(mock_logger, mock_decode):
 
     with pytest.raises(BadJWTError):
         token_instance.verify()
-    mock_logger.warning.assert_called_once_with("token has bad signature - %s", "bad_signature_jwt")
+    mock_logger.warning.assert_called_once_with("token has bad signature - %s", token_fingerprint("bad_signature_jwt"))
 
 
 @patch("jwt.decode")
@@ -49,7 +74,9 @@ def test_verify_expired_signature(mock_logger, mock_decode):
 
     with pytest.raises(BadJWTError):
         token_instance.verify()
-    mock_logger.warning.assert_called_once_with("token signature is expired - %s", "expired_jwt_token")
+    mock_logger.warning.assert_called_once_with(
+        "token signature is expired - %s", token_fingerprint("expired_jwt_token")
+    )
 
 
 @patch("jwt.decode")
@@ -61,7 +88,17 @@ def test_verify_invalid_token(mock_logger, mock_decode):
 
     with pytest.raises(BadJWTError):
         token_instance.verify()
-    mock_logger.warning.assert_called_once_with("Issue decoding token - %s", "invalid_jwt_token")
+    mock_logger.warning.assert_called_once_with("Issue decoding token - %s", token_fingerprint("invalid_jwt_token"))
+
+
+def test_token_fingerprint_does_not_reveal_token():
+    token = jwt.encode({"exp": 9999999999}, "shh", algorithm="HS256")
+
+    fingerprint = token_fingerprint(token)
+
+    assert len(fingerprint) == 12  # noqa: PLR2004
+    assert fingerprint not in token
+    assert fingerprint == token_fingerprint(token)
 
 
 @patch("jwt.decode")
@@ -77,19 +114,29 @@ def test_verify_general_exception(mock_logger, mock_decode):
     mock_logger.exception.assert_called_once_with("JWT verification Failed for unknown reason")
 
 
-@patch("fia_auth.tokens.datetime")
-@patch("jwt.encode")
-def test_access_token_with_payload(mock_encode, mock_datetime):
+def _frozen_clock(now):
+    """Patch the clock tokens are stamped with, keeping datetime a real type"""
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromtimestamp(now.timestamp(), tz)
+
+    return patch("fia_auth.tokens.datetime", FrozenDatetime)
+
+
+def test_access_token_with_payload():
     fixed_time = datetime(2021, 1, 1, 12, 0, 0, tzinfo=UTC)
-    mock_datetime.now.return_value = fixed_time
     payload = {"user": "test_user"}
 
-    AccessToken(payload=payload)
+    with _frozen_clock(fixed_time):
+        access_token = AccessToken(payload=payload)
 
-    mock_encode.assert_called_once_with(
+    assert access_token.jwt == jwt.encode(
         {"user": "test_user", "exp": fixed_time + timedelta(minutes=10)},
         b"shh",
         algorithm="HS256",
+        headers={"kid": get_key_ring().active.kid},
     )
 
 
@@ -116,31 +163,29 @@ def test_access_token_with_both_none():
         AccessToken()
 
 
-@patch("jwt.encode")
 @patch("jwt.decode")
-def test_access_token_refresh(mock_decode, mock_encode):
+def test_access_token_refresh(mock_decode):
     jwt_token = "valid.jwt.token"  # noqa: S105
     mock_decode.return_value = {"user": "test_user", "exp": datetime.now(UTC)}
     token = AccessToken(jwt_token=jwt_token)
 
-    token.refresh()
+    asyncio.run(token.refresh())
 
-    args, _ = mock_encode.call_args
-    assert args[0]["exp"] > datetime.now(UTC)  # checks if the expiration time is extended
+    assert token.jwt != jwt_token
+    assert token._payload["exp"] > datetime.now(UTC)  # checks if the expiration time is extended
 
 
-@patch("fia_auth.tokens.datetime")
-@patch("jwt.encode")
-def test_refresh_token_creation_no_jwt(mock_encode, mock_datetime):
+def test_refresh_token_creation_no_jwt():
     fixed_time = datetime(2021, 1, 1, 12, 0, 0, tzinfo=UTC)
-    mock_datetime.now.return_value = fixed_time
 
-    RefreshToken()
+    with _frozen_clock(fixed_time):
+        refresh_token = RefreshToken()
 
-    mock_encode.assert_called_once_with(
+    assert refresh_token.jwt == jwt.encode(
         {"exp": fixed_time + timedelta(hours=12)},
         b"shh",
         algorithm="HS256",
+        headers={"kid": get_key_ring().active.kid},
     )
 
 
@@ -168,16 +213,14 @@ def test_refresh_token_with_invalid_jwt(mock_decode):
         RefreshToken(jwt_token="invalid.jwt.token")  # noqa: S106
 
 
-@patch("fia_auth.tokens.datetime")
-def test_generate_access_token(mock_datetime):
+def test_generate_access_token():
     user = Mock()
     user.user_number = 12345
     user.username = "Mr Cool"
-    user.role = Role.USER
-    user.role = Role.USER
+    user.get_role = AsyncMock(return_value=Role.USER)
     fixed_time = datetime(2000, 12, 12, 12, 0, tzinfo=UTC)
-    mock_datetime.now.return_value = fixed_time
-    access_token = generate_access_token(user)
+    with _frozen_clock(fixed_time):
+        access_token = asyncio.run(generate_access_token(user))
 
     expected_payload = {
         "usernumber": 12345,
@@ -187,3 +230,274 @@ def test_generate_access_token(mock_datetime):
     }
 
     assert access_token._payload == expected_payload
+
+
+def _signed_token(exp_delta=timedelta(minutes=5), key="shh"):
+    return jwt.encode({"usernumber": 1234, "exp": datetime.now(UTC) + exp_delta}, key, algorithm="HS256")
+
+
+def test_verify_caches_verified_tokens():
+    token = _signed_token()
+    AccessToken(jwt_token=token).verify()
+
+    with patch("jwt.decode") as mock_decode:
+        access_token = AccessToken(jwt_token=token)
+        access_token.verify()
+
+    mock_decode.assert_not_called()
+    assert access_token._payload["usernumber"] == 1234  # noqa: PLR2004
+
+
+def test_loading_and_verifying_a_token_decodes_it_once():
+    token = AccessToken(payload={"usernumber": 1234}).jwt
+
+    with patch("fia_auth.tokens._decode", wraps=tokens._decode) as decode:
+        load_access_token(token).verify()
+
+    decode.assert_called_once_with(token, verify_exp=False)
+
+
+def test_verify_rejects_expired_loaded_token():
+    token = AccessToken(payload={"usernumber": 1234}).jwt
+    access_token = load_access_token(token)
+
+    with patch("fia_auth.tokens.time.time", return_value=4102444800), pytest.raises(ExpiredJWTError):
+        access_token.verify()
+
+
+def test_cached_payload_is_a_copy():
+    token = _signed_token()
+    access_token = AccessToken(jwt_token=token)
+    access_token.verify()
+    asyncio.run(access_token.refresh())
+
+    reloaded = AccessToken(jwt_token=token)
+    assert isinstance(reloaded._payload["exp"], int)
+
+
+def test_verify_cache_entry_expires_with_token():
+    token = _signed_token(exp_delta=timedelta(seconds=-1))
+
+    with pytest.raises(BadJWTError):
+        AccessToken(jwt_token=token).verify()
+    assert len(VERIFIED_TOKEN_CACHE) == 0
+
+
+def test_verify_does_not_cache_bad_tokens():
+    token = _signed_token(key="not-the-key")
+
+    with pytest.raises(BadJWTError):
+        Token.verify(Mock(jwt=token))
+    assert len(VERIFIED_TOKEN_CACHE) == 0
+
+
+def test_signing_key_change_invalidates_verified_tokens():
+    token = _signed_token()
+    AccessToken(jwt_token=token).verify()
+
+    new_key_ring = KeyRing(load_signing_key(secret="new-key"))  # noqa: S106
+    with patch("fia_auth.keys._KEY_RING", new_key_ring), pytest.raises(BadJWTError):
+        AccessToken(jwt_token=token).verify()
+
+
+@pytest.mark.parametrize(
+    ("token", "expected_status"),
+    [
+        (_signed_token(), TokenStatus.VALID),
+        (_signed_token(exp_delta=timedelta(minutes=-1)), TokenStatus.EXPIRED),
+        (_signed_token(key="not-the-key"), TokenStatus.BAD_SIGNATURE),
+        ("not.a.jwt", TokenStatus.MALFORMED),
+        (jwt.encode({"usernumber": 1234}, "shh", algorithm="HS256"), TokenStatus.MALFORMED),
+    ],
+)
+def test_check_access_token(token, expected_status):
+    status, claims = check_access_token(token)
+
+    assert status == expected_status
+    if expected_status == TokenStatus.VALID:
+        assert claims["usernumber"] == 1234  # noqa: PLR2004
+    else:
+        assert claims is None
+
+
+_CODEC_KEY = b"codec-secret"
+
+
+def _reference_encode(payload, kid="codec"):
+    return jwt.encode(payload, _CODEC_KEY, algorithm="HS256", headers={"kid": kid})
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"usernumber": 1234, "role": "user", "username": "Mr Cool", "exp": datetime(2030, 1, 1, tzinfo=UTC)},
+        {"usernumber": 1234, "role": "staff", "username": "Ms Ünïcode ✓", "exp": 1893456000},
+        {"exp": datetime(2030, 1, 1, 12, 30, 15, tzinfo=UTC)},
+    ],
+)
+def test_hs256_codec_matches_pyjwt(payload):
+    codec = HS256Codec("codec", _CODEC_KEY)
+
+    token = codec.encode(payload)
+
+    assert token == _reference_encode(payload)
+    assert codec.decode(token, verify_exp=False) == jwt.decode(
+        token, _CODEC_KEY, algorithms=["HS256"], options={"verify_exp": False}
+    )
+
+
+def _tamper(token):
+    header, payload, signature = token.split(".")
+    return f"{header}.{payload}.{'A' if signature[0] != 'A' else 'B'}{signature[1:]}"
+
+
+def _forged(claims):
+    header = _reference_encode({"exp": 1}).split(".")[0]
+    signing_input = f"{header}.{base64url_encode(json.dumps(claims).encode()).decode()}"
+    signature = base64url_encode(hmac.new(_CODEC_KEY, signing_input.encode(), hashlib.sha256).digest())
+    return f"{signing_input}.{signature.decode()}"
+
+
+@pytest.mark.parametrize(
+    ("token", "verify_exp"),
+    [
+        (_tamper(_reference_encode({"exp": 4102444800})), True),
+        (_reference_encode({"exp": 1}), True),
+        (_reference_encode({"usernumber": 1234}), True),
+        (_forged([1, 2]), True),
+        (_reference_encode({"exp": 4102444800}) + ".extra", True),
+        (_reference_encode({"exp": 4102444800})[:-1] + "!", True),
+        (_reference_encode({"exp": 4102444800}).rpartition(".")[0], True),
+        (_reference_encode({"exp": 4102444800}).split(".")[0] + ".", True),
+        (_forged({"exp": 4102444800, "sub": 1}), True),
+        (_forged({"exp": 4102444800, "jti": 1}), True),
+    ],
+)
+def test_hs256_codec_raises_pyjwt_errors(token, verify_exp):
+    def reference_decode():
+        return jwt.decode(
+            token,
+            _CODEC_KEY,
+            algorithms=["HS256"],
+            options={"require": ["exp"], "verify_exp": verify_exp},
+        )
+
+    with pytest.raises(jwt.InvalidTokenError) as reference:
+        reference_decode()
+
+    # The codec either raises the same error or leaves the token to PyJWT
+    with pytest.raises(jwt.InvalidTokenError) as codec:
+        HS256Codec("codec", _CODEC_KEY).decode(token, verify_exp=verify_exp) or reference_decode()
+    assert type(codec.value) is type(reference.value)
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        jwt.encode({"exp": 4102444800}, _CODEC_KEY, algorithm="HS256"),
+        _reference_encode({"exp": 4102444800}, kid="other"),
+        _reference_encode({"exp": 4102444800, "iat": 1}),
+        _forged({"exp": "4102444800"}),
+    ],
+)
+def test_hs256_codec_leaves_other_tokens_to_pyjwt(token):
+    assert HS256Codec("codec", _CODEC_KEY).decode(token) is None
+
+
+def test_hs256_codec_rejects_empty_key():
+    with pytest.raises(ValueError, match="HMAC key must not be empty"):
+        HS256Codec("codec", b"")
+
+
+def test_hs256_tokens_are_decoded_without_parsing_the_header():
+    retired = load_signing_key(secret="retired-key")  # noqa: S106
+    key_ring = KeyRing(load_signing_key(secret="active-key"), (retired,))  # noqa: S106
+    token = jwt.encode(
+        {"usernumber": 1234, "exp": datetime.now(UTC) + timedelta(minutes=5)},
+        "retired-key",
+        algorithm="HS256",
+        headers={"kid": retired.kid},
+    )
+
+    with (
+        patch("fia_auth.keys._KEY_RING", key_ring),
+        patch("fia_auth.tokens.jwt.get_unverified_header", side_effect=AssertionError) as get_header,
+    ):
+        status, claims = check_access_token(token)
+
+    assert status == TokenStatus.VALID
+    assert claims["usernumber"] == 1234  # noqa: PLR2004
+    get_header.assert_not_called()
+
+
+def test_tokens_without_kid_still_verify():
+    token = jwt.encode({"usernumber": 1234, "exp": datetime.now(UTC) + timedelta(minutes=5)}, "shh", algorithm="HS256")
+
+    access_token = AccessToken(jwt_token=token)
+    access_token.verify()
+
+    assert access_token.claims["usernumber"] == 1234  # noqa: PLR2004
+
+
+def _user(user_number=12345):
+    user = Mock()
+    user.user_number = user_number
+    user.username = "Mr Cool"
+    user.get_role = AsyncMock(return_value=Role.USER)
+    return user
+
+
+@patch("fia_auth.tokens.get_experiments_for_user_number", new_callable=AsyncMock)
+def test_generate_access_token_without_experiments_claim(mock_get_experiments):
+    access_token = asyncio.run(generate_access_token(_user()))
+
+    assert "experiments" not in access_token.claims
+    mock_get_experiments.assert_not_called()
+
+
+@patch("fia_auth.tokens.get_experiments_for_user_number", new_callable=AsyncMock)
+def test_generate_access_token_with_experiments_claim(mock_get_experiments):
+    mock_get_experiments.return_value = [3, 1, 2, 1]
+
+    access_token = asyncio.run(generate_access_token(_user(), include_experiments=True))
+
+    assert access_token.claims["experiments"] == [1, 2, 3]
+    mock_get_experiments.assert_awaited_once_with(12345)
+
+
+@patch("fia_auth.tokens.ACCESS_TOKEN_EXPERIMENTS_MAX", 2)
+@patch("fia_auth.tokens.get_experiments_for_user_number", new_callable=AsyncMock)
+def test_experiments_claim_over_cap_requires_lookup(mock_get_experiments):
+    mock_get_experiments.return_value = [1, 2, 3]
+
+    access_token = asyncio.run(generate_access_token(_user(), include_experiments=True))
+
+    assert access_token.claims["experiments"] == EXPERIMENTS_LOOKUP_REQUIRED
+
+
+@patch("fia_auth.tokens.get_experiments_for_user_number", new_callable=AsyncMock)
+def test_experiments_claim_requires_lookup_when_allocations_fails(mock_get_experiments):
+    mock_get_experiments.side_effect = ProposalAllocationsError()
+
+    access_token = asyncio.run(generate_access_token(_user(), include_experiments=True))
+
+    assert access_token.claims["experiments"] == EXPERIMENTS_LOOKUP_REQUIRED
+
+
+@patch("fia_auth.tokens.get_experiments_for_user_number", new_callable=AsyncMock)
+def test_refresh_resolves_experiments_claim_again(mock_get_experiments):
+    mock_get_experiments.return_value = [1]
+    access_token = asyncio.run(generate_access_token(_user(), include_experiments=True))
+    mock_get_experiments.return_value = [1, 2]
+
+    refreshed = AccessToken(jwt_token=access_token.jwt)
+    asyncio.run(refreshed.refresh())
+
+    refreshed.verify()
+    assert refreshed.claims["experiments"] == [1, 2]
+
+
+def test_warm_up_signing_does_not_touch_verified_token_cache():
+    warm_up_signing()
+
+    assert len(VERIFIED_TOKEN_CACHE) == 0
@@ -0,0 +1,151 @@
+# ruff: noqa: D100, D101, D102, D103, D107
+import asyncio
+import json
+from http import HTTPStatus
+from unittest import mock
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from gql import GraphQLRequest
+from gql.transport.async_transport import AsyncTransport
+from graphql import ExecutionResult
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from starlette.testclient import TestClient
+
+from fia_auth.auth import authenticate
+from fia_auth.experiments import PROPOSALS_FOR_USER_QUERY, AllocationsClient
+from fia_auth.model import UserCredentials
+from fia_auth.tracing import TRACER, FileSpanExporter, TracingMiddleware, configure_tracing
+from fia_auth.uows import UOWSClient
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+@pytest.fixture(scope="module")
+def span_exporter():
+    return configure_tracing("memory")
+
+
+@pytest.fixture(autouse=True)
+def _clear_spans(span_exporter):
+    span_exporter.clear()
+
+
+def _spans_by_name(span_exporter):
+    return {span.name: span for span in span_exporter.get_finished_spans()}
+
+
+def test_login_upstream_calls_are_child_spans_and_propagate_context(span_exporter):
+    received_traceparents = []
+
+    def handler(request):
+        received_traceparents.append(request.headers.get("traceparent"))
+        if request.url.path == "/v1/sessions":
+            return httpx.Response(HTTPStatus.CREATED, json={"userId": 1234})
+        return httpx.Response(HTTPStatus.OK, json=[{"displayName": "Mr Cool"}])
+
+    client = UOWSClient("https://uows.test", "key", transport=httpx.MockTransport(handler))
+    with mock.patch("fia_auth.auth.get_uows_client", return_value=client):
+        asyncio.run(authenticate(UserCredentials(username="foo", password="foo")))  # noqa: S106
+
+    spans = _spans_by_name(span_exporter)
+    authenticate_span = spans["auth.authenticate"]
+    for name in ("uows create_session", "uows basic_person_details"):
+        assert spans[name].parent.span_id == authenticate_span.context.span_id
+        assert spans[name].kind == trace.SpanKind.CLIENT
+    trace_id = format(authenticate_span.context.trace_id, "032x")
+    assert len(received_traceparents) == 2  # noqa: PLR2004
+    assert all(traceparent.split("-")[1] == trace_id for traceparent in received_traceparents)
+
+
+def test_failed_upstream_call_records_error(span_exporter):
+    def handler(_):
+        raise httpx.ConnectError("refused")
+
+    client = UOWSClient("https://uows.test", "key", transport=httpx.MockTransport(handler))
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(client.get_roles(1234))
+
+    span = _spans_by_name(span_exporter)["uows roles"]
+    assert span.status.status_code == trace.StatusCode.ERROR
+
+
+class RecordingTransport(AsyncTransport):
+    def __init__(self):
+        self.extra_args = []
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def execute(self, request, *_, extra_args=None, **__):
+        self.extra_args.append(extra_args)
+        return ExecutionResult(data={"proposals": []})
+
+    def subscribe(self, request):
+        raise NotImplementedError
+
+
+def test_allocations_requests_propagate_context(span_exporter):
+    transport = RecordingTransport()
+    client = AllocationsClient("https://allocations.test", "key", transport=transport)
+
+    async def execute():
+        with TRACER.start_as_current_span("parent"):
+            await client.execute(GraphQLRequest(PROPOSALS_FOR_USER_QUERY, variable_values={"userNumber": "1"}))
+
+    with mock.patch("fia_auth.experiments._SCHEMA_INTROSPECTION", {}):
+        asyncio.run(execute())
+
+    span = _spans_by_name(span_exporter)["allocations query"]
+    traceparent = transport.extra_args[0]["headers"]["traceparent"]
+    assert traceparent.split("-")[2] == format(span.context.span_id, "016x")
+
+
+def test_middleware_continues_incoming_trace(span_exporter):
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int) -> int:
+        return item_id
+
+    TestClient(app).get("/items/1", headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"})
+
+    span = _spans_by_name(span_exporter)["GET /items/{item_id}"]
+    assert format(span.context.trace_id, "032x") == TRACE_ID
+    assert span.kind == trace.SpanKind.SERVER
+    assert span.attributes["http.response.status_code"] == HTTPStatus.OK
+
+
+def test_file_exporter_writes_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(FileSpanExporter(str(path))))
+
+    with provider.get_tracer("test").start_as_current_span("first"):
+        pass
+    with provider.get_tracer("test").start_as_current_span("second"):
+        pass
+
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["first", "second"]
+
+
+def test_unsupported_exporter():
+    with pytest.raises(ValueError, match="Unsupported"):
+        configure_tracing("zipkin")
+
+
+def test_configuring_again_adds_exporter_to_installed_provider(span_exporter):
+    second_exporter = configure_tracing("memory")
+
+    with TRACER.start_as_current_span("configured twice"):
+        pass
+
+    assert "configured twice" in _spans_by_name(span_exporter)
+    assert "configured twice" in _spans_by_name(second_exporter)
@@ -0,0 +1,74 @@
+# ruff: noqa: D100, D103
+import asyncio
+from http import HTTPStatus
+from unittest import mock
+
+import httpx
+from prometheus_client import REGISTRY
+
+import fia_auth.uows
+from fia_auth.uows import UOWSClient, close_uows_client, get_uows_client
+
+
+def test_get_uows_client_returns_shared_client():
+    with mock.patch("fia_auth.uows._CLIENT", None):
+        client = get_uows_client()
+        assert isinstance(client, UOWSClient)
+        assert get_uows_client() is client
+        asyncio.run(close_uows_client())
+        assert fia_auth.uows._CLIENT is None
+
+
+def test_close_uows_client_when_not_opened():
+    with mock.patch("fia_auth.uows._CLIENT", None):
+        asyncio.run(close_uows_client())
+        assert fia_auth.uows._CLIENT is None
+
+
+def test_server_errors_are_counted_as_upstream_errors():
+    labels = {"upstream": "uows", "operation": "roles"}
+    before = REGISTRY.get_sample_value("fia_auth_upstream_errors_total", labels) or 0
+    client = UOWSClient(
+        "https://uows.test", "key", transport=httpx.MockTransport(lambda _: httpx.Response(HTTPStatus.BAD_GATEWAY))
+    )
+
+    response = asyncio.run(client.get_roles(1234))
+
+    assert response.status_code == HTTPStatus.BAD_GATEWAY
+    assert REGISTRY.get_sample_value("fia_auth_upstream_errors_total", labels) == before + 1
+
+
+def test_concurrent_person_details_calls_share_one_request():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(HTTPStatus.OK, json=[{"displayName": "Some User"}])
+
+    client = UOWSClient("https://uows.test", "key", transport=httpx.MockTransport(handler))
+
+    async def run():
+        return await asyncio.gather(*(client.get_basic_person_details(user_number) for user_number in (1, 1, 2)))
+
+    responses = asyncio.run(run())
+
+    assert len(requests) == 2  # noqa: PLR2004
+    assert responses[0] is responses[1]
+    assert responses[1].json() == [{"displayName": "Some User"}]
+
+
+def test_requests_without_api_key_leave_out_authorization():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(HTTPStatus.UNAUTHORIZED)
+
+    client = UOWSClient("https://uows.test", "", transport=httpx.MockTransport(handler))
+
+    async def run():
+        return await client.get_roles(1234), await client.get_basic_person_details(1234)
+
+    assert [response.status_code for response in asyncio.run(run())] == [HTTPStatus.UNAUTHORIZED] * 2
+    assert all("Authorization" not in request.headers for request in requests)
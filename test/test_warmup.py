@@ -0,0 +1,94 @@
+# ruff: noqa: D100, D103
+import asyncio
+from unittest import mock
+
+from fastapi import FastAPI
+
+from fia_auth.warmup import warm_up, warmup_steps
+
+
+async def _passes():
+    pass
+
+
+async def _fails():
+    raise ConnectionError("refused")
+
+
+async def _hangs():
+    await asyncio.sleep(10)
+
+
+def test_warm_up_times_each_step():
+    timings = asyncio.run(warm_up({"first": _passes, "second": _passes}))
+
+    assert set(timings) == {"first", "second"}
+    assert all(timing is not None and timing >= 0 for timing in timings.values())
+
+
+def test_warm_up_runs_steps_concurrently():
+    async def sleeps():
+        await asyncio.sleep(0.1)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await warm_up({"first": sleeps, "second": sleeps, "third": sleeps})
+        return loop.time() - start
+
+    assert asyncio.run(run()) < 0.25  # noqa: PLR2004
+
+
+def test_warm_up_continues_past_failed_step():
+    succeeded = mock.AsyncMock()
+
+    timings = asyncio.run(warm_up({"failing": _fails, "succeeding": succeeded}))
+
+    assert timings["failing"] is None
+    assert timings["succeeding"] is not None
+    succeeded.assert_awaited_once()
+
+
+def test_warm_up_cancels_steps_still_running_at_timeout():
+    cancelled = asyncio.Event()
+
+    async def hangs():
+        try:
+            await _hangs()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def run():
+        timings = await warm_up({"hanging": hangs, "quick": _passes}, timeout_seconds=0.05)
+        await asyncio.sleep(0)
+        return timings
+
+    timings = asyncio.run(run())
+
+    assert timings["hanging"] is None
+    assert timings["quick"] is not None
+    assert cancelled.is_set()
+
+
+def test_routes_step_serves_a_request_in_process():
+    app = FastAPI()
+    requests = []
+
+    @app.get("/healthz")
+    def healthz():
+        requests.append("/healthz")
+        return "ok"
+
+    timings = asyncio.run(warm_up({"routes": warmup_steps(app)["routes"]}))
+
+    assert timings["routes"] is not None
+    assert requests == ["/healthz"]
+
+
+def test_signing_step_signs_and_verifies_a_token():
+    with mock.patch("fia_auth.warmup.warm_up_signing") as warm_up_signing:
+        timings = asyncio.run(warm_up({"signing": warmup_steps(FastAPI())["signing"]}))
+
+    assert timings["signing"] is not None
+    warm_up_signing.assert_called_once()